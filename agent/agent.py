@@ -1,14 +1,29 @@
 import os
 
 from dotenv import load_dotenv
-from fastmcp import Client
 
 from google.adk.agents.llm_agent import LlmAgent
 from google.adk.tools import google_search
 
+from retrieval.telemetry import setup_tracing, start_metrics_server
+
+from .mcp_pool import MCPClientPool
+
 load_dotenv()
 model = os.getenv("MODEL")
 MCP_SEVER_URL = os.getenv("MCP_SEVER_URL")
+MCP_POOL_SIZE = int(os.getenv("MCP_POOL_SIZE", "4"))            # MCPサーバーへの同時接続数の上限
+MCP_TOOLS_CACHE_TTL = float(os.getenv("MCP_TOOLS_CACHE_TTL", "300"))  # ツール一覧をキャッシュする秒数
+AGENT_METRICS_PORT = int(os.getenv("AGENT_METRICS_PORT", "9464"))    # /metrics を公開するポート。0 で公開しない
+
+# TRACING が設定されている場合、ADK の LLM 呼び出しと MCP ツール呼び出しの span が同じトレースに記録される
+setup_tracing("agent")
+# adk web のサーバーには /metrics を追加できないため、別のポートで公開する
+if AGENT_METRICS_PORT:
+    start_metrics_server(AGENT_METRICS_PORT)
+
+# MCPサーバーへの接続はエージェントの呼び出しをまたいで使い回す
+mcp_pool = MCPClientPool(f"{MCP_SEVER_URL}/mcp", size=MCP_POOL_SIZE, tools_ttl=MCP_TOOLS_CACHE_TTL)
 
 async def get_tools():
     """
@@ -20,10 +35,8 @@ async def get_tools():
     戻り値:
         dict:
     """
-    async with Client(f"{MCP_SEVER_URL}/mcp") as client:
-        # ツール一覧を確認
-        tools = await client.list_tools()
-        return tools
+    # ツール一覧はキャッシュされ、MCPサーバーから変更が通知された場合に取り直される
+    return await mcp_pool.list_tools()
 
 async def call_tools(tool_name: str, args: dict)->dict:
     """
@@ -40,10 +53,7 @@ async def call_tools(tool_name: str, args: dict)->dict:
     戻り値:
         dict:各Toolが返す辞書
     """
-    async with Client(f"{MCP_SEVER_URL}/mcp") as client:
-        # ツール一覧を確認
-        result = await client.call_tool(tool_name, args)
-        return result
+    return await mcp_pool.call_tool(tool_name, args)
 
 mcp_client_agent = LlmAgent(
     name = "mcp_client_agent",
@@ -81,6 +91,7 @@ orchestrator_agent = LlmAgent(
         "あなたは、ユーザーからのリクエストに応じて各種sub_agentを利用して回答の材料となる情報を取得し、最終的な回答を行うアシスタントです。"
         "まず、質問が与えられたら、get_tool_agentでMCPサーバーのツールのメタ情報を取得し、どのようなツールが使えそうかを確認してください。"
         "その後に、mcp_client_agentを使ってデータベースからユーザーの質問に応じた情報を取得します。"
+        "検索すべきインデックスが1つに決まらない場合は、インデックスごとに検索を繰り返さず、search_manyツールで複数のインデックスをまとめて検索してください。"
         "そしてその情報を元にしてあなたが最終的な回答を生成してユーザーに返してください。"
     ),
     sub_agents = [mcp_client_agent, get_tool_agent]
@@ -0,0 +1,156 @@
+"""
+MCP サーバーへの接続を使い回すクライアントプール。
+
+ツールを呼び出すたびに fastmcp.Client で接続し直すと、HTTP セッションの確立と MCP の initialize を毎回行うことになるため、
+接続済みのクライアントを最大 size 個まで保持して、エージェントの呼び出しをまたいで共有します。
+接続が切れていた場合は新しく接続し直して1回だけ再試行します。
+ツール一覧は tools_ttl 秒間キャッシュし、サーバーからツール一覧の変更通知を受け取った場合はすぐに取り直します。
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from fastmcp import Client
+from fastmcp.exceptions import ToolError
+from mcp.types import ToolListChangedNotification
+
+from retrieval.telemetry import AGENT_TOOL_SECONDS, MCP_CONNECT_SECONDS, trace_headers
+
+logger = logging.getLogger(__name__)
+
+
+class MCPClientPool:
+    def __init__(self, url: str, size: int = 4, tools_ttl: float = 300):
+        self.url = url
+        self.size = size
+        self.tools_ttl = tools_ttl
+        self._loop = None
+        self._idle = []         # 接続済みで未使用のクライアント
+        self._open = 0          # 接続済み（使用中を含む）のクライアント数
+        self._available = None  # 接続数が size に達している場合に空きを待つための Condition
+        self._tools = None
+        self._tools_fetched_at = 0.0
+
+    def _bind_loop(self):
+        """
+        asyncio の接続はイベントループに結び付くため、別のループから使われた場合は保持している接続を破棄します。
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._idle = []
+            self._open = 0
+            self._available = asyncio.Condition()
+
+    async def _on_message(self, message):
+        if isinstance(getattr(message, "root", None), ToolListChangedNotification):
+            self.invalidate_tools()
+
+    async def _connect(self) -> Client:
+        client = Client(self.url, message_handler=self._on_message)
+        with MCP_CONNECT_SECONDS.time():
+            await client.__aenter__()
+        return client
+
+    async def _discard(self, client: Client):
+        try:
+            await client.__aexit__(None, None, None)
+        except Exception as e:
+            logger.debug("Failed to close MCP client: %s", e)
+
+    async def _acquire(self) -> Client:
+        async with self._available:
+            while not self._idle and self._open >= self.size:
+                await self._available.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._open += 1
+        try:
+            return await self._connect()
+        except Exception:
+            async with self._available:
+                self._open -= 1
+                self._available.notify()
+            raise
+
+    async def _release(self, client: Client, broken: bool = False):
+        if broken:
+            await self._discard(client)
+        async with self._available:
+            if broken:
+                self._open -= 1
+            else:
+                self._idle.append(client)
+            self._available.notify()
+
+    @asynccontextmanager
+    async def session(self):
+        """
+        プールから接続済みのクライアントを1つ借ります。ブロック内でツールのエラー以外の例外が起きた場合、
+        その接続は壊れているとみなして破棄します。
+        """
+        self._bind_loop()
+        client = await self._acquire()
+        try:
+            yield client
+        except ToolError:
+            await self._release(client)
+            raise
+        except BaseException:
+            await self._release(client, broken=True)
+            raise
+        else:
+            await self._release(client)
+
+    async def call_tool(self, name: str, args: dict):
+        """
+        ツールを呼び出します。接続の待ち・再接続を含めた所要時間をツールごとに記録します。
+        トレースが有効な場合は trace context (traceparent / tracestate) をリクエストの _meta に入れて MCP サーバーへ引き継ぎます。
+        """
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await self._call_tool(name, args)
+            status = "ok"
+            return result
+        finally:
+            AGENT_TOOL_SECONDS.observe(time.perf_counter() - started, tool=name, status=status)
+
+    async def _call_tool(self, name: str, args: dict):
+        meta = trace_headers() or None
+        try:
+            async with self.session() as client:
+                return await client.call_tool(name, args, meta=meta)
+        except ToolError:
+            raise
+        except Exception as e:
+            # サーバーの再起動などで接続が切れていた場合は、接続し直して1回だけ再試行する
+            logger.warning("MCP call '%s' failed, reconnecting: %s", name, e)
+            async with self.session() as client:
+                return await client.call_tool(name, args, meta=meta)
+
+    async def list_tools(self):
+        expired = self.tools_ttl > 0 and time.time() - self._tools_fetched_at > self.tools_ttl
+        if self._tools is None or expired:
+            try:
+                async with self.session() as client:
+                    tools = await client.list_tools()
+            except Exception as e:
+                logger.warning("MCP list_tools failed, reconnecting: %s", e)
+                async with self.session() as client:
+                    tools = await client.list_tools()
+            self._tools = tools
+            self._tools_fetched_at = time.time()
+        return self._tools
+
+    def invalidate_tools(self):
+        self._tools = None
+
+    async def close(self):
+        if self._loop is not asyncio.get_running_loop():
+            return
+        idle, self._idle = self._idle, []
+        for client in idle:
+            await self._discard(client)
+        self._open -= len(idle)
@@ -0,0 +1,130 @@
+"""
+チャンク分割方式の比較。
+
+同じコーパスを従来の文字数による分割 (chars) と、文境界 + トークン数による分割 (tokens) でチャンク化し、
+以下を比較します。
+- 分割処理のスループット（chunks/s, MB/s。tokens はトークナイズを含む）
+- モデルの入力長を超えて切り捨てられるチャンクの割合
+- 文が途中で切られずにいずれかのチャンクに収まっている割合
+- 検索のヒット率（質問に対する上位 k 件のチャンクに、答えの文がそのまま含まれている割合）
+
+ヒット率の計測では全チャンクを実際のモデルで埋め込み、NumPy の全件コサイン類似度で検索します（Elasticsearch は使いません）。
+
+実行例:
+    python benchmarks/chunking.py --docs 50 --chunk-size 500 --top-k 3
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.ingest_throughput import WORDS
+from benchmarks.stub_es import start_stub_es
+
+ENTITIES = "Aurora Borealis Cobalt Delta Ember Falcon Glacier Harbor Iris Juniper Kestrel Lumen".split()
+ATTRIBUTES = [("launch year", "開始年"), ("budget", "予算"), ("owner", "担当者"), ("location", "拠点")]
+VALUES = "Tokyo Osaka Sapporo Fukuoka Nagoya Kyoto Sendai Kobe Yokohama Naha".split()
+
+
+def make_corpus(n_docs: int, sentences_per_doc: int, seed: int = 0):
+    """
+    説明文の中に「事実」の文を散りばめた文書と、その事実を問う質問を生成します。
+
+    Returns:
+        tuple: (文書のリスト, (質問, 答えの文) のリスト)
+    """
+    rng = random.Random(seed)
+    docs = []
+    facts = []
+    for d in range(n_docs):
+        sentences = []
+        for s in range(sentences_per_doc):
+            if s % 6 == 5:
+                entity = f"{rng.choice(ENTITIES)} {rng.choice(ENTITIES)} {d}-{s}"
+                attr_en, attr_ja = rng.choice(ATTRIBUTES)
+                value = f"{rng.choice(VALUES)} {rng.randint(1, 999)}"
+                if rng.random() < 0.5:
+                    sentence = f"The {attr_en} of {entity} is {value}."
+                    query = f"What is the {attr_en} of {entity}?"
+                else:
+                    sentence = f"{entity}の{attr_ja}は{value}です。"
+                    query = f"{entity}の{attr_ja}は何ですか"
+                facts.append((query, sentence))
+            else:
+                words = [rng.choice(WORDS) for _ in range(rng.randint(8, 24))]
+                sentence = " ".join(words) + rng.choice(["。", ". "])
+            sentences.append(sentence)
+            if s % 10 == 9:
+                sentences.append("\n\n")
+        docs.append("".join(sentences))
+    return docs, facts
+
+
+def chunk_corpus(server, docs, chunking, args):
+    return [
+        list(server.make_chunks([doc], chunking, args.chunk_size, args.chunk_tokens, args.overlap_tokens))
+        for doc in docs
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--sentences", type=int, default=120, help="1文書あたりの文の数")
+    parser.add_argument("--chunk-size", type=int, default=500, help="chars のチャンクサイズ（文字数）")
+    parser.add_argument("--chunk-tokens", type=int, default=None, help="tokens のチャンクサイズ（既定はモデルの入力長）")
+    parser.add_argument("--overlap-tokens", type=int, default=None)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--skip-retrieval", action="store_true", help="埋め込みが必要なヒット率の計測を省略")
+    args = parser.parse_args()
+
+    endpoint, store, stub = start_stub_es()
+    os.environ["ELASTICSEARCH_ENDPOINT"] = endpoint
+    os.environ.setdefault("API_SEVER_PORT", "8002")
+
+    from indexing import server
+
+    docs, facts = make_corpus(args.docs, args.sentences)
+    corpus_mb = sum(len(d.encode("utf-8")) for d in docs) / 1024 / 1024
+    tokenizer = server.get_batch_tokenizer()
+    limit = server.embedder.max_tokens
+    print(f"docs={len(docs)} size={corpus_mb:.1f}MB facts={len(facts)} model_max_tokens={limit}")
+
+    try:
+        for chunking in ("chars", "tokens"):
+            start = time.perf_counter()
+            per_doc = chunk_corpus(server, docs, chunking, args)
+            elapsed = time.perf_counter() - start
+            chunks = [c for doc_chunks in per_doc for c in doc_chunks]
+
+            lengths = np.array([len(o) for o in tokenizer.offsets(chunks)])
+            truncated = float(np.mean(lengths > limit))
+            sentences = [s for _, s in facts]
+            intact = float(np.mean([any(s.strip() in c for c in chunks) for s in sentences]))
+            print(
+                f"{chunking:<7} {elapsed:7.2f}s  {len(chunks) / elapsed:10.1f} chunks/s  {corpus_mb / elapsed:7.2f} MB/s  "
+                f"chunks={len(chunks)}  tokens(avg/max)={lengths.mean():.0f}/{lengths.max()}  "
+                f"truncated={truncated:.1%}  facts intact={intact:.1%}"
+            )
+            if args.skip_retrieval:
+                continue
+
+            vectors = server.embed_chunks(chunks)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+            queries = server.embed_chunks([q for q, _ in facts])
+            queries /= np.linalg.norm(queries, axis=1, keepdims=True).clip(min=1e-12)
+            scores = queries @ vectors.T
+            top = np.argpartition(-scores, min(args.top_k, len(chunks) - 1), axis=1)[:, :args.top_k]
+            hits = [any(sentence.strip() in chunks[i] for i in row) for row, (_, sentence) in zip(top, facts)]
+            print(f"{'':<7} hit@{args.top_k}={np.mean(hits):.1%}")
+    finally:
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
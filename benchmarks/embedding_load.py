@@ -0,0 +1,86 @@
+"""
+クエリ埋め込みのマイクロバッチングの負荷試験。
+
+同時に encode_query を呼び出すスレッド数を変えながら、1件ずつ encode する場合と
+MicroBatchingEmbedder でまとめる場合の QPS とレイテンシ (p50 / p99) を比較します。
+Elasticsearch や HTTP は介さず、プロセス内の埋め込み処理だけを計測します。
+
+実行例:
+    python benchmarks/embedding_load.py --concurrency 1,8,32 --duration 10
+    EMBEDDING_BACKEND=onnx python benchmarks/embedding_load.py --max-batch 64 --max-wait-ms 5
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.ingest_throughput import WORDS
+from retrieval.embedding import MicroBatchingEmbedder, create_local_embedder
+
+
+def run_load(embedder, concurrency: int, duration: float, seed: int = 0):
+    """
+    concurrency 本のスレッドから duration 秒間 encode_query を呼び続けます。
+
+    Returns:
+        tuple: (QPS, レイテンシ (秒) の配列)
+    """
+    latencies = [[] for _ in range(concurrency)]
+    stop = time.perf_counter() + duration
+
+    def worker(i):
+        rng = random.Random(seed + i)
+        while time.perf_counter() < stop:
+            query = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+            start = time.perf_counter()
+            embedder.encode_query(query)
+            latencies[i].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    samples = np.array([x for per_thread in latencies for x in per_thread])
+    return len(samples) / elapsed, samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,8,32", help="同時に呼び出すスレッド数（カンマ区切り）")
+    parser.add_argument("--duration", type=float, default=10.0, help="1条件あたりの計測時間（秒）")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    base = create_local_embedder()
+    base.warm_up()
+    batching = MicroBatchingEmbedder(base, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+    batching.warm_up()
+    print(f"model={base.model_id} max_batch={args.max_batch} max_wait_ms={args.max_wait_ms}")
+
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        for name, embedder in (("single", base), ("batched", batching)):
+            before = batching.stats()
+            qps, samples = run_load(embedder, concurrency, args.duration)
+            line = (
+                f"concurrency={concurrency:<4} {name:<8} {qps:9.1f} QPS  "
+                f"p50={np.percentile(samples, 50) * 1000:7.2f}ms  p99={np.percentile(samples, 99) * 1000:7.2f}ms"
+            )
+            if embedder is batching:
+                after = batching.stats()
+                batches = after["batches"] - before["batches"]
+                line += f"  avg batch={len(samples) / batches if batches else 0:.1f}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+ストリーミング取り込みのメモリ使用量計測。
+
+数百MBのテキストファイルを生成し、取り込みジョブ (run_ingest_job) でローカルの Elasticsearch スタブに登録して
+ピーク RSS を計測します。--legacy を付けると、従来の「ファイル全体を読み込み、全チャンクを埋め込んでから登録」
+方式でのピーク RSS も計測します（従来方式は全ベクトルが揃った時点までを計測し、登録は行いません）。
+
+実モデルで数百MBを埋め込むと数時間かかるため、既定では埋め込みを乱数ベクトルに置き換えてパイプライン自体の
+メモリ使用量を計測します（モデルは読み込まないため、ベースラインの RSS にもモデルのメモリは含まれません）。
+乱数ベクトルの次元数は --dim（既定は環境変数 EMBEDDING_DIMS、未設定なら 384）で指定します。
+実モデルを使う場合は --real-embeddings を指定してください。
+
+実行例:
+    python benchmarks/ingest_memory.py --size-mb 300 --legacy
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from benchmarks.stub_es import start_stub_es
+from benchmarks.ingest_throughput import WORDS
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class PeakRSS:
+    """
+    with ブロック内の RSS をバックグラウンドで定期的に取得し、ピーク値を記録します。
+    """
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_mb())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = rss_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_mb())
+
+
+def write_corpus(path: str, size_mb: int, seed: int = 0):
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        while written < target:
+            line = " ".join(rng.choice(WORDS) for _ in range(40)) + "\n"
+            f.write(line)
+            written += len(line.encode("utf-8"))
+
+
+def fake_encode(dim: int):
+    rng = np.random.default_rng(0)
+
+    def encode(sentences, **kwargs):
+        return rng.standard_normal((len(sentences), dim), dtype=np.float32)
+    return encode
+
+
+class RandomEmbedder:
+    """
+    fake_encode の乱数ベクトルを返す、モデルを読み込まない埋め込み器。
+    トークナイザーを持たないため、チャンク分割は chars で行います。
+    """
+
+    model_id = "random"
+    lowercase = False
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.ready = False
+        self._encode = fake_encode(dim)
+
+    def encode(self, texts, batch_size: int = 32) -> np.ndarray:
+        self.ready = True
+        return self._encode(list(texts))
+
+    def encode_query(self, query: str) -> np.ndarray:
+        return self.encode([query])[0]
+
+    def warm_up(self):
+        self.encode(["warm up"])
+
+
+def run_legacy(server, path, chunk_size):
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    chunks = server.split_text(text, chunk_size)
+    vectors = server.embed_chunks(chunks)
+    return len(chunks), vectors.nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=300)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--legacy", action="store_true", help="従来方式のピーク RSS も計測")
+    parser.add_argument("--real-embeddings", action="store_true", help="実際の埋め込みモデルを使用")
+    parser.add_argument(
+        "--dim", type=int, default=int(os.getenv("EMBEDDING_DIMS", "384")), help="乱数ベクトルの次元数"
+    )
+    args = parser.parse_args()
+
+    endpoint, store, stub = start_stub_es(keep_docs=False)
+    os.environ["ELASTICSEARCH_ENDPOINT"] = endpoint
+    os.environ.setdefault("API_SEVER_PORT", "8002")
+    if not args.real_embeddings:
+        # トークン数での分割にはモデルのトークナイザーが必要なため、文字数で分割する
+        os.environ["CHUNKING"] = "chars"
+
+    from indexing import server
+    from retrieval import core
+
+    if not args.real_embeddings:
+        server.embedder = core.set_embedder(RandomEmbedder(args.dim))
+    server.embed_chunks(["warm up"])
+
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "corpus.txt")
+    write_corpus(path, args.size_mb)
+    print(f"file={os.path.getsize(path) / 1024 / 1024:.1f}MB chunk_size={args.chunk_size} window={server.INGEST_WINDOW}")
+
+    try:
+        baseline = rss_mb()
+        print(f"baseline RSS: {baseline:.1f}MB")
+
+        if args.legacy:
+            with PeakRSS() as peak:
+                start = time.perf_counter()
+                n_chunks, vector_bytes = run_legacy(server, path, args.chunk_size)
+                elapsed = time.perf_counter() - start
+            print(
+                f"legacy    {elapsed:8.2f}s  chunks={n_chunks}  vectors={vector_bytes / 1024 / 1024:.1f}MB  "
+                f"peak RSS={peak.peak:.1f}MB (+{peak.peak - baseline:.1f}MB)"
+            )
+            baseline = rss_mb()
+
+        # run_ingest_job は完了時にファイルを削除するため、コピーを渡す
+        job_path = os.path.join(tmp_dir, "job.txt")
+        os.link(path, job_path)
+        job = server.IngestJob(
+            filename="corpus.txt",
+            index_name="bench_memory",
+            chunk_size=args.chunk_size,
+            doc_id="corpus.txt",
+            file_path=job_path
+        )
+        with PeakRSS() as peak:
+            start = time.perf_counter()
+            server.run_ingest_job(job)
+            elapsed = time.perf_counter() - start
+        print(
+            f"streaming {elapsed:8.2f}s  chunks={job.total_chunks}  written={store.doc_count}  status={job.status}  "
+            f"peak RSS={peak.peak:.1f}MB (+{peak.peak - baseline:.1f}MB)"
+        )
+    finally:
+        os.remove(path)
+        os.rmdir(tmp_dir)
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+インジェスト処理のスループット計測。
+
+ローカルの Elasticsearch スタブに対して、従来の「1チャンクずつ encode + es.index」と
+「バッチ encode + bulk 登録」の2通りでドキュメントを登録し、chunks/sec と docs/sec を比較します。
+
+実行例:
+    python benchmarks/ingest_throughput.py --docs 20 --doc-chars 20000 --chunk-size 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_es import start_stub_es
+
+WORDS = (
+    "検索 拡張 生成 ベクトル 埋め込み インデックス 文書 チャンク 質問 回答 "
+    "search retrieval vector embedding index document chunk query answer agent"
+).split()
+
+
+def make_corpus(n_docs: int, doc_chars: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    docs = []
+    for _ in range(n_docs):
+        words = []
+        length = 0
+        while length < doc_chars:
+            w = rng.choice(WORDS)
+            words.append(w)
+            length += len(w) + 1
+        docs.append(" ".join(words)[:doc_chars])
+    return docs
+
+
+def run_legacy(server, docs, chunk_size):
+    for doc in docs:
+        for chunk in server.split_text(doc, chunk_size):
+            vector = server.embedder.model.encode(chunk).tolist()
+            server.es.index(index="bench_legacy", body={"description": "bench", "content": chunk, "embedding": vector})
+
+
+def run_batched(server, docs, chunk_size):
+    for doc in docs:
+        chunks = server.split_text(doc, chunk_size)
+        vectors = server.embed_chunks(chunks)
+        server.bulk_index(
+            "bench_batched",
+            ({"description": "bench", "content": c, "embedding": v.tolist()} for c, v in zip(chunks, vectors))
+        )
+
+
+def report(name, elapsed, n_docs, n_chunks, n_requests):
+    print(
+        f"{name:<8} {elapsed:8.2f}s  {n_chunks / elapsed:10.1f} chunks/s  "
+        f"{n_docs / elapsed:8.2f} docs/s  {n_requests:6d} HTTP requests"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--doc-chars", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=None, help="EMBED_BATCH_SIZE を上書き")
+    parser.add_argument("--skip-legacy", action="store_true", help="従来方式の計測を省略")
+    args = parser.parse_args()
+
+    endpoint, store, stub = start_stub_es()
+    os.environ["ELASTICSEARCH_ENDPOINT"] = endpoint
+    os.environ.setdefault("API_SEVER_PORT", "8002")
+    if args.batch_size:
+        os.environ["EMBED_BATCH_SIZE"] = str(args.batch_size)
+
+    from indexing import server
+
+    docs = make_corpus(args.docs, args.doc_chars)
+    n_chunks = sum(len(server.split_text(d, args.chunk_size)) for d in docs)
+    print(f"docs={len(docs)} chunks={n_chunks} chunk_size={args.chunk_size} batch_size={server.EMBED_BATCH_SIZE}")
+
+    # モデルのウォームアップ（初回 encode のコストを計測から除外）
+    server.embed_chunks(["warm up"])
+
+    try:
+        if not args.skip_legacy:
+            before = store.requests
+            start = time.perf_counter()
+            run_legacy(server, docs, args.chunk_size)
+            report("legacy", time.perf_counter() - start, len(docs), n_chunks, store.requests - before)
+
+        before = store.requests
+        start = time.perf_counter()
+        run_batched(server, docs, args.chunk_size)
+        report("batched", time.perf_counter() - start, len(docs), n_chunks, store.requests - before)
+    finally:
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+エージェントから MCP サーバーへのツール呼び出しのレイテンシ計測。
+
+ローカルの Elasticsearch スタブに接続する MCP サーバーをサブプロセスで起動し、N 回連続でツールを呼び出したときの
+1回あたりのレイテンシを、従来の「呼び出しごとに fastmcp.Client で接続」と MCPClientPool で接続を使い回す場合で比較します。
+ツール一覧の取得 (list_tools) についても、毎回取得する場合とキャッシュする場合を比較します。
+
+実行例:
+    python benchmarks/mcp_client_latency.py --calls 200 --tool list_indices
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fastmcp import Client
+
+from agent.mcp_pool import MCPClientPool
+from benchmarks.startup_time import free_port, status_of
+from benchmarks.stub_es import start_stub_es
+
+
+def report(name: str, latencies: list):
+    samples = np.array(latencies) * 1000
+    print(
+        f"{name:<20} mean={samples.mean():7.2f}ms  p50={np.percentile(samples, 50):7.2f}ms  "
+        f"p99={np.percentile(samples, 99):7.2f}ms"
+    )
+
+
+async def timed(calls: int, func) -> list:
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await func()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def run(url: str, calls: int, tool: str, args: dict):
+    async def call_per_connection():
+        async with Client(url) as client:
+            await client.call_tool(tool, args)
+
+    async def list_per_connection():
+        async with Client(url) as client:
+            await client.list_tools()
+
+    pool = MCPClientPool(url, size=1)
+    try:
+        await pool.call_tool(tool, args)  # 接続の確立を計測から除外
+        report("call  per-connection", await timed(calls, call_per_connection))
+        report("call  pooled", await timed(calls, lambda: pool.call_tool(tool, args)))
+        report("tools per-connection", await timed(calls, list_per_connection))
+        report("tools cached", await timed(calls, pool.list_tools))
+    finally:
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=100)
+    parser.add_argument("--tool", default="list_indices")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    endpoint, store, stub = start_stub_es()
+    store.ensure("bench_mcp")["mappings"] = {"_meta": {"description": "benchmark"}}
+    port = free_port()
+    env = {
+        **os.environ,
+        "ELASTICSEARCH_ENDPOINT": endpoint,
+        "MCP_SEVER_PORT": str(port),
+        "EMBEDDING_WARMUP": "off",
+        "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))
+    }
+    # サーバーのアクセスログは計測結果の表示の妨げになるため出力しない
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "mcp", "server.py")],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        start = time.perf_counter()
+        while status_of(f"http://127.0.0.1:{port}/healthz") != 200:
+            if proc.poll() is not None:
+                raise RuntimeError(f"MCP server exited with code {proc.returncode}")
+            if time.perf_counter() - start > args.timeout:
+                raise RuntimeError("MCP server did not start")
+            time.sleep(0.1)
+        print(f"calls={args.calls} tool={args.tool}")
+        asyncio.run(run(f"http://127.0.0.1:{port}/mcp", args.calls, args.tool, {}))
+    finally:
+        proc.terminate()
+        proc.wait()
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
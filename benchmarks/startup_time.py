@@ -0,0 +1,97 @@
+"""
+Indexing API の起動時間計測。
+
+ローカルの Elasticsearch スタブに接続する Indexing API をサブプロセスで起動し、
+/healthz・/readyz が 200 を返すまでの時間と、最初の /search/ が成功するまでの時間 (time-to-first-successful-search)
+を EMBEDDING_WARMUP のモードごとに計測します。
+
+実行例:
+    python benchmarks/startup_time.py --modes off,background,blocking
+    EMBEDDING_MODEL_PATH=/models/all-MiniLM-L6-v2 python benchmarks/startup_time.py
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stub_es import start_stub_es
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def status_of(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=60) as res:
+            return res.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return 0
+
+
+def measure(mode: str, endpoint: str, timeout: float) -> dict:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        "ELASTICSEARCH_ENDPOINT": endpoint,
+        "API_SEVER_PORT": str(port),
+        "EMBEDDING_WARMUP": mode,
+        "MCP_SEVER_URL": "",
+        "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))
+    }
+    search_url = f"{base}/search/?" + urllib.parse.urlencode({"index_name": "bench_startup", "query": "startup"})
+    targets = {"healthz": f"{base}/healthz", "readyz": f"{base}/readyz", "first_search": search_url}
+    results = {}
+
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "indexing.server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env
+    )
+    try:
+        while len(results) < len(targets) and time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {proc.returncode}")
+            for name, url in targets.items():
+                if name not in results and status_of(url) == 200:
+                    results[name] = time.perf_counter() - start
+            time.sleep(0.05)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="off,background,blocking", help="EMBEDDING_WARMUP のモード（カンマ区切り）")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    endpoint, store, stub = start_stub_es()
+    store.ensure("bench_startup")
+    try:
+        for mode in args.modes.split(","):
+            results = measure(mode, endpoint, args.timeout)
+            print(f"{mode:<10} " + json.dumps({k: round(v, 2) for k, v in results.items()}))
+    finally:
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
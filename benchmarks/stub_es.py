@@ -0,0 +1,325 @@
+"""
+ベンチマーク用のローカル Elasticsearch スタブ。
+
+本物の Elasticsearch コンテナを立ち上げずに、elasticsearch-py クライアントから
+HTTP 経由で呼び出せる最小限の API (インデックス作成/取得/削除, _doc, _bulk, _mget, _mapping, _settings, _refresh,
+_search, _msearch, scroll)
+を提供します。scroll は最初の検索で全件を返し、続きのページは常に空になります。ドキュメントはメモリ上に保持するだけなので、計測対象はクライアント側の処理と HTTP の往復回数になります。
+検索は全件走査（kNN はコサイン類似度、全文検索は単語の出現回数）による簡易的なものです。
+"""
+import fnmatch
+import json
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+
+class StubStore:
+    def __init__(self, keep_docs: bool = True):
+        self.lock = threading.Lock()
+        self.indices = {}  # index名 -> {"settings": dict, "mappings": dict, "docs": {id: source}}
+        self.keep_docs = keep_docs  # False の場合は件数だけ数え、ドキュメント本体は保持しない
+        self.doc_count = 0
+        self.requests = 0
+
+    def ensure(self, index: str) -> dict:
+        return self.indices.setdefault(index, {"settings": {}, "mappings": {}, "docs": {}})
+
+    def index_settings(self, index: str) -> dict:
+        """
+        作成時の settings.index と _settings で更新した値をまとめた設定（None を指定した設定は含めない）。
+        """
+        settings = self.indices[index]["settings"]
+        merged = {**settings.get("index", {}), **{k: v for k, v in settings.items() if k != "index"}}
+        return {k: v for k, v in merged.items() if v is not None}
+
+    def put_doc(self, index: str, doc_id, source: dict) -> str:
+        doc_id = doc_id or uuid.uuid4().hex
+        entry = self.ensure(index)
+        self.doc_count += 1
+        if self.keep_docs:
+            entry["docs"][doc_id] = source
+        return doc_id
+
+    # --- 検索 ---
+    def resolve(self, index_expr: str) -> list:
+        names = []
+        for pattern in index_expr.split(","):
+            names.extend(n for n in self.indices if fnmatch.fnmatchcase(n, pattern) and n not in names)
+        return names
+
+    @staticmethod
+    def _filter_ok(source: dict, clauses: list) -> bool:
+        for clause in clauses:
+            kind, cond = next(iter(clause.items()))
+            name, value = next(iter(cond.items()))
+            if kind == "term" and source.get(name) != (value.get("value") if isinstance(value, dict) else value):
+                return False
+            if kind == "terms" and source.get(name) not in value:
+                return False
+        return True
+
+    @staticmethod
+    def _lexical_score(source: dict, multi_match: dict) -> float:
+        tokens = multi_match["query"].lower().split()
+        text = " ".join(str(source.get(f, "")) for f in multi_match.get("fields", [])).lower()
+        return float(sum(text.count(t) for t in tokens))
+
+    def search(self, index_expr: str, body: dict) -> dict:
+        docs = [
+            (name, doc_id, source)
+            for name in self.resolve(index_expr)
+            for doc_id, source in self.indices[name]["docs"].items()
+        ]
+        size = body.get("size", 10)
+        scored = []
+        if "knn" in body:
+            knn = body["knn"]
+            query = np.asarray(knn["query_vector"], dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+            candidates = [d for d in docs if knn["field"] in d[2] and self._filter_ok(d[2], knn.get("filter", []))]
+            if candidates:
+                matrix = np.asarray([d[2][knn["field"]] for d in candidates], dtype=np.float32)
+                matrix /= np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+                scores = (1.0 + matrix @ query) / 2.0
+                scored = list(zip(scores.tolist(), candidates))
+            scored.sort(key=lambda x: x[0], reverse=True)
+            scored = scored[:knn.get("k", size)]
+        else:
+            query = body.get("query", {"match_all": {}})
+            if "match_all" in query:
+                scored = [(1.0, d) for d in docs]
+            else:
+                clauses = query.get("bool", {})
+                excluded = {v for c in clauses.get("must_not", []) for v in c.get("ids", {}).get("values", [])}
+                for d in docs:
+                    if d[1] in excluded or not self._filter_ok(d[2], clauses.get("filter", [])):
+                        continue
+                    must = clauses.get("must", [])
+                    score = sum(self._lexical_score(d[2], c["multi_match"]) for c in must) if must else 1.0
+                    if score > 0:
+                        scored.append((score, d))
+                scored.sort(key=lambda x: x[0], reverse=True)
+
+        excludes = set()
+        source_opt = body.get("_source", True)
+        if isinstance(source_opt, dict):
+            excludes = set(source_opt.get("excludes", []))
+        hits = []
+        for score, (name, doc_id, source) in scored[:size]:
+            hit = {"_index": name, "_id": doc_id, "_score": score}
+            if source_opt is not False:
+                hit["_source"] = {k: v for k, v in source.items() if k not in excludes}
+            hits.append(hit)
+        return {
+            "took": 0,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": len(scored), "relation": "eq"}, "max_score": hits[0]["_score"] if hits else None, "hits": hits}
+        }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # ヘッダーと本文を別々に書き込むため、遅延 ACK との組み合わせで待たされないようにする
+    store: StubStore = None
+
+    def log_message(self, *args):
+        pass
+
+    # --- レスポンス ---
+    def _send(self, status: int, body=None):
+        payload = b"" if body is None else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(payload)
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _json(self):
+        raw = self._body()
+        return json.loads(raw) if raw else {}
+
+    def _parts(self):
+        return [p for p in urlsplit(self.path).path.split("/") if p]
+
+    # --- ルーティング ---
+    def do_HEAD(self):
+        parts = self._parts()
+        with self.store.lock:
+            self.store.requests += 1
+            if not parts:
+                return self._send(200)
+            return self._send(200 if parts[0] in self.store.indices else 404)
+
+    def do_GET(self):
+        parts = self._parts()
+        if parts and parts[-1] in ("_search", "_msearch"):
+            return self.do_POST()
+        with self.store.lock:
+            self.store.requests += 1
+            if not parts:
+                return self._send(200, {"name": "stub", "version": {"number": "8.15.0"}, "tagline": "You Know, for Search"})
+            if len(parts) == 2 and parts[1] == "_mapping":
+                return self._send(200, {
+                    n: {"mappings": self.store.indices[n]["mappings"]} for n in self.store.resolve(parts[0])
+                })
+            if len(parts) in (2, 3) and parts[1] == "_settings":
+                return self._send(200, {
+                    n: {"settings": {"index": self.store.index_settings(n)}} for n in self.store.resolve(parts[0])
+                })
+            if len(parts) == 1:
+                names = self.store.resolve(parts[0])
+                if not names and "*" not in parts[0]:
+                    return self._send(404, {"error": {"type": "index_not_found_exception"}, "status": 404})
+                return self._send(200, {
+                    n: {"settings": self.store.indices[n]["settings"], "mappings": self.store.indices[n]["mappings"]}
+                    for n in names
+                })
+            if len(parts) == 3 and parts[1] == "_doc":
+                source = self.store.indices.get(parts[0], {}).get("docs", {}).get(parts[2])
+                if source is None:
+                    return self._send(404, {"_index": parts[0], "_id": parts[2], "found": False})
+                return self._send(200, {"_index": parts[0], "_id": parts[2], "found": True, "_source": source})
+        return self._send(404, {"error": {"type": "not_implemented", "reason": self.path}, "status": 404})
+
+    def do_PUT(self):
+        parts = self._parts()
+        if parts and parts[-1] == "_bulk":
+            return self._bulk(parts[0] if len(parts) == 2 else None)
+        body = self._json()
+        with self.store.lock:
+            self.store.requests += 1
+            if len(parts) == 1:
+                if parts[0] in self.store.indices:
+                    return self._send(400, {"error": {"type": "resource_already_exists_exception"}, "status": 400})
+                entry = self.store.ensure(parts[0])
+                entry["settings"] = body.get("settings", {})
+                entry["mappings"] = body.get("mappings", {})
+                return self._send(200, {"acknowledged": True, "index": parts[0]})
+            if len(parts) == 2 and parts[1] == "_mapping":
+                if parts[0] not in self.store.indices:
+                    return self._send(404, {"error": {"type": "index_not_found_exception"}, "status": 404})
+                mappings = self.store.indices[parts[0]]["mappings"]
+                for key, value in body.items():
+                    mappings[key] = {**mappings.get(key, {}), **value} if isinstance(value, dict) else value
+                return self._send(200, {"acknowledged": True})
+            if len(parts) == 2 and parts[1] == "_settings":
+                if parts[0] not in self.store.indices:
+                    return self._send(404, {"error": {"type": "index_not_found_exception"}, "status": 404})
+                self.store.indices[parts[0]]["settings"].update(body.get("index", body))
+                return self._send(200, {"acknowledged": True})
+            if len(parts) == 3 and parts[1] == "_doc":
+                self.store.put_doc(parts[0], parts[2], body)
+                return self._send(201, {"_index": parts[0], "_id": parts[2], "result": "created"})
+        return self._send(404, {"error": {"type": "not_implemented", "reason": self.path}, "status": 404})
+
+    def do_POST(self):
+        parts = self._parts()
+        if parts[-2:] == ["_search", "scroll"]:
+            self._body()
+            return self._send(200, {"_scroll_id": "stub", "hits": {"total": {"value": 0, "relation": "eq"}, "hits": []}})
+        if parts and parts[-1] == "_bulk":
+            return self._bulk(parts[0] if len(parts) == 2 else None)
+        if parts and parts[-1] == "_msearch":
+            return self._msearch(parts[0] if len(parts) == 2 else None)
+        body = self._json()
+        with self.store.lock:
+            self.store.requests += 1
+            if parts and parts[-1] == "_search":
+                if "scroll" in parse_qs(urlsplit(self.path).query):
+                    result = self.store.search(parts[0] if len(parts) == 2 else "*", {**body, "size": None})
+                    return self._send(200, {**result, "_scroll_id": "stub"})
+                return self._send(200, self.store.search(parts[0] if len(parts) == 2 else "*", body))
+            if parts and parts[-1] == "_mget":
+                docs = []
+                for ref in body.get("docs", []):
+                    index = ref.get("_index", parts[0] if len(parts) == 2 else None)
+                    source = self.store.indices.get(index, {}).get("docs", {}).get(ref["_id"])
+                    doc = {"_index": index, "_id": ref["_id"], "found": source is not None}
+                    if source is not None:
+                        doc["_source"] = source
+                    docs.append(doc)
+                return self._send(200, {"docs": docs})
+            if parts and parts[-1] == "_refresh":
+                return self._send(200, {"_shards": {"total": 1, "successful": 1, "failed": 0}})
+            if len(parts) == 2 and parts[1] == "_doc":
+                doc_id = self.store.put_doc(parts[0], None, body)
+                return self._send(201, {"_index": parts[0], "_id": doc_id, "result": "created"})
+        return self._send(404, {"error": {"type": "not_implemented", "reason": self.path}, "status": 404})
+
+    def do_DELETE(self):
+        parts = self._parts()
+        if parts[-2:] == ["_search", "scroll"]:
+            self._body()
+            return self._send(200, {"succeeded": True, "num_freed": 1})
+        with self.store.lock:
+            self.store.requests += 1
+            if len(parts) == 1 and self.store.indices.pop(parts[0], None) is not None:
+                return self._send(200, {"acknowledged": True})
+            if len(parts) == 3 and parts[1] == "_doc":
+                removed = self.store.indices.get(parts[0], {}).get("docs", {}).pop(parts[2], None)
+                return self._send(200 if removed is not None else 404, {
+                    "_index": parts[0], "_id": parts[2], "result": "deleted" if removed is not None else "not_found"
+                })
+        return self._send(404, {"error": {"type": "index_not_found_exception"}, "status": 404})
+
+    def _msearch(self, default_index):
+        lines = [json.loads(line) for line in self._body().splitlines() if line.strip()]
+        with self.store.lock:
+            self.store.requests += 1
+            responses = []
+            for header, body in zip(lines[0::2], lines[1::2]):
+                index = header.get("index", default_index) or "*"
+                if isinstance(index, list):
+                    index = ",".join(index)
+                responses.append({**self.store.search(index, body), "status": 200})
+        return self._send(200, {"took": 0, "responses": responses})
+
+    def _bulk(self, default_index):
+        lines = [line for line in self._body().splitlines() if line.strip()]
+        items = []
+        with self.store.lock:
+            self.store.requests += 1
+            i = 0
+            while i < len(lines):
+                action = json.loads(lines[i])
+                op, meta = next(iter(action.items()))
+                index = meta.get("_index", default_index)
+                if op == "delete":
+                    removed = self.store.ensure(index)["docs"].pop(meta.get("_id"), None)
+                    items.append({op: {"_index": index, "_id": meta.get("_id"), "status": 200 if removed else 404}})
+                    i += 1
+                    continue
+                source = json.loads(lines[i + 1])
+                if op == "update":
+                    source = source.get("doc", source)
+                doc_id = self.store.put_doc(index, meta.get("_id"), source)
+                items.append({op: {"_index": index, "_id": doc_id, "status": 201, "result": "created"}})
+                i += 2
+        return self._send(200, {"took": 0, "errors": False, "items": items})
+
+
+def start_stub_es(host: str = "127.0.0.1", port: int = 0, keep_docs: bool = True):
+    """
+    スタブをバックグラウンドスレッドで起動します。
+    keep_docs=False にすると登録されたドキュメントを保持せず、メモリ計測に影響しません。
+
+    Returns:
+        tuple: (エンドポイントURL, StubStore, server) 。終了時は server.shutdown() を呼んでください。
+    """
+    store = StubStore(keep_docs)
+    handler = type("BoundStubHandler", (StubHandler,), {"store": store})
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return f"http://{host}:{server.server_address[1]}", store, server
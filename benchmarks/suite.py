@@ -0,0 +1,432 @@
+"""
+検索・取り込み・インデックス一覧の性能と検索精度をまとめて計測するベンチマークスイート。
+
+合成コーパスを生成（または JSONL から読み込み）して Indexing API 経由で登録し、コーパスの規模ごとに以下を計測します。
+- 取り込みのスループット（docs/s, chunks/s）
+- 検索のレイテンシ（モードごとの p50 / p95 / p99）
+- 同時実行数ごとの検索の QPS
+- list_indices のレイテンシ（キャッシュ無効化直後と通常時）
+- プロセスの RSS（取り込み・検索中のピーク）
+- recall@k（NumPy の全件コサイン類似度による厳密な kNN に対する、ベクトル検索の上位 k 件の一致率）
+
+Indexing API はこのプロセス内で起動し、HTTP 経由で呼び出します。既定ではローカルの Elasticsearch スタブに接続するため
+オフラインで実行できます（スタブの kNN は全件走査なので recall は 1.0 になり、パイプラインの回帰だけを検出します）。
+--es-endpoint を指定すると実際の Elasticsearch に対して計測し、HNSW や量子化による recall の低下も計測できます。
+--backend local ではプロセス内のバックエンド (SEARCH_BACKEND=local) を一時ディレクトリに作成して計測します。
+--min-recall などの閾値を下回った場合は終了コード 1 で終了するため、レビュー時の回帰チェックに使えます。
+
+実行例:
+    python benchmarks/suite.py --docs 100,500 --queries 50 --top-k 10 --concurrency 1,8 --fake-embeddings
+    python benchmarks/suite.py --es-endpoint http://localhost:9200 --vector-index-type int4_hnsw --json result.json
+    python benchmarks/suite.py --backend local --fake-embeddings --docs 100,1000
+    python benchmarks/suite.py --corpus docs.jsonl --min-recall 0.95 --max-p99-ms 200
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.chunking import make_corpus
+from benchmarks.ingest_memory import PeakRSS, rss_mb
+from benchmarks.startup_time import free_port
+from benchmarks.stub_es import start_stub_es
+
+INDEX_PREFIX = "bench_suite"
+
+
+def hashed_encode(dim: int):
+    """
+    単語ごとのハッシュから決まる乱数ベクトルの和で埋め込む、モデルを使わない決定的な encode。
+    同じ単語を含むテキストほど近いベクトルになるため、検索結果が意味を持ったまま高速に計測できます。
+    """
+    cache = {}
+
+    def token_vector(token):
+        vector = cache.get(token)
+        if vector is None:
+            seed = int.from_bytes(hashlib.sha256(token.encode("utf-8")).digest()[:8], "little")
+            vector = cache[token] = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+        return vector
+
+    def encode(sentences, **kwargs):
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        vectors = np.zeros((len(sentences), dim), dtype=np.float32)
+        for i, sentence in enumerate(sentences):
+            for token in sentence.lower().split():
+                vectors[i] += token_vector(token)
+        return vectors
+    return encode
+
+
+class HashedEmbedder:
+    """
+    hashed_encode で埋め込む、モデルを読み込まない埋め込み器（--fake-embeddings）。
+    トークナイザーを持たないため、チャンク分割は chars で行います。
+    """
+
+    model_id = "hashed-words"
+    lowercase = True  # hashed_encode は単語を小文字にしてから埋め込む
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.ready = False
+        self._encode = hashed_encode(dim)
+
+    def encode(self, texts, batch_size: int = 32) -> np.ndarray:
+        self.ready = True
+        return self._encode(list(texts))
+
+    def encode_query(self, query: str) -> np.ndarray:
+        return self.encode([query])[0]
+
+    def warm_up(self):
+        self.encode(["warm up"])
+
+
+def load_corpus(path: str) -> list:
+    """
+    1行に1文書の JSONL（{"description": ..., "content": ...}、または {"content": ...}）を読み込みます。
+    """
+    docs = []
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if line.strip():
+                doc = json.loads(line)
+                docs.append({"description": doc.get("description") or f"doc-{i}", "content": doc["content"]})
+    return docs
+
+
+def synthetic_corpus(n_docs: int, sentences: int, seed: int = 0):
+    texts, facts = make_corpus(n_docs, sentences, seed)
+    return [{"description": f"doc-{i}", "content": text} for i, text in enumerate(texts)], [q for q, _ in facts]
+
+
+def percentiles(samples: list) -> dict:
+    ms = np.array(samples) * 1000
+    return {
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99))
+    }
+
+
+def start_api(server, port: int):
+    import uvicorn
+
+    api = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=api.run, daemon=True)
+    thread.start()
+    while not api.started:
+        time.sleep(0.05)
+    return api, thread
+
+
+class Suite:
+    def __init__(self, base_url: str, server, args):
+        self.base = base_url
+        self.server = server
+        self.args = args
+        self.session = requests.Session()
+        self.index_names = [f"{INDEX_PREFIX}_{i}" for i in range(args.indices)]
+
+    def _check(self, res: requests.Response) -> dict:
+        if res.status_code != 200:
+            raise RuntimeError(f"{res.request.method} {res.url} -> {res.status_code}: {res.text[:500]}")
+        return res.json()
+
+    def create_indices(self):
+        body = {"description": "benchmark suite corpus"}
+        if self.args.vector_index_type:
+            body["vector_index_type"] = self.args.vector_index_type
+        for name in self.index_names:
+            self.session.delete(f"{self.base}/delete_index/", params={"index_name": name})
+            self._check(self.session.post(f"{self.base}/create_index/", json={**body, "index_name": name}))
+
+    def ingest(self, docs: list) -> dict:
+        """
+        文書を Indexing API の /index_document_chunked/ で登録します。文書はインデックスに順番に割り振ります。
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        def post(item):
+            i, doc = item
+            payload = {"index_name": self.index_names[i % len(self.index_names)], **doc}
+            with requests.Session() as session:
+                return self._check(session.post(f"{self.base}/index_document_chunked/", json=payload))
+
+        with PeakRSS() as peak:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(self.args.ingest_concurrency) as pool:
+                results = list(pool.map(post, enumerate(docs)))
+            elapsed = time.perf_counter() - start
+        chunks = sum(r["indexed"] for r in results)
+        return {
+            "docs": len(docs),
+            "chunks": chunks,
+            "seconds": elapsed,
+            "docs_per_sec": len(docs) / elapsed,
+            "chunks_per_sec": chunks / elapsed,
+            "peak_rss_mb": peak.peak
+        }
+
+    def search(self, query: str, mode: str, session=None) -> list:
+        params = {"index_name": self.index_names[0], "query": query, "top_k": self.args.top_k, "mode": mode}
+        return self._check((session or self.session).get(f"{self.base}/search/", params=params))["results"]
+
+    def latency(self, queries: list) -> dict:
+        results = {}
+        for mode in self.args.modes.split(","):
+            samples = []
+            for query in queries:
+                start = time.perf_counter()
+                self.search(query, mode)
+                samples.append(time.perf_counter() - start)
+            results[mode] = percentiles(samples)
+        return results
+
+    def throughput(self, queries: list) -> dict:
+        results = {}
+        for concurrency in [int(c) for c in self.args.concurrency.split(",")]:
+            counts = [0] * concurrency
+            stop = time.perf_counter() + self.args.duration
+
+            def worker(i):
+                rng = random.Random(i)
+                with requests.Session() as session:
+                    while time.perf_counter() < stop:
+                        self.search(rng.choice(queries), self.args.qps_mode, session)
+                        counts[i] += 1
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            results[str(concurrency)] = sum(counts) / (time.perf_counter() - started)
+        return results
+
+    def list_indices(self, repeats: int = 20) -> dict:
+        # create_index は既存のインデックスでは説明の更新だけを行い、カタログのキャッシュを無効化する
+        self._check(self.session.post(
+            f"{self.base}/create_index/", json={"index_name": self.index_names[0], "description": "benchmark suite corpus"}
+        ))
+        start = time.perf_counter()
+        self._check(self.session.get(f"{self.base}/list_indices/"))
+        cold = time.perf_counter() - start
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            self._check(self.session.get(f"{self.base}/list_indices/"))
+            samples.append(time.perf_counter() - start)
+        return {"cold_ms": cold * 1000, **percentiles(samples)}
+
+    def exact_top_k(self, query_vectors: np.ndarray):
+        """
+        検索対象インデックスの全チャンクを読み出し、NumPy で厳密なコサイン類似度の上位 k 件を求めます。
+        _source に embedding が保存されていないインデックスでは、チャンクを埋め込み直します。
+        """
+        from retrieval.es import scan
+
+        keys = []
+        vectors = []
+        missing = []
+        for hit in scan(
+            self.server.es,
+            index=self.index_names[0],
+            query={"query": {"bool": {"must_not": [{"ids": {"values": ["_meta_"]}}]}}},
+            _source=["description", "content", "embedding"]
+        ):
+            source = hit["_source"]
+            keys.append((source.get("description"), source.get("content")))
+            vectors.append(source.get("embedding"))
+            if source.get("embedding") is None:
+                missing.append(len(keys) - 1)
+        if missing:
+            embedded = self.server.embed_chunks([keys[i][1] for i in missing])
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        matrix = np.asarray(vectors, dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+        queries = query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True).clip(min=1e-12)
+        scores = queries @ matrix.T
+        k = min(self.args.top_k, len(keys))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        return [{keys[i] for i in row} for row in top]
+
+    def recall(self, queries: list) -> float:
+        query_vectors = self.server.embedder.encode(queries)
+        exact = self.exact_top_k(query_vectors)
+        recalls = []
+        for query, expected in zip(queries, exact):
+            found = {(hit["description"], hit["content"]) for hit in self.search(query, "vector")}
+            recalls.append(len(found & expected) / len(expected) if expected else 1.0)
+        return float(np.mean(recalls))
+
+    def run_step(self, docs: list, queries: list) -> dict:
+        step = {"ingest": self.ingest(docs)}
+        with PeakRSS() as peak:
+            step["latency"] = self.latency(queries)
+            step["qps"] = self.throughput(queries)
+            step["list_indices"] = self.list_indices()
+        step["search_peak_rss_mb"] = peak.peak
+        step[f"recall@{self.args.top_k}"] = self.recall(queries)
+        return step
+
+
+def print_step(total_docs: int, step: dict, top_k: int):
+    ingest = step["ingest"]
+    print(
+        f"[docs={total_docs}] ingest: +{ingest['docs']} docs / +{ingest['chunks']} chunks in {ingest['seconds']:.2f}s  "
+        f"{ingest['docs_per_sec']:.1f} docs/s  {ingest['chunks_per_sec']:.1f} chunks/s  peak RSS={ingest['peak_rss_mb']:.0f}MB"
+    )
+    for mode, stats in step["latency"].items():
+        print(
+            f"  search {mode:<8} p50={stats['p50_ms']:7.2f}ms  p95={stats['p95_ms']:7.2f}ms  p99={stats['p99_ms']:7.2f}ms"
+        )
+    print("  qps     " + "  ".join(f"c={c}: {qps:.1f}" for c, qps in step["qps"].items()))
+    lists = step["list_indices"]
+    print(f"  list_indices cold={lists['cold_ms']:.2f}ms  p50={lists['p50_ms']:.2f}ms  p99={lists['p99_ms']:.2f}ms")
+    print(f"  recall@{top_k}={step[f'recall@{top_k}']:.3f}  search peak RSS={step['search_peak_rss_mb']:.0f}MB")
+
+
+def check_gates(steps: list, args) -> list:
+    """
+    最も大きいコーパスでの結果を閾値と比較し、満たさなかった項目のメッセージを返します。
+    """
+    last = steps[-1]
+    failures = []
+    recall = last[f"recall@{args.top_k}"]
+    if args.min_recall is not None and recall < args.min_recall:
+        failures.append(f"recall@{args.top_k} {recall:.3f} < {args.min_recall}")
+    if args.max_p99_ms is not None:
+        for mode, stats in last["latency"].items():
+            if stats["p99_ms"] > args.max_p99_ms:
+                failures.append(f"search {mode} p99 {stats['p99_ms']:.2f}ms > {args.max_p99_ms}ms")
+    if args.min_chunks_per_sec is not None and last["ingest"]["chunks_per_sec"] < args.min_chunks_per_sec:
+        failures.append(f"ingest {last['ingest']['chunks_per_sec']:.1f} chunks/s < {args.min_chunks_per_sec}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", default="100", help="コーパスの規模（文書数、カンマ区切りで段階的に追加登録）")
+    parser.add_argument("--sentences", type=int, default=60, help="合成コーパスの1文書あたりの文の数")
+    parser.add_argument("--corpus", default=None, help="合成コーパスの代わりに使う JSONL ファイル")
+    parser.add_argument("--queries", type=int, default=50, help="計測に使うクエリ数")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--modes", default="hybrid,vector,lexical", help="レイテンシを計測する検索モード")
+    parser.add_argument("--qps-mode", default="hybrid", help="QPS を計測する検索モード")
+    parser.add_argument("--concurrency", default="1,8", help="QPS を計測する同時実行数（カンマ区切り）")
+    parser.add_argument("--duration", type=float, default=5.0, help="同時実行数ごとの QPS の計測時間（秒）")
+    parser.add_argument("--indices", type=int, default=1, help="文書を分散して登録するインデックス数（検索は1つ目のみ）")
+    parser.add_argument("--ingest-concurrency", type=int, default=2, help="取り込みリクエストの同時実行数")
+    parser.add_argument("--vector-index-type", default=None, help="作成するインデックスの格納方式（省略時は VECTOR_INDEX_TYPE）")
+    parser.add_argument("--es-endpoint", default=None, help="スタブの代わりに使う Elasticsearch の URL")
+    parser.add_argument("--backend", choices=["elasticsearch", "local"], default="elasticsearch", help="検索バックエンド")
+    parser.add_argument("--fake-embeddings", action="store_true", help="モデルの代わりに単語ハッシュの埋め込みを使う（モデルを読み込まずオフラインで実行。チャンク分割は chars）")
+    parser.add_argument("--cache", action="store_true", help="クエリ埋め込み・検索結果のキャッシュを有効のまま計測")
+    parser.add_argument("--json", default=None, help="結果を書き出す JSON ファイル")
+    parser.add_argument("--min-recall", type=float, default=None)
+    parser.add_argument("--max-p99-ms", type=float, default=None)
+    parser.add_argument("--min-chunks-per-sec", type=float, default=None)
+    args = parser.parse_args()
+
+    stub = None
+    local_dir = None
+    if args.backend == "local":
+        local_dir = tempfile.mkdtemp(prefix="bench_local_")
+        os.environ["SEARCH_BACKEND"] = "local"
+        os.environ["LOCAL_INDEX_PATH"] = local_dir
+    elif args.es_endpoint:
+        os.environ["ELASTICSEARCH_ENDPOINT"] = args.es_endpoint
+    else:
+        endpoint, store, stub = start_stub_es()
+        os.environ["ELASTICSEARCH_ENDPOINT"] = endpoint
+    port = free_port()
+    os.environ["API_SEVER_PORT"] = str(port)
+    os.environ["MCP_SEVER_URL"] = ""
+    os.environ["EMBEDDING_WARMUP"] = "blocking"
+    if args.fake_embeddings:
+        # トークン数によるチャンク分割はモデルのトークナイザーを読み込むため、文字数で分割する
+        os.environ["CHUNKING"] = "chars"
+    if not args.cache:
+        # 同じクエリを繰り返すため、キャッシュを無効にして毎回の埋め込みと検索を計測する
+        os.environ["QUERY_CACHE_SIZE"] = "0"
+        os.environ["RESULT_CACHE_SIZE"] = "0"
+
+    from indexing import server
+    from retrieval import core
+    from retrieval.embedding import with_micro_batching
+
+    if args.fake_embeddings:
+        # server はモデルを import 時には読み込まないため、起動（warm-up）前に差し替えればモデルは読み込まれない
+        server.embedder = core.set_embedder(with_micro_batching(HashedEmbedder()))
+
+    sizes = [int(n) for n in args.docs.split(",")]
+    if args.corpus:
+        docs = load_corpus(args.corpus)
+        sizes = [min(n, len(docs)) for n in sizes]
+        queries = []
+    else:
+        docs, queries = synthetic_corpus(max(sizes), args.sentences)
+    # 事実を問う質問が足りない場合は、登録した文書の先頭の単語からクエリを作る
+    rng = random.Random(0)
+    while len(queries) < args.queries:
+        words = rng.choice(docs[:sizes[0]])["content"].split()
+        start = rng.randrange(max(1, len(words) - 8))
+        queries.append(" ".join(words[start:start + 8]))
+    queries = rng.sample(queries, args.queries)
+
+    api, thread = start_api(server, port)
+    suite = Suite(f"http://127.0.0.1:{port}", server, args)
+    results = {"config": vars(args), "baseline_rss_mb": rss_mb(), "steps": []}
+    backend = "local" if local_dir else "elasticsearch" if args.es_endpoint else "stub"
+    print(f"model={server.embedder.model_id} backend={backend} queries={len(queries)}")
+    try:
+        suite.create_indices()
+        done = 0
+        for size in sizes:
+            if size <= done:
+                continue
+            step = suite.run_step(docs[done:size], queries)
+            done = size
+            step["total_docs"] = done
+            results["steps"].append(step)
+            print_step(done, step, args.top_k)
+    finally:
+        for name in suite.index_names:
+            suite.session.delete(f"{suite.base}/delete_index/", params={"index_name": name})
+        api.should_exit = True
+        thread.join()
+        if stub is not None:
+            stub.shutdown()
+        if local_dir is not None:
+            shutil.rmtree(local_dir, ignore_errors=True)
+
+    failures = check_gates(results["steps"], args) if results["steps"] else []
+    results["failures"] = failures
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
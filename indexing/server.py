@@ -1,31 +1,159 @@
-from fastapi import FastAPI, HTTPException, Query, UploadFile, File
+from fastapi import FastAPI, HTTPException, Query, Request, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-from elasticsearch import Elasticsearch
-from sentence_transformers import SentenceTransformer
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+from elasticsearch import BadRequestError
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from collections import OrderedDict
+import numpy as np
+import asyncio
+import hashlib
+import httpx
+import json
+import logging
 import os
+import requests
+import shutil
+import tempfile
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
 from docx import Document as DocxDocument
 import uvicorn
 
+from retrieval import core
+from retrieval.chunking import BatchTokenizer, TokenChunker
+from retrieval.es import scan, streaming_bulk
+from retrieval.embedding import create_local_embedder, with_micro_batching
+from retrieval.search import SOURCE_FILTER, SearchParams
+from retrieval.telemetry import (
+    BULK_ACTIONS, CONTENT_TYPE, ES_SECONDS, INGEST_CHUNKS, INGEST_DOCUMENT_CHUNKS, REGISTRY, measure, server_span,
+    setup_tracing, span, with_trace_headers
+)
+from retrieval.vector_index import VectorProfile
+
 load_dotenv()
-ELASTICSEARCH_ENDPOINT = os.getenv("ELASTICSEARCH_ENDPOINT")
 PORT = int(os.getenv("API_SEVER_PORT"))
+MCP_SEVER_URL = os.getenv("MCP_SEVER_URL")
+# 書き込み時に検索結果キャッシュの無効化を通知する先（カンマ区切り）。既定は MCP サーバー
+CACHE_INVALIDATION_URLS = [
+    url for url in os.getenv("CACHE_INVALIDATION_URLS", f"{MCP_SEVER_URL}/invalidate" if MCP_SEVER_URL else "").split(",")
+    if url
+]
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))              # 1回の encode に渡すチャンク数
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))               # 1回の _bulk リクエストに含める件数
+BULK_MAX_BYTES = int(os.getenv("BULK_MAX_BYTES", str(10 * 1024 * 1024))) # 1回の _bulk リクエストの最大バイト数
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))                   # 埋め込みを行うジョブの同時実行数
+INGEST_WRITERS = int(os.getenv("INGEST_WRITERS", "2"))                   # ES への書き込みスレッド数
+INGEST_WINDOW = int(os.getenv("INGEST_WINDOW", "256"))                   # 1回の埋め込み→書き込みで扱うチャンク数
+READ_BLOCK_SIZE = int(os.getenv("READ_BLOCK_SIZE", str(64 * 1024)))       # テキストファイルを読み込む単位（文字数）
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "100"))           # 保持する完了済みジョブ数
+SUPPORTED_EXTENSIONS = (".txt", ".docx")
+EMBEDDING_WARMUP = os.getenv("EMBEDDING_WARMUP", "background")           # background / blocking / off
+CHUNKING = os.getenv("CHUNKING", "tokens")                               # tokens: 文境界 + トークン数 / chars: 文字数
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "0"))               # 1チャンクのトークン数。0 でモデルの入力長
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))      # 前のチャンクと重複させるトークン数
+TOKENIZE_BATCH_SIZE = int(os.getenv("TOKENIZE_BATCH_SIZE", "64"))        # 1回のトークナイズに渡す文の数
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))            # エクスポートで1回の検索で取得する件数
+EXPORT_KEEP_ALIVE = os.getenv("EXPORT_KEEP_ALIVE", "2m")                 # エクスポートのページ間で point in time を保持する時間
+CHUNKING_MODES = ("tokens", "chars")
+
+# --- トレース（TRACING が設定されている場合のみ） ---
+setup_tracing("indexing-server")
 
-# --- ElasticSearch 接続 ---
-es = Elasticsearch(ELASTICSEARCH_ENDPOINT)
+# --- ElasticSearch 接続（MCP サーバーと共通の接続プール設定） ---
+# API のハンドラーは共有の AsyncElasticsearch (core.get_async_client()) を使い、
+# スレッドで動く取り込み処理 (ジョブ・bulk 登録) はこの同期クライアントを使う
+es = core.get_client()
 
 # --- Hugging Face 埋め込みモデル ---
-embedding_model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-VECTOR_DIM = embedding_model.get_sentence_embedding_dimension()
+# 埋め込みを提供する側なので、EMBEDDING_SERVER_URL が設定されていても常に自身のモデルを使う
+# モデルは import 時には読み込まず、起動後の warm-up か最初の利用時に読み込む
+# /search/ や /embed/ で同時に届いた少数テキストの encode はマイクロバッチにまとめる
+embedder = core.set_embedder(with_micro_batching(create_local_embedder()))
+
+logger = logging.getLogger(__name__)
+
+def invalidate_search_cache(index_name: str, catalog: bool = False):
+    """
+    インデックスの検索結果キャッシュを無効化し、同じインデックスを検索する他のサーバーにも通知します。
+    インデックスの作成・削除時は catalog=True でインデックス一覧のカタログも取り直させます。
+    """
+    core.invalidate(index_name, catalog=catalog)
+    for url in CACHE_INVALIDATION_URLS:
+        try:
+            requests.post(url, json={"index_name": index_name, "catalog": catalog}, timeout=2)
+        except requests.RequestException as e:
+            # 通知に失敗しても、通知先のキャッシュは RESULT_CACHE_TTL で期限切れになる
+            logger.warning("Failed to notify cache invalidation to %s: %s", url, e)
+
+async def invalidate_search_cache_async(index_name: str, catalog: bool = False):
+    """
+    invalidate_search_cache() の非同期版です。通知先が複数ある場合は並行して通知します。
+    """
+    core.invalidate(index_name, catalog=catalog)
+    if not CACHE_INVALIDATION_URLS:
+        return
+    async with httpx.AsyncClient(timeout=2) as client:
+        results = await asyncio.gather(
+            *(client.post(url, json={"index_name": index_name, "catalog": catalog}) for url in CACHE_INVALIDATION_URLS),
+            return_exceptions=True
+        )
+    for url, result in zip(CACHE_INVALIDATION_URLS, results):
+        if isinstance(result, Exception):
+            logger.warning("Failed to notify cache invalidation to %s: %s", url, result)
 
 # --- FastAPI 初期化 ---
-app = FastAPI(title="RAG Document Indexing API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # background: モデルの読み込みを待たずに起動し、準備ができたら /readyz が 200 を返す
+    # blocking:   warm-up が終わるまでリクエストを受け付けない
+    if EMBEDDING_WARMUP == "blocking":
+        await run_in_threadpool(core.warm_up)
+    elif EMBEDDING_WARMUP == "background":
+        core.start_warm_up()
+    yield
+    await core.close_async_client()
+
+app = FastAPI(title="RAG Document Indexing API", lifespan=lifespan)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # UI や MCP サーバー（埋め込みの委譲）から届いた traceparent を引き継ぐ
+    with server_span(f"{request.method} {request.url.path}", request.headers, end_on_exit=False) as span:
+        response = await call_next(request)
+    if span is None:
+        return response
+
+    # /export_index/ などのストリーミングのレスポンスは call_next から戻った後に本文を送るため、送り終えた時点で span を終了する
+    body = response.body_iterator
+
+    async def traced_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            span.end()
+
+    response.body_iterator = traced_body()
+    return response
 
 # --- Pydantic モデル ---
 class IndexRequest(BaseModel):
     index_name: str
     description: Optional[str] = None
+    # 埋め込みベクトルの格納方式（省略時は環境変数 VECTOR_INDEX_TYPE などの設定）
+    vector_index_type: Optional[str] = None         # hnsw / int8_hnsw / int4_hnsw / bbq_hnsw
+    similarity: Optional[str] = None                # cosine / dot_product / l2_norm / max_inner_product
+    m: Optional[int] = None                         # HNSW の接続数
+    ef_construction: Optional[int] = None           # HNSW の構築時の候補数
+    shards: Optional[int] = None                    # プライマリシャード数
+    exclude_embedding_source: Optional[bool] = None # embedding を _source に保存しない
+    candidate_factor: Optional[float] = None        # 検索時の num_candidates を k の何倍にするか
 
 class Document(BaseModel):
     description: str
@@ -41,157 +169,833 @@ class DocumentChunkRequest(BaseModel):
     index_name: str                # 保存先インデックス名
     description: str               # ドキュメントの説明 (検索対象フィールド)
     content: str                   # 登録する元テキスト
-    chunk_size: int = 200          # チャンクサイズ（デフォルト200文字）
+    chunk_size: int = 200          # chars のチャンクサイズ（デフォルト200文字）
+    doc_id: Optional[str] = None   # 文書ID。同じIDで再登録すると差分だけ更新（省略時は description。description を変える場合は固定の ID を指定）
+    chunking: Optional[str] = None         # tokens / chars（省略時は CHUNKING）
+    chunk_tokens: Optional[int] = None     # tokens のチャンクサイズ（省略時は CHUNK_MAX_TOKENS）
+    overlap_tokens: Optional[int] = None   # tokens の重複トークン数（省略時は CHUNK_OVERLAP_TOKENS。チャンクの 1/4 まで）
+
+class EmbedRequest(BaseModel):
+    texts: List[str]               # 埋め込むテキストのリスト
+
+# --- チャンク分割・埋め込み ---
+def split_text(text: str, chunk_size: int) -> List[str]:
+    return [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
+
+def iter_chunks(pieces: Iterable[str], chunk_size: int) -> Iterator[str]:
+    """
+    少しずつ読み込まれるテキスト片から chunk_size 文字ずつのチャンクを順に生成します。
+    結果は全テキストを連結して split_text した場合と同じで、保持するのは chunk_size 文字 + テキスト片1つ分だけです。
+    """
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) < chunk_size:
+            continue
+        end = len(buffer) - len(buffer) % chunk_size
+        for i in range(0, end, chunk_size):
+            yield buffer[i:i+chunk_size]
+        buffer = buffer[end:]
+    if buffer:
+        yield buffer
+
+_batch_tokenizer = None
+_batch_tokenizer_lock = threading.Lock()
+
+def get_batch_tokenizer() -> BatchTokenizer:
+    global _batch_tokenizer
+    with _batch_tokenizer_lock:
+        if _batch_tokenizer is None:
+            _batch_tokenizer = BatchTokenizer(embedder.tokenizer)
+        return _batch_tokenizer
+
+def check_chunking(chunking: Optional[str]) -> str:
+    chunking = chunking or CHUNKING
+    if chunking not in CHUNKING_MODES:
+        raise HTTPException(status_code=400, detail=f"chunking must be one of {CHUNKING_MODES}.")
+    return chunking
+
+def make_chunker(
+    chunking: str,
+    chunk_size: int,
+    chunk_tokens: Optional[int] = None,
+    overlap_tokens: Optional[int] = None
+) -> Callable[[Iterable[str]], Iterator[str]]:
+    """
+    chunking に応じて、テキスト片の列をチャンクに分ける関数を返します。
+    tokens は文・段落の境界で区切り、chunk_tokens トークン以内（モデルの入力長が上限）に詰めます。
+    chars は従来どおり chunk_size 文字ずつに区切ります。
+    指定が不正な場合は、テキストを読み始める前にここで ValueError を送出します。
+    """
+    if chunking == "chars":
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive.")
+        return lambda pieces: iter_chunks(pieces, chunk_size)
+    limit = embedder.max_tokens
+    max_tokens = min(chunk_tokens or CHUNK_MAX_TOKENS or limit, limit)
+    if overlap_tokens is None:
+        # 既定の重複は小さいチャンクでは大きすぎるため、チャンクの 1/4 までに抑える（明示した値はそのまま検証する）
+        overlap_tokens = min(CHUNK_OVERLAP_TOKENS, max_tokens // 4)
+    chunker = TokenChunker(
+        get_batch_tokenizer(),
+        max_tokens=max_tokens,
+        overlap_tokens=overlap_tokens,
+        batch_size=TOKENIZE_BATCH_SIZE
+    )
+    return chunker.chunks
+
+def make_chunks(
+    pieces: Iterable[str],
+    chunking: str,
+    chunk_size: int,
+    chunk_tokens: Optional[int] = None,
+    overlap_tokens: Optional[int] = None
+) -> Iterator[str]:
+    """
+    make_chunker() で作った関数でテキスト片の列をチャンクに分けます。
+    """
+    return make_chunker(chunking, chunk_size, chunk_tokens, overlap_tokens)(pieces)
+
+def iter_windows(items: Iterable, size: int) -> Iterator[Tuple[int, list]]:
+    """
+    items を size 件ずつのリストにまとめ、(先頭の通し番号, リスト) を順に返します。
+    """
+    window = []
+    start = 0
+    for item in items:
+        window.append(item)
+        if len(window) == size:
+            yield start, window
+            start += size
+            window = []
+    if window:
+        yield start, window
+
+def embed_chunks(chunks: List[str], batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+    """
+    チャンクをまとめて埋め込みベクトルに変換します。
+    1チャンクずつ encode するのではなく batch_size 件ずつモデルに渡すため、CPU でも高速に処理できます。
+
+    Returns:
+        np.ndarray: (チャンク数, ベクトル次元数) の float32 配列
+    """
+    return embedder.encode(chunks, batch_size=batch_size)
+
+# --- インデックス定義 ---
+# 差分登録に使うフィールド。文書単位の検索・削除のため keyword にする
+DEDUP_FIELDS = {
+    "doc_id": {"type": "keyword"},
+    "content_hash": {"type": "keyword"}
+}
+
+def build_index_body(description: str = "", profile: Optional[VectorProfile] = None) -> dict:
+    """
+    profile を省略した場合は、環境変数で設定された埋め込みベクトルの格納方式で作成します。
+    """
+    profile = profile or VectorProfile.from_env()
+    mappings = {
+        # インデックスの説明と格納方式は mapping の _meta に保存し、一覧取得時に全インデックス分をまとめて取得する
+        "_meta": {"description": description, "vector": profile.to_meta()},
+        "properties": {
+            "description": {"type": "text"},
+            "content": {"type": "text"},
+            **DEDUP_FIELDS,
+            "embedding": profile.field_mapping(embedder.dim)
+        }
+    }
+    if profile.exclude_source:
+        mappings["_source"] = {"excludes": ["embedding"]}
+    return {
+        "settings": {
+            "index": {
+                "number_of_shards": profile.shards,
+                "number_of_replicas": 0
+            }
+        },
+        "mappings": mappings
+    }
+
+_ensured_indices = set()
+
+def ensure_index(index_name: str):
+    """
+    登録先のインデックスがなければ作成し、既存のインデックスには差分登録用のフィールドを追加します。
+    登録時の自動作成に任せると embedding が dense_vector にならず、kNN 検索できないためです。
+    """
+    if index_name in _ensured_indices:
+        return
+    if not es.indices.exists(index=index_name):
+        es.indices.create(index=index_name, body=build_index_body(), ignore=400)
+        invalidate_search_cache(index_name, catalog=True)
+    else:
+        try:
+            es.indices.put_mapping(index=index_name, properties=DEDUP_FIELDS)
+        except BadRequestError as e:
+            # 既に別の型で登録されている場合は差分登録用の検索が一致しないため、再作成を促す
+            logger.warning("Could not add doc_id/content_hash mapping to '%s': %s", index_name, e)
+    _ensured_indices.add(index_name)
+
+# --- Bulk 登録 ---
+_refresh_lock = threading.Lock()
+_refresh_holds = {}  # index名 -> [refresh を止めている登録処理の数, そのインデックスの設定変更を直列化するロック]
+_refresh_saved = {}  # index名 -> 止める前の refresh_interval（明示的な設定がなければ None）
+
+def _refresh_hold(index_name: str) -> list:
+    with _refresh_lock:
+        return _refresh_holds.setdefault(index_name, [0, threading.Lock()])
+
+def _get_refresh_interval(index_name: str) -> Optional[str]:
+    res = es.indices.get_settings(index=index_name, name="index.refresh_interval")
+    settings = next(iter(res.values()), {}).get("settings", {})
+    return settings.get("index", {}).get("refresh_interval")
+
+@contextmanager
+def refresh_paused(index_name: str):
+    """
+    登録中はインデックスの refresh を無効化し、最後の登録処理が終わった時点で元の refresh_interval に戻して1回だけ refresh します。
+    同じインデックスへ複数のジョブが同時に書き込む場合も、全て終わるまで refresh は止めたままになります。
+    設定の取得・変更はインデックスごとのロックで直列化するため、別のインデックスへの登録を待たせません。
+    """
+    hold = _refresh_hold(index_name)
+    with hold[1]:
+        paused = hold[0] > 0 or es.indices.exists(index=index_name)
+        if paused:
+            if hold[0] == 0:
+                _refresh_saved[index_name] = _get_refresh_interval(index_name)
+                es.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": "-1"}})
+            with _refresh_lock:
+                hold[0] += 1
+    try:
+        yield
+    finally:
+        if paused:
+            with hold[1]:
+                with _refresh_lock:
+                    hold[0] -= 1
+                    last = hold[0] == 0
+                if last:
+                    # 元の設定が無かった場合は None を指定し、デフォルトの refresh_interval に戻す
+                    es.indices.put_settings(
+                        index=index_name, settings={"index": {"refresh_interval": _refresh_saved.pop(index_name, None)}}
+                    )
+        es.indices.refresh(index=index_name, ignore_unavailable=True)
+        # インデックスが存在しなかった場合は登録時に自動作成されるため、一覧も更新する
+        invalidate_search_cache(index_name, catalog=not paused)
+
+def bulk_write(index_name: str, actions: Iterable[dict], labels: Optional[Sequence[dict]] = None) -> dict:
+    """
+    Elasticsearch の bulk helper で操作をまとめて実行します。
+    actions は {"_id": ..., "_source": ...} や {"_op_type": "delete", "_id": ...} の形式で、
+    labels には失敗時のエラー報告に含める各操作の情報（チャンク番号など）を actions と同じ順で渡します。
+
+    Returns:
+        dict: indexed (成功件数) と errors (失敗した操作の情報とエラー内容) を含む辞書
+    """
+    indexed = 0
+    errors = []
+    with measure(ES_SECONDS, "es.bulk", {"index": index_name}, operation="bulk"):
+        results = streaming_bulk(
+            with_trace_headers(es),
+            ({"_index": index_name, **action} for action in actions),
+            chunk_size=BULK_CHUNK_SIZE,
+            max_chunk_bytes=BULK_MAX_BYTES,
+            raise_on_error=False,
+            raise_on_exception=False
+        )
+        for i, (ok, item) in enumerate(results):
+            if ok:
+                indexed += 1
+            else:
+                info = next(iter(item.values()))
+                label = labels[i] if labels is not None else {"chunk_number": i+1}
+                errors.append({**label, "error": info.get("error", info)})
+    BULK_ACTIONS.observe(indexed + len(errors))
+    return {"indexed": indexed, "errors": errors}
+
+def bulk_index(index_name: str, docs: Iterable[dict]) -> dict:
+    """
+    refresh を止めた状態で bulk_write を実行します。
+    """
+    with refresh_paused(index_name):
+        return bulk_write(index_name, ({"_source": doc} for doc in docs))
 
 # --- ファイル前処理関数 ---
-def preprocess_text(text: str, chunk_size: int = 500) -> List[dict]:
-    text = text.replace("\r\n", "\n").strip()
-    chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
-    indexed_docs = []
-    for i, chunk in enumerate(chunks):
-        vector = embedding_model.encode(chunk).tolist()
-        indexed_docs.append({"content": chunk, "embedding": vector, "chunk_number": i+1})
-    return indexed_docs
-
-def preprocess_file(file_path: str, chunk_size: int = 500) -> List[dict]:
+def _strip_stream(pieces: Iterable[str]) -> Iterator[str]:
+    """
+    テキスト片の列に対して、全体を連結して strip() したのと同じ結果になるように先頭・末尾の空白を取り除きます。
+    """
+    started = False
+    pending = ""
+    for piece in pieces:
+        if not started:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+            started = True
+        body = piece.rstrip()
+        if body:
+            yield pending + body
+            pending = piece[len(body):]
+        else:
+            pending += piece
+
+def iter_file_text(file_path: str) -> Iterator[Tuple[str, float]]:
+    """
+    ファイルからテキストを少しずつ読み出し、(テキスト片, 読み込み済みの割合) を順に返します。
+    txt は READ_BLOCK_SIZE 文字ずつ、docx は段落ごとに読み出すため、ファイル全体の文字列は作りません。
+    """
     ext = os.path.splitext(file_path)[1].lower()
     if ext == ".txt":
+        size = os.path.getsize(file_path) or 1
+        # 改行コードは universal newlines により "\n" に統一される
         with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
+            while True:
+                block = f.read(READ_BLOCK_SIZE)
+                if not block:
+                    break
+                yield block, min(f.buffer.tell() / size, 1.0)
     elif ext == ".docx":
-        doc = DocxDocument(file_path)
-        text = "\n".join([p.text for p in doc.paragraphs])
+        paragraphs = DocxDocument(file_path).paragraphs
+        for i, p in enumerate(paragraphs):
+            yield (p.text if i == 0 else "\n" + p.text), (i + 1) / len(paragraphs)
     else:
         raise ValueError("対応していないファイル形式です。txtかdocxを使用してください。")
-    return preprocess_text(text, chunk_size)
 
-# --- インデックス作成 ---
-@app.post("/create_index/")
-def create_index(request: IndexRequest):
-    index_body = {
-        "settings": {
-            "index": {
-                "number_of_shards": 1,
-                "number_of_replicas": 0
-            }
-        },
-        "mappings": {
-            "properties": {
-                "description": {"type": "text"},
-                "content": {"type": "text"},
-                "embedding": {"type": "dense_vector", "dims": VECTOR_DIM}
+# --- バックグラウンド取り込みジョブ ---
+embed_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest-embed")
+write_executor = ThreadPoolExecutor(max_workers=INGEST_WRITERS, thread_name_prefix="ingest-write")
+
+@dataclass
+class IngestJob:
+    filename: Optional[str]
+    index_name: str
+    chunk_size: int
+    doc_id: str                         # 文書ID。チャンクの ID はこれと内容のハッシュから決まる
+    file_path: Optional[str] = None
+    chunking: str = CHUNKING
+    chunk_tokens: Optional[int] = None
+    overlap_tokens: Optional[int] = None
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "queued"  # queued / running / completed / failed / cancelled
+    total_chunks: Optional[int] = None  # ストリーミング処理のため完了時に確定する
+    progress: float = 0.0               # ファイルの読み込み済みの割合
+    chunks_embedded: int = 0
+    chunks_written: int = 0
+    chunks_skipped: int = 0             # 内容が変わっていないため埋め込み・書き込みを省略したチャンク数
+    chunks_updated: int = 0             # 内容は同じで description などだけが変わり、部分更新したチャンク数
+    chunks_deleted: int = 0             # 文書から無くなったため削除したチャンク数
+    chunks_stale: int = 0               # 書き込みに失敗したため削除せずに残した古いチャンク数（登録し直すと削除される）
+    errors: List[dict] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def eta_seconds(self) -> Optional[float]:
+        if self.status != "running" or not self.progress:
+            return None
+        elapsed = time.time() - self.started_at
+        return elapsed / self.progress * (1.0 - self.progress)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "job_id": self.job_id,
+                "status": self.status,
+                "filename": self.filename,
+                "index_name": self.index_name,
+                "doc_id": self.doc_id,
+                "chunking": self.chunking,
+                "total_chunks": self.total_chunks,
+                "progress": self.progress,
+                "chunks_embedded": self.chunks_embedded,
+                "chunks_written": self.chunks_written,
+                "chunks_skipped": self.chunks_skipped,
+                "chunks_updated": self.chunks_updated,
+                "chunks_deleted": self.chunks_deleted,
+                "chunks_stale": self.chunks_stale,
+                "errors": list(self.errors),
+                "eta_seconds": self.eta_seconds(),
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at
             }
-        }
-    }
 
+_jobs_lock = threading.Lock()
+_jobs = OrderedDict()  # job_id -> IngestJob (古い順)
+
+def register_job(job: IngestJob):
+    with _jobs_lock:
+        _jobs[job.job_id] = job
+        finished = [j for j in _jobs.values() if j.finished_at is not None]
+        for old_job in finished[:max(0, len(finished) - JOB_HISTORY_LIMIT)]:
+            del _jobs[old_job.job_id]
+
+def get_job(job_id: str) -> IngestJob:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' does not exist.")
+    return job
+
+# --- 差分登録 ---
+def content_hash(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+def chunk_id(doc_id: str, chunk_hash: str) -> str:
+    return hashlib.sha256(f"{doc_id}\x00{chunk_hash}".encode("utf-8")).hexdigest()
+
+def existing_chunks(index_name: str, doc_id: str) -> dict:
+    """
+    doc_id の既存チャンクの ID -> 埋め込みと本文を除いたフィールド (description など)
+    """
+    hits = scan(
+        es,
+        index=index_name,
+        query={"query": {"bool": {"filter": [{"term": {"doc_id": doc_id}}]}}},
+        _source={"excludes": ["embedding", "content"]},
+        size=1000
+    )
+    return {hit["_id"]: hit.get("_source", {}) for hit in hits}
+
+def embedding_in_source(index_name: str) -> bool:
+    """
+    embedding が _source に保存されているか。保存されていないインデックスで部分更新すると埋め込みが失われる。
+    """
+    mappings = es.indices.get_mapping(index=index_name)[index_name]["mappings"]
+    return "embedding" not in mappings.get("_source", {}).get("excludes", [])
+
+def _write_window(job: IngestJob, window: List[tuple], vectors: np.ndarray, make_source: Callable[[int, str], dict]):
+    actions = []
+    labels = []
+    for (number, cid, chunk_hash, chunk), vector in zip(window, vectors):
+        source = make_source(number, chunk)
+        source.update({"doc_id": job.doc_id, "content_hash": chunk_hash, "embedding": vector.tolist()})
+        actions.append({"_id": cid, "_source": source})
+        labels.append({"chunk_number": number})
+    result = bulk_write(job.index_name, actions, labels)
+    with job.lock:
+        job.chunks_written += result["indexed"]
+        job.errors.extend(result["errors"])
+
+def ingest_chunks(job: IngestJob, chunks: Iterable[str], make_source: Callable[[int, str], dict]):
+    """
+    _ingest_chunks を実行し、文書ごとのチャンク数をメトリクスに記録します。
+    """
+    with span("ingest", index=job.index_name, doc_id=job.doc_id):
+        try:
+            _ingest_chunks(job, chunks, make_source)
+        finally:
+            INGEST_CHUNKS.inc(job.chunks_written, result="written")
+            INGEST_CHUNKS.inc(job.chunks_skipped, result="skipped")
+            INGEST_CHUNKS.inc(job.chunks_updated, result="updated")
+            INGEST_CHUNKS.inc(job.chunks_deleted, result="deleted")
+            INGEST_CHUNKS.inc(len(job.errors), result="failed")
+            INGEST_DOCUMENT_CHUNKS.observe(job.chunks_written + job.chunks_skipped + job.chunks_updated)
+
+def _ingest_chunks(job: IngestJob, chunks: Iterable[str], make_source: Callable[[int, str], dict]):
+    """
+    チャンクを doc_id と内容のハッシュから決まる ID で登録します。
+    既に同じ ID のチャンクがあれば埋め込みを行わず、description などが変わっていた場合だけ部分更新します
+    （embedding を _source に保存しないインデックスでは部分更新で埋め込みが失われるため、埋め込み直して登録します）。
+    今回含まれなかった既存のチャンクは最後に削除します。ただし書き込みに1件でも失敗した場合は、置き換わるはずの内容が
+    失われないよう削除せずに残し、chunks_stale に件数を記録します（同じ doc_id で登録し直すと削除されます）。
+
+    埋め込みは INGEST_WINDOW チャンクずつ行い、書き込みは write_executor に渡します。
+    次のウィンドウの埋め込みと前のウィンドウの書き込みが並行して進み、メモリ上に保持するのは高々2ウィンドウ分です。
+    make_source(チャンク番号, チャンク) は登録するドキュメントの description, content を返します。
+    """
+    existing = existing_chunks(job.index_name, job.doc_id)
+    can_update = not existing or embedding_in_source(job.index_name)
+    # メモリを文書の大きさに比例させないため、保持するのは既存チャンクのうち今回も含まれていた ID と、変わったフィールドだけにする。
+    # 同じ文書内で同じ内容のチャンクが繰り返される場合は同じ ID に上書きされるだけなので結果は変わらない
+    retained = set()
+    updates = {}  # チャンク ID -> 部分更新するフィールド
+
+    def new_chunks():
+        for number, chunk in enumerate(chunks, start=1):
+            chunk_hash = content_hash(chunk)
+            cid = chunk_id(job.doc_id, chunk_hash)
+            if cid in existing:
+                retained.add(cid)
+                metadata = {k: v for k, v in make_source(number, chunk).items() if k != "content"}
+                if all(existing[cid].get(k) == v for k, v in metadata.items()):
+                    updates.pop(cid, None)
+                    with job.lock:
+                        job.chunks_skipped += 1
+                    continue
+                if can_update:
+                    updates[cid] = metadata
+                    continue
+            yield number, cid, chunk_hash, chunk
+
+    pending = None
     try:
-        es.indices.create(index=request.index_name, body=index_body, ignore=400)
-        
-        # --- _meta_ ドキュメント登録 ---
-        es.index(
-            index=request.index_name,
-            id="_meta_",
-            document={"description": request.description or ""}
+        for _, window in iter_windows(new_chunks(), INGEST_WINDOW):
+            if job.cancel_event.is_set():
+                break
+            vectors = embed_chunks([chunk for _, _, _, chunk in window])
+            with job.lock:
+                job.chunks_embedded += len(window)
+            if pending is not None:
+                pending.result()
+            pending = write_executor.submit(_write_window, job, window, vectors, make_source)
+    finally:
+        if pending is not None:
+            pending.result()
+
+    if updates:
+        result = bulk_write(
+            job.index_name,
+            [{"_op_type": "update", "_id": cid, "doc": metadata} for cid, metadata in updates.items()],
+            [{"chunk_id": cid} for cid in updates]
         )
-        
+        with job.lock:
+            job.chunks_updated += result["indexed"]
+            job.errors.extend(result["errors"])
+
+    # 途中でキャンセルされた場合は、まだ読んでいない部分のチャンクを消さないように削除しない。
+    # 書き込みに失敗した場合も、古いチャンクが失敗したチャンクの内容を含んでいる可能性があるため削除しない
+    stale = sorted(existing.keys() - retained)
+    with job.lock:
+        failed = bool(job.errors)
+        if stale and failed:
+            job.chunks_stale = len(stale)
+    if stale and not failed and not job.cancel_event.is_set():
+        result = bulk_write(
+            job.index_name,
+            [{"_op_type": "delete", "_id": cid} for cid in stale],
+            [{"chunk_id": cid} for cid in stale]
+        )
+        with job.lock:
+            job.chunks_deleted += result["indexed"]
+            job.errors.extend(result["errors"])
+
+def run_ingest_job(job: IngestJob):
+    """
+    ファイルをストリーミングで読み込み、チャンクに分けて ingest_chunks で差分登録します。
+    """
+    def track_progress(pieces):
+        for piece, progress in pieces:
+            with job.lock:
+                job.progress = progress
+            yield piece
+
+    try:
+        if job.cancel_event.is_set():
+            return
+        with job.lock:
+            job.status = "running"
+            job.started_at = time.time()
+        text = _strip_stream(track_progress(iter_file_text(job.file_path)))
+        chunks = make_chunks(text, job.chunking, job.chunk_size, job.chunk_tokens, job.overlap_tokens)
+
+        ensure_index(job.index_name)
+        with refresh_paused(job.index_name):
+            ingest_chunks(
+                job,
+                chunks,
+                lambda number, chunk: {"description": f"{job.filename} - chunk {number}", "content": chunk}  # title → description
+            )
+        with job.lock:
+            job.total_chunks = job.chunks_embedded + job.chunks_skipped + job.chunks_updated
+    except Exception as e:
+        with job.lock:
+            job.status = "failed"
+            job.errors.append({"error": str(e)})
+    finally:
+        with job.lock:
+            if job.status in ("queued", "running"):
+                job.status = "cancelled" if job.cancel_event.is_set() else "completed"
+            job.finished_at = time.time()
+        if job.file_path:
+            os.remove(job.file_path)
+
+# --- インデックス作成 ---
+@app.post("/create_index/")
+async def create_index(request: IndexRequest):
+    aes = core.get_async_client()
+    try:
+        profile = VectorProfile.from_env(
+            index_type=request.vector_index_type,
+            similarity=request.similarity,
+            m=request.m,
+            ef_construction=request.ef_construction,
+            shards=request.shards,
+            exclude_source=request.exclude_embedding_source,
+            candidate_factor=request.candidate_factor
+        )
+        # モデルの次元数を得るためにモデルの読み込みが必要な場合があるため、スレッドで組み立てる
+        index_body = await run_in_threadpool(build_index_body, request.description or "", profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        res = await aes.indices.create(index=request.index_name, body=index_body, ignore=400)
+        error = res.get("error") or {}
+        if error and error.get("type") != "resource_already_exists_exception":
+            # 未対応の index_options（古いバージョンでの bbq_hnsw など）はここでエラーになる
+            raise HTTPException(status_code=400, detail=error.get("reason") or json.dumps(error, ensure_ascii=False))
+        if not res.get("acknowledged", False):
+            # 既に存在するインデックスは説明だけを更新する（格納方式は作成時のまま）
+            mappings = await aes.indices.get_mapping(index=request.index_name)
+            meta = mappings[request.index_name]["mappings"].get("_meta", {})
+            await aes.indices.put_mapping(index=request.index_name, meta={**meta, "description": request.description or ""})
+        await invalidate_search_cache_async(request.index_name, catalog=True)
+
         return {
             "message": f"Index '{request.index_name}' created successfully.",
-            "index_description": request.description or "No description"
+            "index_description": request.description or "No description",
+            "vector": profile.to_meta() if res.get("acknowledged", False) else None
         }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# --- 旧形式の説明 (_meta_ ドキュメント) を mapping の _meta に移行 ---
+@app.post("/migrate_index_meta/")
+async def migrate_index_meta():
+    """
+    以前のバージョンで作成されたインデックスの _meta_ ドキュメントを mapping の _meta に移し、_meta_ ドキュメントを削除します。
+    複数のインデックスは並行して移行します。
+    """
+    aes = core.get_async_client()
+
+    async def migrate(doc: dict) -> dict:
+        description = doc["_source"].get("description", "")
+        await aes.indices.put_mapping(index=doc["_index"], meta={"description": description})
+        await aes.delete(index=doc["_index"], id="_meta_", refresh=True)
+        await invalidate_search_cache_async(doc["_index"], catalog=True)
+        return {"index": doc["_index"], "description": description}
+
+    try:
+        mappings = await aes.indices.get_mapping(index="*", expand_wildcards="open")
+        legacy = [
+            name for name, body in mappings.items()
+            if not name.startswith(".") and "description" not in body.get("mappings", {}).get("_meta", {})
+        ]
+        migrated = []
+        if legacy:
+            res = await aes.mget(docs=[{"_index": name, "_id": "_meta_"} for name in legacy])
+            migrated = await asyncio.gather(*(migrate(doc) for doc in res["docs"] if doc.get("found")))
+        return {"migrated": list(migrated)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- ドキュメント登録（チャンク化対応） ---
+# 埋め込みと bulk 登録は CPU とスレッドを使う処理のため、同期関数としてスレッドプールで実行する
 @app.post("/index_document_chunked/")
 def index_document_chunked(request: DocumentChunkRequest):
+    """
+    テキストをチャンク化して登録します。
+    同じ doc_id（省略時は description）で再登録すると、変更のないチャンクは埋め込み・書き込みを省略し、
+    無くなったチャンクは削除します。
+    """
+    chunking = check_chunking(request.chunking)
     try:
-        chunks = [request.content[i:i+request.chunk_size] for i in range(0, len(request.content), request.chunk_size)]
-        for chunk in chunks:
-            vector = embedding_model.encode(chunk).tolist()
-            doc = {
-                "description": request.description,
-                "content": chunk,
-                "embedding": vector
-            }
-            es.index(index=request.index_name, body=doc)
-        return {"message": f"Document indexed into '{request.index_name}' in {len(chunks)} chunks"}
+        job = IngestJob(
+            filename=None,
+            index_name=request.index_name,
+            chunk_size=request.chunk_size,
+            doc_id=request.doc_id or request.description,
+            chunking=chunking,
+            chunk_tokens=request.chunk_tokens,
+            overlap_tokens=request.overlap_tokens
+        )
+        chunks = make_chunks([request.content], chunking, request.chunk_size, request.chunk_tokens, request.overlap_tokens)
+        ensure_index(request.index_name)
+        with refresh_paused(request.index_name):
+            ingest_chunks(
+                job,
+                chunks,
+                lambda number, chunk: {"description": request.description, "content": chunk}
+            )
+        return {
+            "message": (
+                f"Document '{job.doc_id}' indexed into '{request.index_name}': "
+                f"{job.chunks_written} written, {job.chunks_updated} updated, {job.chunks_skipped} unchanged, "
+                f"{job.chunks_deleted} removed"
+                + (f", {job.chunks_stale} stale kept after write errors" if job.chunks_stale else "")
+            ),
+            "indexed": job.chunks_written,
+            "skipped": job.chunks_skipped,
+            "updated": job.chunks_updated,
+            "deleted": job.chunks_deleted,
+            "stale": job.chunks_stale,
+            "errors": job.errors
+        }
+    except ValueError as e:
+        # chunk_tokens / overlap_tokens の指定が不正な場合
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- ファイルアップロードからインデックスに登録するエンドポイント ---
 @app.post("/index_file/")
-async def index_file(file: UploadFile = File(...), index_name: str = "rag_docs", chunk_size: int = 500):
-    tmp_path = f"/tmp/{file.filename}"
-    with open(tmp_path, "wb") as f:
-        f.write(await file.read())
+async def index_file(
+    file: UploadFile = File(...),
+    index_name: str = "rag_docs",
+    chunk_size: int = 500,
+    doc_id: Optional[str] = None,
+    chunking: Optional[str] = None,
+    chunk_tokens: Optional[int] = None,
+    overlap_tokens: Optional[int] = None
+):
+    """
+    アップロードされたファイルをブロック単位で一時ファイルにコピーし、取り込みジョブとして登録します。
+    埋め込みと登録はバックグラウンドで行われるため、進捗は /jobs/{job_id} で確認してください。
+    同じ doc_id（省略時はファイル名）で再アップロードすると、変更のあったチャンクだけが登録されます。
+    """
+    chunking = check_chunking(chunking)
+    ext = os.path.splitext(file.filename)[1].lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="対応していないファイル形式です。txtかdocxを使用してください。")
     try:
-        chunks = preprocess_file(tmp_path, chunk_size)
-        for i, chunk_info in enumerate(chunks):
-            doc_body = {
-                "description": f"{file.filename} - chunk {i+1}",  # title → description
-                "content": chunk_info["content"],
-                "embedding": chunk_info["embedding"]
-            }
-            es.index(index=index_name, document=doc_body)
-        return {"message": f"{len(chunks)} chunks from file '{file.filename}' indexed successfully."}
-    finally:
-        os.remove(tmp_path)
+        # ジョブとして受け付けた後に失敗しないよう、チャンク分割の指定はここで確かめる（tokens はモデルを読み込む）
+        await run_in_threadpool(make_chunker, chunking, chunk_size, chunk_tokens, overlap_tokens)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
+        await run_in_threadpool(shutil.copyfileobj, file.file, tmp)
+
+    job = IngestJob(
+        filename=file.filename,
+        index_name=index_name,
+        chunk_size=chunk_size,
+        doc_id=doc_id or file.filename,
+        file_path=tmp.name,
+        chunking=chunking,
+        chunk_tokens=chunk_tokens,
+        overlap_tokens=overlap_tokens
+    )
+    register_job(job)
+    embed_executor.submit(run_ingest_job, job)
+    return {
+        "message": f"File '{file.filename}' queued for indexing into '{index_name}'.",
+        "job_id": job.job_id,
+        "status": job.status
+    }
+
+# --- 取り込みジョブ一覧 ---
+@app.get("/jobs/")
+def list_jobs():
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+    return {"jobs": [job.to_dict() for job in jobs]}
+
+# --- 取り込みジョブの進捗 ---
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return get_job(job_id).to_dict()
+
+# --- 取り込みジョブのキャンセル ---
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """
+    ジョブにキャンセルを要求します。
+    実行中のジョブは処理中のウィンドウの書き込みが終わった時点で停止し、それまでに登録されたチャンクは残ります。
+    """
+    job = get_job(job_id)
+    job.cancel_event.set()
+    return job.to_dict()
 
 # --- ハイブリッド検索エンドポイント ---
 @app.get("/search/")
-def search(index_name: str, query: str, top_k: int = 3):
+async def search(
+    index_name: str,
+    query: str,
+    top_k: int = 3,
+    mode: str = Query("hybrid", description="hybrid / vector / lexical"),
+    num_candidates: Optional[int] = Query(None, description="kNN 検索の候補数（省略時はインデックスの格納方式に応じて決定）"),
+    rank_window_size: int = Query(50, description="ハイブリッド検索で統合の対象とする各検索の取得件数"),
+    fusion: str = Query("rrf", description="rrf / weighted"),
+    rrf_k: int = 60,
+    lexical_weight: float = 1.0,
+    vector_weight: float = 1.0,
+    filters: Optional[str] = Query(None, description='JSON 形式の keyword フィールドの完全一致フィルタ 例: {"doc_id": "manual.txt"}'),
+    rerank: Optional[bool] = Query(None, description="クロスエンコーダーで再ランキングするか（省略時は RERANK_DEFAULT）"),
+    rerank_candidates: Optional[int] = Query(None, description="再ランキングする候補数（省略時は RERANK_CANDIDATES）")
+):
     try:
-        query_vector = embedding_model.encode(query).tolist()
-        knn_query = {
-            "knn": {
-                "field": "embedding",
-                "query_vector": query_vector,
-                "k": top_k,
-                "num_candidates": 100
-            }
-        }
+        params = SearchParams(
+            top_k=top_k,
+            mode=mode,
+            num_candidates=num_candidates,
+            rank_window_size=rank_window_size,
+            fusion=fusion,
+            rrf_k=rrf_k,
+            lexical_weight=lexical_weight,
+            vector_weight=vector_weight,
+            filters=json.loads(filters) if filters else {},
+            rerank=rerank,
+            rerank_candidates=rerank_candidates
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        res = es.search(index=index_name, body=knn_query)
-        results = [
-            {
-                "description": hit["_source"].get("description", ""),
-                "content": hit["_source"].get("content", ""),
-                "score": hit["_score"]
-            }
-            for hit in res["hits"]["hits"]
-        ]
-        return {"results": results}
+    try:
+        return {"results": await core.search_async(index_name, query, params)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# --- インデックス一覧 ---
-@app.get("/list_indices/")
-def list_indices():
-    try:
-        # 全インデックス名取得
-        indices_info = es.indices.get(index="*")
-        indices_list = []
+# --- キャッシュ統計 ---
+@app.get("/cache_stats/")
+def cache_stats():
+    return core.cache_stats()
 
-        for index_name in indices_info.keys():
-            # 各インデックスの _meta_ ドキュメント取得
-            try:
-                meta_res = es.get(index=index_name, id="_meta_")
-                description = meta_res["_source"].get("description", "")
-            except:
-                description = ""  # _meta_ がない場合は空文字
+# --- 埋め込み（MCP サーバーなど同一ホストの他サービスから利用） ---
+@app.get("/embed/")
+def embed_info():
+    return {"model": embedder.model_id, "dim": embedder.dim, "lowercase": embedder.lowercase}
 
-            indices_list.append({"index": index_name, "description": description})
+@app.post("/embed/")
+async def embed(request: EmbedRequest):
+    vectors = await core.encode_async(request.texts)
+    return {"model": embedder.model_id, "vectors": vectors.tolist()}
 
-        return {"indices": indices_list}
+# --- メトリクス（Prometheus 形式） ---
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+# --- ヘルスチェック ---
+@app.get("/healthz")
+def healthz():
+    """
+    プロセスが応答できるかだけを返します（モデルの読み込み中でも 200）。
+    """
+    return {"status": "ok"}
 
+@app.get("/readyz")
+async def readyz():
+    """
+    モデルの warm-up が済み、Elasticsearch に接続できる場合に 200、それ以外は 503 を返します。
+    """
+    state = await core.readiness_async()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+# --- インデックス一覧 ---
+@app.get("/list_indices/")
+async def list_indices():
+    try:
+        return {"indices": await core.list_indices_async()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- インデックス内容取得 ---
 @app.get("/index_content/")
-def index_content(index_name: str = Query(..., description="取得したいIndex名")):
+async def index_content(index_name: str = Query(..., description="取得したいIndex名")):
     try:
-        res = es.search(index=index_name, query={"match_all": {}}, size=100)
+        # 旧形式のインデックスにある _meta_ ドキュメントは含めない
+        res = await core.get_async_client().search(
+            index=index_name,
+            query={"bool": {"must_not": [{"ids": {"values": ["_meta_"]}}]}},
+            source=SOURCE_FILTER,
+            size=100
+        )
         documents = [
             {
                 "description": hit["_source"].get("description"),
@@ -204,23 +1008,222 @@ def index_content(index_name: str = Query(..., description="取得したいIndex
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- インデックスのエクスポート（NDJSON） ---
+def export_source_filter(fields: Optional[str], include_embedding: bool):
+    """
+    fields（カンマ区切り）を省略した場合は embedding 以外の全フィールドを返します。
+    """
+    if fields:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+        return names + ["embedding"] if include_embedding and "embedding" not in names else names
+    return True if include_embedding else SOURCE_FILTER
+
+@app.get("/export_index/")
+async def export_index(
+    index_name: str = Query(..., description="エクスポートするインデックス名"),
+    fields: Optional[str] = Query(None, description="出力するフィールド（カンマ区切り）。省略時は embedding 以外の全て"),
+    include_embedding: bool = Query(False, description="embedding を含める（/import_index/ で埋め込み直さずに復元できる）"),
+    page_size: int = Query(EXPORT_PAGE_SIZE, ge=1, le=10000)
+):
+    """
+    インデックスの全ドキュメントを NDJSON でストリーミングします。
+    1行目はインデックスの定義 {"index": ..., "mappings": ...}、2行目以降は {"_id": ..., "_source": ...} です。
+    point in time で検索開始時点の内容を固定し、search_after で page_size 件ずつ読み進めるため、件数の上限はありません。
+    """
+    aes = core.get_async_client()
+    try:
+        if not await aes.indices.exists(index=index_name):
+            raise HTTPException(status_code=404, detail=f"Index '{index_name}' does not exist.")
+        mappings = (await aes.indices.get_mapping(index=index_name))[index_name]["mappings"]
+        if include_embedding and "embedding" in mappings.get("_source", {}).get("excludes", []):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Index '{index_name}' does not store embeddings in _source; export without include_embedding and re-embed on import."
+            )
+        pit_id = (await aes.open_point_in_time(index=index_name, keep_alive=EXPORT_KEEP_ALIVE))["id"]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    source = export_source_filter(fields, include_embedding)
+
+    async def lines():
+        nonlocal pit_id
+        try:
+            yield json.dumps({"index": index_name, "mappings": mappings}, ensure_ascii=False) + "\n"
+            after = None
+            while True:
+                with measure(ES_SECONDS, "es.search", {"index": index_name}, operation="export"):
+                    res = await aes.search(
+                        pit={"id": pit_id, "keep_alive": EXPORT_KEEP_ALIVE},
+                        # 旧形式のインデックスにある _meta_ ドキュメントは含めない
+                        query={"bool": {"must_not": [{"ids": {"values": ["_meta_"]}}]}},
+                        sort=[{"_shard_doc": "asc"}],
+                        search_after=after,
+                        size=page_size,
+                        source=source,
+                        track_total_hits=False
+                    )
+                pit_id = res.get("pit_id", pit_id)
+                hits = res["hits"]["hits"]
+                if not hits:
+                    break
+                yield "".join(
+                    json.dumps({"_id": hit["_id"], "_source": hit.get("_source", {})}, ensure_ascii=False) + "\n"
+                    for hit in hits
+                )
+                after = hits[-1]["sort"]
+        finally:
+            try:
+                await aes.close_point_in_time(id=pit_id)
+            except Exception as e:
+                logger.warning("Failed to close point in time for '%s': %s", index_name, e)
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{index_name}.ndjson"'}
+    )
+
+# --- インデックスのインポート（/export_index/ の出力から復元） ---
+def create_index_from_export(index_name: str, mappings: dict):
+    """
+    エクスポート元と同じ mapping（説明・格納方式を含む）でインデックスを作成します。
+    """
+    profile = VectorProfile.from_meta(mappings.get("_meta", {}).get("vector"))
+    shards = profile.shards if profile else 1
+    body = {"settings": {"index": {"number_of_shards": shards, "number_of_replicas": 0}}, "mappings": mappings}
+    es.indices.create(index=index_name, body=body, ignore=400)
+    invalidate_search_cache(index_name, catalog=True)
+
+def import_batch(index_name: str, docs: List[dict]) -> dict:
+    """
+    embedding を含むドキュメントはそのまま登録し、含まないドキュメントは content を埋め込み直してから登録します。
+    embedding も content も無いドキュメント（fields を絞ったエクスポートなど）は空文字の埋め込みで登録せず、errors に含めます。
+    """
+    errors = [
+        {"_id": doc["_id"], "error": "document has neither embedding nor content to embed"}
+        for doc in docs if doc["_source"].get("embedding") is None and not doc["_source"].get("content")
+    ]
+    if errors:
+        skipped = {error["_id"] for error in errors}
+        docs = [doc for doc in docs if doc["_id"] not in skipped]
+    missing = [doc for doc in docs if doc["_source"].get("embedding") is None]
+    if missing:
+        vectors = embed_chunks([doc["_source"]["content"] for doc in missing])
+        for doc, vector in zip(missing, vectors):
+            doc["_source"]["embedding"] = vector.tolist()
+    labels = [{"_id": doc["_id"]} for doc in docs]
+    result = bulk_write(index_name, ({"_id": doc["_id"], "_source": doc["_source"]} for doc in docs), labels)
+    return {**result, "errors": errors + result["errors"], "embedded": len(missing)}
+
+@app.post("/import_index/")
+async def import_index(
+    request: Request,
+    index_name: Optional[str] = Query(None, description="登録先のインデックス名。省略時はエクスポート元と同じ名前")
+):
+    """
+    /export_index/ の NDJSON をリクエスト本文で受け取り、ストリーミングで読みながら bulk 登録します。
+    登録先のインデックスがなければエクスポート元の mapping で作成します。_id は引き継ぐため、同じ内容を再度インポートしても重複しません。
+    embedding を含むエクスポートは埋め込みを行わずに復元でき、含まないドキュメントだけをこのサーバーのモデルで埋め込み直します。
+
+    例:
+        curl "http://localhost:8002/export_index/?index_name=a&include_embedding=true" |
+            curl -X POST --data-binary @- -H "Content-Type: application/x-ndjson" "http://localhost:8002/import_index/?index_name=b"
+    """
+    totals = {"indexed": 0, "embedded": 0, "errors": []}
+    stack = ExitStack()
+    target = index_name
+    opened = False  # 登録先のインデックスを用意し、refresh を止めたか
+    batch = []
+    buffer = b""
+
+    async def flush():
+        nonlocal batch
+        if batch:
+            result = await run_in_threadpool(import_batch, target, batch)
+            totals["indexed"] += result["indexed"]
+            totals["embedded"] += result["embedded"]
+            totals["errors"].extend(result["errors"])
+            batch = []
+
+    async def open_target(mappings: Optional[dict]):
+        nonlocal opened
+        if not target:
+            raise HTTPException(status_code=400, detail="index_name is required.")
+        if mappings is None:
+            # 定義の行がないファイルは、通常の登録と同じ mapping で作成する
+            await run_in_threadpool(ensure_index, target)
+        elif not await run_in_threadpool(es.indices.exists, index=target):
+            await run_in_threadpool(create_index_from_export, target, mappings)
+        await run_in_threadpool(stack.enter_context, refresh_paused(target))
+        opened = True
+
+    async def handle(line: bytes):
+        nonlocal target
+        if not line.strip():
+            return
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid NDJSON line: {e}")
+        if "_source" not in record:
+            # 1行目のインデックスの定義
+            if not opened:
+                target = target or record.get("index")
+                # mappings の無い定義の行は、定義の行が無いファイルと同じく通常の mapping で作成する
+                await open_target(record.get("mappings") or None)
+            return
+        if not opened:
+            await open_target(None)
+        batch.append({"_id": record.get("_id") or str(uuid.uuid4()), "_source": record["_source"]})
+        if len(batch) >= BULK_CHUNK_SIZE:
+            await flush()
+
+    try:
+        async for chunk in request.stream():
+            buffer += chunk
+            *complete, buffer = buffer.split(b"\n")
+            for line in complete:
+                await handle(line)
+        await handle(buffer)
+        await flush()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await run_in_threadpool(stack.close)
+    return {
+        "index": target,
+        "indexed": totals["indexed"],
+        "embedded": totals["embedded"],
+        "errors": totals["errors"][:100],
+        "error_count": len(totals["errors"])
+    }
+
 # --- インデックス削除エンドポイント ---
 @app.delete("/delete_index/")
-def delete_index(index_name: str = Query(..., description="削除したいインデックス名")):
+async def delete_index(index_name: str = Query(..., description="削除したいインデックス名")):
     """
     指定した Elasticsearch インデックスを削除します。
     存在しない場合はエラーを返します。
     """
+    aes = core.get_async_client()
     try:
-        if not es.indices.exists(index=index_name):
+        if not await aes.indices.exists(index=index_name):
             raise HTTPException(status_code=404, detail=f"Index '{index_name}' does not exist.")
         
-        res = es.indices.delete(index=index_name)
+        res = await aes.indices.delete(index=index_name)
+        _ensured_indices.discard(index_name)
+        await invalidate_search_cache_async(index_name, catalog=True)
         if res.get("acknowledged", False):
             return {"message": f"Index '{index_name}' deleted successfully."}
         else:
             raise HTTPException(status_code=500, detail=f"Failed to delete index '{index_name}'.")
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
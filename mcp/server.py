@@ -1,67 +1,165 @@
 import os
+import time
+from typing import List, Optional
 from dotenv import load_dotenv
-from elasticsearch import Elasticsearch
-from sentence_transformers import SentenceTransformer
 from fastmcp import FastMCP
+from fastmcp.server.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+
+from retrieval import core
+from retrieval.search import SearchParams
+from retrieval.telemetry import CONTENT_TYPE, REGISTRY, TOOL_SECONDS, server_span, setup_tracing
 
 load_dotenv()
 mcp_server_port = int(os.getenv("MCP_SEVER_PORT"))
-ELASTICSEARCH_ENDPOINT = os.getenv("ELASTICSEARCH_ENDPOINT")
+EMBEDDING_WARMUP = os.getenv("EMBEDDING_WARMUP", "background")  # background / blocking / off
+# TRACING が設定されている場合、エージェントがリクエストの _meta に入れた trace context の子としてツールの span が記録される
+setup_tracing("mcp-server")
 mcp = FastMCP("MyRAGMCP")
 
-# --- ElasticSearch 接続 ---
-es = Elasticsearch(ELASTICSEARCH_ENDPOINT)
 
-# --- Hugging Face 埋め込みモデル ---
-embedding_model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-VECTOR_DIM = embedding_model.get_sentence_embedding_dimension()
+def _request_meta(context) -> dict:
+    """
+    ツール呼び出しのリクエストの _meta（エージェントの MCPClientPool が traceparent / tracestate を入れる）。
+    """
+    try:
+        meta = context.fastmcp_context.request_context.meta
+    except (AttributeError, LookupError, ValueError):
+        return {}
+    if meta is None:
+        return {}
+    return meta if isinstance(meta, dict) else meta.model_dump(exclude_none=True)
+
+
+class ToolMetricsMiddleware(Middleware):
+    """
+    ツールごとの実行時間を成功・失敗別に記録し、_meta の trace context の子としてツールの span を作成します。
+    """
+
+    async def on_call_tool(self, context, call_next):
+        started = time.perf_counter()
+        status = "error"
+        try:
+            with server_span(f"tools/call {context.message.name}", _request_meta(context)):
+                result = await call_next(context)
+            status = "ok"
+            return result
+        finally:
+            TOOL_SECONDS.observe(time.perf_counter() - started, tool=context.message.name, status=status)
 
-# --- ベクトル検索エンドポイント ---
+
+mcp.add_middleware(ToolMetricsMiddleware())
+
+# Elasticsearch クライアント・埋め込みモデル・キャッシュは retrieval.core で共有する。
+# EMBEDDING_SERVER_URL を設定すると、埋め込みは Indexing API のモデルに委譲され、このプロセスではモデルを読み込まない。
+# ツールは非同期関数として AsyncElasticsearch を使い、埋め込みはマイクロバッチのワーカーかスレッドプールで行うため、
+# 1プロセスで多数のエージェントのセッションを同時に処理できる。
+
+# --- ハイブリッド検索エンドポイント ---
 @mcp.tool()
-def search(index_name: str, query: str, top_k: int = 3):
+async def search(
+    index_name: str,
+    query: str,
+    top_k: int = 3,
+    mode: str = "hybrid",
+    num_candidates: Optional[int] = None,
+    fusion: str = "rrf",
+    lexical_weight: float = 1.0,
+    vector_weight: float = 1.0,
+    filters: Optional[dict] = None,
+    rerank: Optional[bool] = None
+):
     """
-    指定されたインデックスからベクトル検索を行います。
+    指定されたインデックスからハイブリッド検索を行います。
 
     このツールは以下を組み合わせた検索を提供します:
     - テキスト検索（description, content フィールドに対する multi_match）
     - ベクトル検索（sentence-transformers による埋め込みベクトル）
+    2つの検索結果は RRF (Reciprocal Rank Fusion) で統合されるため、
+    キーワードが一致する文書と意味が近い文書の両方が上位に来ます。
 
     Args:
         index_name (str): 検索対象のインデックス名
         query (str): 検索クエリ
         top_k (int): 取得件数（デフォルト3）
+        mode (str): "hybrid"（デフォルト）/ "vector"（ベクトル検索のみ）/ "lexical"（テキスト検索のみ）
+        num_candidates (int): ベクトル検索で集める候補数（省略時はインデックスの格納方式に応じて決定）。大きいほど精度が上がり遅くなります
+        fusion (str): 統合方法。"rrf"（デフォルト）または "weighted"（正規化したスコアの重み付き和）
+        lexical_weight (float): テキスト検索の重み（デフォルト1.0）
+        vector_weight (float): ベクトル検索の重み（デフォルト1.0）
+        filters (dict): {フィールド名: 値} の完全一致フィルタ（任意）。doc_id（登録時の文書ID、ファイルの場合はファイル名）などの keyword フィールドだけを指定できます 例: {"doc_id": "manual.txt"}
+        rerank (bool): true で多めに取得した候補をクロスエンコーダーで採点し直し、より的確な top_k 件に絞ります（省略時はサーバーの設定）
 
     Returns:
         dict: 検索結果。
-              各要素には description, content, score が含まれます。
+              各要素には description, content, score が含まれます（再ランキングした場合は rerank_score も）。
     """
     try:
-        query_vector = embedding_model.encode(query).tolist()
-        knn_query = {
-            "knn": {
-                "field": "embedding",
-                "query_vector": query_vector,
-                "k": top_k,
-                "num_candidates": 100
-            }
-        }
-
-        res = es.search(index=index_name, body=knn_query)
-        results = [
-            {
-                "description": hit["_source"].get("description", ""),
-                "content": hit["_source"].get("content", ""),
-                "score": hit["_score"]
-            }
-            for hit in res["hits"]["hits"]
-        ]
-        return {"results": results}
+        params = SearchParams(
+            top_k=top_k,
+            mode=mode,
+            num_candidates=num_candidates,
+            fusion=fusion,
+            lexical_weight=lexical_weight,
+            vector_weight=vector_weight,
+            filters=filters or {},
+            rerank=rerank
+        )
+    except ValueError as e:
+        raise RuntimeError(f"検索パラメータが不正です: {str(e)}")
+
+    try:
+        return {"results": await core.search_async(index_name, query, params)}
+    except Exception as e:
+        raise RuntimeError(f"検索処理でエラーが発生しました: {str(e)}")
+
+# --- 複数インデックスの横断検索 ---
+@mcp.tool()
+async def search_many(
+    query: str,
+    index_names: Optional[List[str]] = None,
+    top_k: int = 5,
+    per_index: int = 3,
+    mode: str = "hybrid",
+    normalization: str = "auto",
+    filters: Optional[dict] = None,
+    rerank: Optional[bool] = None
+):
+    """
+    複数のインデックスを1回の呼び出しでまとめて検索し、スコアの高い順に統合した結果を返します。
+    どのインデックスを検索すべきか分からない場合や、複数のインデックスに情報がありそうな場合は、
+    list_indices と search を繰り返す代わりにこのツールを使ってください。
+
+    Args:
+        query (str): 検索クエリ
+        index_names (list[str]): 検索対象のインデックス名のリスト（省略時は説明が登録されている全インデックス）
+        top_k (int): 取得件数（デフォルト5）
+        per_index (int): 1つのインデックスから採用する最大件数（デフォルト3）
+        mode (str): "hybrid"（デフォルト）/ "vector" / "lexical"
+        normalization (str): インデックス間のスコアの揃え方。"auto"（デフォルト）/ "minmax"（インデックスごとに0〜1に正規化）/ "none"
+        filters (dict): {フィールド名: 値} の完全一致フィルタ（任意）。doc_id（登録時の文書ID、ファイルの場合はファイル名）などの keyword フィールドだけを指定できます 例: {"doc_id": "manual.txt"}
+        rerank (bool): true で全インデックスの候補をクロスエンコーダーで採点し直して並べ替えます（省略時はサーバーの設定）
+
+    Returns:
+        dict: indices (検索したインデックス名), results, errors (検索に失敗したインデックスとエラー内容)。
+              results の各要素には index, description, content, score が含まれます（再ランキングした場合は rerank_score も）。
+    """
+    try:
+        params = SearchParams(top_k=top_k, mode=mode, filters=filters or {}, rerank=rerank)
+    except ValueError as e:
+        raise RuntimeError(f"検索パラメータが不正です: {str(e)}")
+
+    try:
+        return await core.search_many_async(index_names, query, params, per_index=per_index, normalization=normalization)
+    except ValueError as e:
+        raise RuntimeError(f"検索パラメータが不正です: {str(e)}")
     except Exception as e:
         raise RuntimeError(f"検索処理でエラーが発生しました: {str(e)}")
 
 # --- インデックス一覧 ---
 @mcp.tool()
-def list_indices():
+async def list_indices():
     """
     利用可能なインデックスの一覧を取得します。
 
@@ -72,28 +170,48 @@ def list_indices():
         dict: インデックスの辞書。
               各要素には index (インデックス名) と description (説明) が含まれます。
               descriptionはIndexの説明のためユーザーからの入力に応じてどのIndexでの検索が適切かを判断することができます。
-              description は _meta_ ドキュメントから取得できない場合は空文字となります。
+              description はインデックス作成時に登録されたもので、登録されていない場合は空文字となります。
     """
     try:
-        # 全インデックス名取得
-        indices_info = es.indices.get(index="*")
-        indices_list = []
-
-        for index_name in indices_info.keys():
-            # 各インデックスの _meta_ ドキュメント取得
-            try:
-                meta_res = es.get(index=index_name, id="_meta_")
-                description = meta_res["_source"].get("description", "")
-            except:
-                description = ""  # _meta_ がない場合は空文字
-
-            indices_list.append({"index": index_name, "description": description})
-
-        return {"indices": indices_list}
-
+        return {"indices": await core.list_indices_async()}
     except Exception as e:
         raise RuntimeError(f"検索エラー: {str(e)}")
 
+# --- ヘルスチェック ---
+@mcp.custom_route("/healthz", methods=["GET"])
+async def healthz(request: Request) -> JSONResponse:
+    return JSONResponse({"status": "ok"})
+
+@mcp.custom_route("/readyz", methods=["GET"])
+async def readyz(request: Request) -> JSONResponse:
+    state = await core.readiness_async()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+# --- キャッシュ統計（エージェント向けのツールではなく HTTP エンドポイントとして公開） ---
+@mcp.custom_route("/cache_stats", methods=["GET"])
+async def cache_stats(request: Request) -> JSONResponse:
+    return JSONResponse(core.cache_stats())
+
+# --- メトリクス（Prometheus 形式） ---
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics(request: Request) -> PlainTextResponse:
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+# --- 検索結果キャッシュの無効化（インデックスへの書き込み時に Indexing API から呼ばれる） ---
+@mcp.custom_route("/invalidate", methods=["POST"])
+async def invalidate(request: Request) -> JSONResponse:
+    body = await request.json()
+    index_name = body.get("index_name")
+    if not index_name:
+        return JSONResponse({"detail": "index_name is required."}, status_code=400)
+    core.invalidate(index_name, catalog=bool(body.get("catalog", False)))
+    return JSONResponse({"message": f"Search cache for '{index_name}' invalidated."})
+
 
 if __name__ == "__main__":
+    # モデルの読み込み（または委譲先への接続確認）を起動と並行して行う
+    if EMBEDDING_WARMUP == "blocking":
+        core.warm_up()
+    elif EMBEDDING_WARMUP == "background":
+        core.start_warm_up()
     mcp.run(transport="http", host="0.0.0.0", port=mcp_server_port)
\ No newline at end of file
@@ -0,0 +1,291 @@
+"""
+検索経路で共有するキャッシュ。
+"""
+import atexit
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+
+
+def normalize_query(query: str, casefold: bool = False) -> str:
+    """
+    クエリ文字列を正規化します（NFKC・空白の統一）。
+    casefold=True は小文字化するトークナイザー (all-MiniLM-L6-v2 などの uncased モデル) でのみ指定してください。
+    大文字・小文字を区別するモデルでは、小文字化すると埋め込みが変わります。
+    """
+    query = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", query)).strip()
+    return query.casefold() if casefold else query
+
+
+class QueryEmbeddingCache:
+    """
+    クエリの埋め込みベクトルを (モデル名, 正規化したクエリ) をキーに保持する LRU + TTL キャッシュ。
+    埋め込むのもキーと同じ正規化したクエリで、表記の違うクエリが同じキーを共有しても結果は変わりません。
+    lowercase はモデルのトークナイザーが小文字化するか（True の場合だけキーでも大文字・小文字を区別しない）です。
+
+    path を指定すると npz ファイルに保存し、次回起動時に読み込みます。
+    保存は persist_every 回のミスごとと、プロセス終了時に行います。
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600,
+        path: Optional[str] = None,
+        persist_every: int = 100,
+        lowercase: bool = False
+    ):
+        self.model_name = model_name
+        self.lowercase = lowercase
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.persist_every = persist_every
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (model_name, query) -> (作成時刻, ベクトル)
+        self._unsaved = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if path:
+            self._load()
+            atexit.register(self.save)
+
+    @classmethod
+    def from_env(cls, model_name: str, lowercase: bool = False) -> "QueryEmbeddingCache":
+        """
+        環境変数 QUERY_CACHE_SIZE / QUERY_CACHE_TTL（秒, 0 で無期限）/ QUERY_CACHE_PATH から設定を読み込みます。
+        """
+        return cls(
+            model_name,
+            max_entries=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+            ttl_seconds=float(os.getenv("QUERY_CACHE_TTL", "3600")),
+            path=os.getenv("QUERY_CACHE_PATH") or None,
+            lowercase=lowercase
+        )
+
+    def normalize(self, query: str) -> str:
+        """
+        キーにも埋め込みにも使う、正規化したクエリ。
+        """
+        return normalize_query(query, casefold=self.lowercase)
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds
+
+    def get(self, query: str) -> Optional[np.ndarray]:
+        key = (self.model_name, self.normalize(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0]):
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, query: str, vector: np.ndarray):
+        key = (self.model_name, self.normalize(query))
+        vector = np.asarray(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (time.time(), vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._unsaved += 1
+            persist = self.path and self._unsaved >= self.persist_every
+        if persist:
+            self.save()
+
+    def get_or_compute(self, query: str, encode: Callable[[str], np.ndarray]) -> np.ndarray:
+        """
+        キャッシュにあればそのベクトルを、なければ正規化したクエリを encode した結果を保存して返します。
+        """
+        query = self.normalize(query)
+        vector = self.get(query)
+        if vector is None:
+            vector = np.asarray(encode(query), dtype=np.float32)
+            self.put(query, vector)
+        return vector
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "model": self.model_name,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+    # --- 永続化 ---
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            items = [(k, v) for k, v in self._entries.items() if k[0] == self.model_name]
+            self._unsaved = 0
+        if not items:
+            return
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            queries=np.array([k[1] for k, _ in items]),
+            created_at=np.array([v[0] for _, v in items], dtype=np.float64),
+            vectors=np.stack([v[1] for _, v in items]),
+            model=np.array(self.model_name),
+            lowercase=np.array(self.lowercase)
+        )
+        # 書き込み途中で落ちても既存のファイルが壊れないように置き換える
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                # 正規化の方法が異なる（以前のバージョンで保存した）キャッシュは、キーとベクトルが対応しないため使わない
+                if str(data["model"]) != self.model_name or "lowercase" not in data.files:
+                    return
+                if bool(data["lowercase"]) != self.lowercase:
+                    return
+                queries = data["queries"].tolist()
+                created_at = data["created_at"].tolist()
+                vectors = data["vectors"].astype(np.float32)
+        except Exception:
+            return  # 壊れたキャッシュファイルは無視して空の状態から始める
+        for query, ts, vector in list(zip(queries, created_at, vectors))[-self.max_entries:]:
+            if not self._expired(ts):
+                vector.setflags(write=False)
+                self._entries[(self.model_name, query)] = (ts, vector)
+
+
+class SearchResultCache:
+    """
+    検索結果を (インデックス名, 世代, 検索パラメータ) をキーに保持する LRU + TTL キャッシュ。
+
+    インデックスへの書き込み・削除時に invalidate() で世代を進めると、そのインデックスの古い結果は二度と返されません。
+    複数インデックス（カンマ区切り・ワイルドカード）の検索は、いずれかのインデックスが更新されるたびに無効になります。
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (index名, 世代, パラメータ) -> (作成時刻, 結果)
+        self._generations = {}         # index名 -> 世代
+        self._global_generation = 0    # いずれかのインデックスが更新されるたびに進む世代
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls) -> "SearchResultCache":
+        """
+        環境変数 RESULT_CACHE_SIZE / RESULT_CACHE_TTL（秒, 0 で無期限）から設定を読み込みます。
+        """
+        return cls(
+            max_entries=int(os.getenv("RESULT_CACHE_SIZE", "512")),
+            ttl_seconds=float(os.getenv("RESULT_CACHE_TTL", "300"))
+        )
+
+    @staticmethod
+    def _is_multi(index_name: str) -> bool:
+        return "," in index_name or "*" in index_name
+
+    def _generation(self, index_name: str) -> int:
+        if self._is_multi(index_name):
+            return self._global_generation
+        return self._generations.get(index_name, 0)
+
+    def _lookup(self, index_name: str, params: tuple):
+        """
+        Returns:
+            tuple: (キャッシュにあったか, 結果, 保存時に使うキー)
+        """
+        with self._lock:
+            generation = self._generation(index_name)
+            key = (index_name, generation, params)
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds > 0 and time.time() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1], key
+            self.misses += 1
+            return False, None, key
+
+    def _store(self, key: tuple, result):
+        index_name, generation, _ = key
+        with self._lock:
+            # 計算中にインデックスが更新された場合、その結果は保存しない
+            if self._generation(index_name) == generation:
+                self._entries[key] = (time.time(), result)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+    def get_or_compute(self, index_name: str, params: tuple, compute: Callable[[], object]):
+        """
+        キャッシュにあればその結果を、なければ compute() の結果を返します。
+        compute() の実行中にインデックスが更新された場合、その結果は保存しません。
+        """
+        found, result, key = self._lookup(index_name, params)
+        if found:
+            return result
+        result = compute()
+        self._store(key, result)
+        return result
+
+    async def get_or_compute_async(self, index_name: str, params: tuple, compute: Callable[[], Awaitable]):
+        """
+        get_or_compute() の非同期版です。compute() はコルーチンを返す関数を渡します。
+        """
+        found, result, key = self._lookup(index_name, params)
+        if found:
+            return result
+        result = await compute()
+        self._store(key, result)
+        return result
+
+    def invalidate(self, index_name: str):
+        with self._lock:
+            self._generations[index_name] = self._generations.get(index_name, 0) + 1
+            self._global_generation += 1
+            self.invalidations += 1
+            for key in [k for k in self._entries if k[0] == index_name or self._is_multi(k[0])]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
@@ -0,0 +1,134 @@
+"""
+インデックスの一覧と説明 (description) のカタログ。
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from retrieval.telemetry import ES_SECONDS, measure
+from retrieval.vector_index import VectorProfile
+
+
+class IndexCatalog:
+    """
+    インデックス名と説明の一覧をまとめて取得し、プロセス内に保持します。
+
+    説明はインデックスの mapping の _meta.description に保存されており、全インデックス分を1回の
+    get_mapping リクエストで取得できます。旧形式（_meta_ ドキュメント）のインデックスがあれば、
+    それらの説明も1回の mget でまとめて取得します。. で始まるシステムインデックスは含めません。
+    create_index / delete_index 時に invalidate() され、それ以外の変更も ttl_seconds で反映されます。
+    同じ mapping の _meta.vector から、各インデックスの埋め込みベクトルの格納方式も保持します。
+    非同期のサーバーからは get_async_client を渡して list_async() を使います。
+    """
+
+    def __init__(self, get_client: Callable, ttl_seconds: float = 60, get_async_client: Optional[Callable] = None):
+        self._get_client = get_client
+        self._get_async_client = get_async_client
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._indices = None
+        self._profiles = {}
+        self._fetched_at = 0.0
+        self._version = 0  # invalidate() のたびに進め、取得中に無効化された結果を保存しないために使う
+        self.fetches = 0
+
+    @staticmethod
+    def _descriptions(mappings: dict):
+        """
+        Returns:
+            tuple: ({index名: 説明}, _meta を持たない旧形式のインデックス名のリスト, {index名: 格納方式})
+        """
+        descriptions = {}
+        legacy = []
+        profiles = {}
+        for name, body in mappings.items():
+            if name.startswith("."):
+                continue
+            meta = body.get("mappings", {}).get("_meta", {})
+            try:
+                profile = VectorProfile.from_meta(meta.get("vector"))
+            except (TypeError, ValueError):
+                profile = None  # 手で書き換えられた _meta などは既定の方針で検索する
+            if profile is not None:
+                profiles[name] = profile
+            if "description" in meta:
+                descriptions[name] = meta["description"]
+            else:
+                legacy.append(name)
+                descriptions[name] = ""  # 説明がない場合は空文字
+        return descriptions, legacy, profiles
+
+    def _catalog(self, descriptions: dict, legacy_docs: List[dict]) -> List[dict]:
+        for doc in legacy_docs:
+            if doc.get("found"):
+                descriptions[doc["_index"]] = doc["_source"].get("description", "")
+        self.fetches += 1
+        return [{"index": name, "description": descriptions[name]} for name in sorted(descriptions)]
+
+    def _fetch(self):
+        es = self._get_client()
+        with measure(ES_SECONDS, "es.get_mapping", operation="catalog"):
+            descriptions, legacy, profiles = self._descriptions(es.indices.get_mapping(index="*", expand_wildcards="open"))
+            legacy_docs = []
+            if legacy:
+                legacy_docs = es.mget(docs=[{"_index": name, "_id": "_meta_"} for name in legacy])["docs"]
+        return self._catalog(descriptions, legacy_docs), profiles
+
+    async def _fetch_async(self):
+        es = self._get_async_client()
+        with measure(ES_SECONDS, "es.get_mapping", operation="catalog"):
+            descriptions, legacy, profiles = self._descriptions(
+                await es.indices.get_mapping(index="*", expand_wildcards="open")
+            )
+            legacy_docs = []
+            if legacy:
+                legacy_docs = (await es.mget(docs=[{"_index": name, "_id": "_meta_"} for name in legacy]))["docs"]
+        return self._catalog(descriptions, legacy_docs), profiles
+
+    def _cached(self) -> Optional[List[dict]]:
+        expired = self.ttl_seconds > 0 and time.time() - self._fetched_at > self.ttl_seconds
+        if self._indices is None or expired:
+            return None
+        return list(self._indices)
+
+    def list(self) -> List[dict]:
+        with self._lock:
+            cached = self._cached()
+            if cached is None:
+                self._indices, self._profiles = self._fetch()
+                self._fetched_at = time.time()
+                cached = list(self._indices)
+            return cached
+
+    async def list_async(self) -> List[dict]:
+        """
+        list() の非同期版です。取得中はロックを保持しないため、同時に期限切れを見た呼び出しはそれぞれ取得します。
+        """
+        with self._lock:
+            cached = self._cached()
+            version = self._version
+        if cached is not None:
+            return cached
+        indices, profiles = await self._fetch_async()
+        with self._lock:
+            if self._version == version:
+                self._indices, self._profiles = indices, profiles
+                self._fetched_at = time.time()
+        return list(indices)
+
+    def vector_profiles(self) -> Dict[str, VectorProfile]:
+        """
+        Returns:
+            dict: インデックス名 -> 埋め込みベクトルの格納方式（_meta.vector を持つインデックスのみ）
+        """
+        self.list()
+        return dict(self._profiles)
+
+    async def vector_profiles_async(self) -> Dict[str, VectorProfile]:
+        await self.list_async()
+        return dict(self._profiles)
+
+    def invalidate(self):
+        with self._lock:
+            self._indices = None
+            self._version += 1
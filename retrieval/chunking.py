@@ -0,0 +1,142 @@
+"""
+文・段落の境界を優先し、埋め込みモデルのトークン数でチャンクの大きさを決めるチャンク分割。
+
+テキスト片の列を受け取るジェネレーターとして動作し、文を TOKENIZE_BATCH_SIZE 件ずつまとめてトークナイズします。
+文字数で区切る方式と違い、文や単語の途中で切れにくく、モデルの入力長を超えて切り捨てられるチャンクも作りません。
+"""
+import re
+import threading
+from collections import deque
+from typing import Iterable, Iterator, List, Tuple
+
+# 文・段落の区切り。空行 > 文末の句読点（閉じ括弧・後続の空白を含む）> 改行 の順に判定する。
+# "." は "3.14" や "e.g" を区切らないよう、後ろに空白がある場合だけ文末とみなす
+_BOUNDARY = re.compile(
+    r"\n[ \t　]*\n\s*"
+    r"|[。．！？!?]+[」』）)\]\"'”’]*\s*"
+    r"|\.[」』）)\]\"'”’]*\s+"
+    r"|\n\s*"
+)
+
+
+def iter_sentences(pieces: Iterable[str], max_chars: int = 2000) -> Iterator[str]:
+    """
+    少しずつ読み込まれるテキスト片を文・段落単位に分けて順に返します。
+    区切りの後ろの空白は直前の文に含めるため、返した文を連結すると元のテキストと一致します。
+    区切りが現れないまま max_chars 文字を超えた場合は、メモリを抑えるため max_chars 文字で区切ります。
+    """
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        pos = 0
+        for m in _BOUNDARY.finditer(buffer):
+            # テキスト片の末尾に接している区切りは、次の片で空白や句読点が続く可能性があるため確定しない
+            if m.end() >= len(buffer):
+                break
+            yield buffer[pos:m.end()]
+            pos = m.end()
+        buffer = buffer[pos:]
+        while len(buffer) > max_chars:
+            yield buffer[:max_chars]
+            buffer = buffer[max_chars:]
+    if buffer:
+        yield buffer
+
+
+class BatchTokenizer:
+    """
+    Hugging Face の fast tokenizer を複数スレッドから使うためのラッパー。
+    fast tokenizer は呼び出しごとに内部状態を書き換えるため、同時に呼ばれないようロックで保護します。
+    """
+
+    def __init__(self, tokenizer):
+        self._tokenizer = tokenizer
+        self._lock = threading.Lock()
+
+    def offsets(self, texts: List[str]) -> List[List[Tuple[int, int]]]:
+        """
+        Returns:
+            list: テキストごとの、各トークンの (開始位置, 終了位置) のリスト（特殊トークンは含まない）
+        """
+        with self._lock:
+            encoded = self._tokenizer(
+                texts,
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+                return_attention_mask=False,
+                return_token_type_ids=False,
+                verbose=False
+            )
+        return encoded["offset_mapping"]
+
+
+class TokenChunker:
+    """
+    文を max_tokens トークン以内に詰めてチャンクを作ります。
+    チャンクの区切りは必ず文の境界になり、次のチャンクの先頭には直前のチャンク末尾の文を overlap_tokens トークン以内で重複させます。
+    1文だけで max_tokens を超える場合は、その文をトークンの境界で分割します。
+    """
+
+    def __init__(self, tokenizer: BatchTokenizer, max_tokens: int, overlap_tokens: int = 0, batch_size: int = 64):
+        if max_tokens <= 0:
+            raise ValueError("max_tokens must be positive.")
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError("overlap_tokens must be between 0 and max_tokens - 1.")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.batch_size = batch_size
+
+    def _tokenized(self, sentences: Iterable[str]) -> Iterator[Tuple[str, int]]:
+        """
+        文を batch_size 件ずつトークナイズし、(文, トークン数) を返します。長すぎる文はここで分割します。
+        """
+        batch = []
+        for sentence in sentences:
+            batch.append(sentence)
+            if len(batch) == self.batch_size:
+                yield from self._split_long(batch)
+                batch = []
+        if batch:
+            yield from self._split_long(batch)
+
+    def _split_long(self, batch: List[str]) -> Iterator[Tuple[str, int]]:
+        for sentence, offsets in zip(batch, self.tokenizer.offsets(batch)):
+            n = len(offsets)
+            if n <= self.max_tokens:
+                yield sentence, n
+                continue
+            # 次のトークンの開始位置で切ると、分割した文を連結したときに元の文と一致する
+            for start in range(0, n, self.max_tokens):
+                end = min(start + self.max_tokens, n)
+                begin = offsets[start][0] if start else 0
+                stop = offsets[end][0] if end < n else len(sentence)
+                yield sentence[begin:stop], end - start
+
+    def chunks(self, pieces: Iterable[str]) -> Iterator[str]:
+        window = deque()  # (文, トークン数)
+        total = 0
+        fresh = False     # window に未出力の文が含まれているか
+        for sentence, n in self._tokenized(iter_sentences(pieces)):
+            if total + n > self.max_tokens and fresh:
+                chunk = "".join(s for s, _ in window).strip()
+                if chunk:
+                    yield chunk
+                # 末尾の文を overlap_tokens 以内で残し、次のチャンクの先頭にする
+                kept = deque()
+                kept_total = 0
+                while window and kept_total + window[-1][1] <= self.overlap_tokens:
+                    s, k = window.pop()
+                    kept.appendleft((s, k))
+                    kept_total += k
+                window, total, fresh = kept, kept_total, False
+            # 重複させた文と合わせて max_tokens を超える場合は、古い文から捨てる
+            while window and total + n > self.max_tokens:
+                total -= window.popleft()[1]
+            window.append((sentence, n))
+            total += n
+            fresh = True
+        if fresh:
+            chunk = "".join(s for s, _ in window).strip()
+            if chunk:
+                yield chunk
@@ -0,0 +1,378 @@
+"""
+Indexing API と MCP サーバーが共有する検索機能。
+
+Elasticsearch クライアント・埋め込み器・キャッシュはプロセスごとに1つだけ作成し、最初に使われた時点で初期化します。
+非同期のサーバー向けに、AsyncElasticsearch を使う *_async 版の関数も提供します。
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from dataclasses import replace
+from typing import List, Optional
+
+import numpy as np
+
+from retrieval.cache import QueryEmbeddingCache, SearchResultCache, normalize_query
+from retrieval.catalog import IndexCatalog
+from retrieval.embedding import MicroBatchingEmbedder, create_embedder
+from retrieval.es import create_async_client, create_client
+from retrieval.rerank import CrossEncoderReranker
+from retrieval.search import RERANK_DEFAULT, SearchParams, federated_search_async, search_index, search_index_async
+from retrieval.telemetry import ES_SECONDS, REGISTRY, SEARCH_SECONDS, measure, with_trace_headers
+
+_lock = threading.RLock()
+_client = None
+_async_client = None
+_embedder = None
+_query_cache = None
+_result_cache = None
+_catalog = None
+_reranker = None
+logger = logging.getLogger(__name__)
+
+
+def get_client():
+    global _client
+    with _lock:
+        if _client is None:
+            _client = create_client()
+        return _client
+
+
+def get_async_client():
+    """
+    プロセスで共有する AsyncElasticsearch。接続プールはイベントループに結び付くため、
+    サーバーの終了時（lifespan の終了処理）に close_async_client() で閉じてください。
+    """
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            _async_client = create_async_client()
+        return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    with _lock:
+        client, _async_client = _async_client, None
+    if client is not None:
+        await client.close()
+
+
+def get_embedder():
+    global _embedder
+    with _lock:
+        if _embedder is None:
+            _embedder = create_embedder()
+        return _embedder
+
+
+def set_embedder(embedder):
+    """
+    使用する埋め込み器を明示的に指定します。
+    埋め込みを提供する側の Indexing API は、EMBEDDING_SERVER_URL が設定されていても自身のモデルを使うために呼び出します。
+    """
+    global _embedder, _query_cache
+    with _lock:
+        _embedder = embedder
+        _query_cache = None
+        return embedder
+
+
+def get_query_cache() -> QueryEmbeddingCache:
+    global _query_cache
+    with _lock:
+        if _query_cache is None:
+            embedder = get_embedder()
+            _query_cache = QueryEmbeddingCache.from_env(embedder.model_id, lowercase=embedder.lowercase)
+        return _query_cache
+
+
+def get_result_cache() -> SearchResultCache:
+    global _result_cache
+    with _lock:
+        if _result_cache is None:
+            _result_cache = SearchResultCache.from_env()
+        return _result_cache
+
+
+def get_catalog() -> IndexCatalog:
+    global _catalog
+    with _lock:
+        if _catalog is None:
+            _catalog = IndexCatalog(
+                get_client,
+                ttl_seconds=float(os.getenv("CATALOG_CACHE_TTL", "60")),
+                get_async_client=get_async_client
+            )
+        return _catalog
+
+
+def get_reranker() -> CrossEncoderReranker:
+    global _reranker
+    with _lock:
+        if _reranker is None:
+            _reranker = CrossEncoderReranker.from_env()
+        return _reranker
+
+
+def _first_stage(params: SearchParams) -> SearchParams:
+    """
+    再ランキングする場合に1段目の検索で使うパラメータ（top_k を候補数に広げたもの）。
+    """
+    if not params.rerank:
+        return params
+    top_k = get_reranker().candidate_count(params.top_k, params.rerank_candidates)
+    return replace(params, top_k=top_k, rerank=False, rerank_candidates=None)
+
+
+def rerank(query: str, results: List[dict], params: SearchParams) -> List[dict]:
+    if not params.rerank:
+        return results
+    return get_reranker().rerank(query, results, params.top_k, params.rerank_candidates)
+
+
+async def rerank_async(query: str, results: List[dict], params: SearchParams) -> List[dict]:
+    """
+    rerank() の非同期版です。クロスエンコーダーの推論はスレッドプールで行います。
+    """
+    if not params.rerank or not results:
+        return results
+    return await asyncio.get_running_loop().run_in_executor(None, rerank, query, results, params)
+
+
+def embed_query(query: str) -> List[float]:
+    return get_query_cache().get_or_compute(query, get_embedder().encode_query).tolist()
+
+
+async def encode_async(texts: List[str]) -> np.ndarray:
+    """
+    イベントループを止めずに埋め込みます。
+    マイクロバッチングが有効な場合は待ち行列に入れて結果を待ち、それ以外はスレッドプールで encode します。
+    """
+    embedder = get_embedder()
+    if isinstance(embedder, MicroBatchingEmbedder) and 0 < len(texts) < embedder.max_batch:
+        return await asyncio.wrap_future(embedder.submit(texts))
+    return await asyncio.get_running_loop().run_in_executor(None, embedder.encode, texts)
+
+
+async def embed_query_async(query: str) -> List[float]:
+    cache = get_query_cache()
+    query = cache.normalize(query)
+    vector = cache.get(query)
+    if vector is None:
+        vector = (await encode_async([query]))[0]
+        cache.put(query, vector)
+    return vector.tolist()
+
+
+def search(index_name: str, query: str, params: SearchParams) -> List[dict]:
+    """
+    キャッシュを経由して検索し、description, content, score を含む結果のリストを返します。
+    params.rerank の場合は多めに取得した候補をクロスエンコーダーで採点し直し、各結果に rerank_score を加えます。
+    クエリは正規化（NFKC・空白の統一）してから検索し、キャッシュのキーにも同じ文字列を使います。
+    """
+    query = normalize_query(query)
+    first_stage = _first_stage(params)
+
+    def run_search():
+        query_vector = None
+        profile = None
+        if params.mode != "lexical":
+            query_vector = embed_query(query)
+            if params.num_candidates is None:
+                profile = get_catalog().vector_profiles().get(index_name)
+        with measure(ES_SECONDS, "es.search", {"index": index_name}, operation=params.mode):
+            results = search_index(
+                with_trace_headers(get_client()), index_name, query, query_vector, first_stage, profile
+            )
+        return rerank(query, results, params)
+
+    with measure(SEARCH_SECONDS, "search", {"index": index_name}, mode=params.mode, scope="single"):
+        return get_result_cache().get_or_compute(index_name, (query, params.cache_key()), run_search)
+
+
+async def search_async(index_name: str, query: str, params: SearchParams) -> List[dict]:
+    """
+    search() の非同期版です。
+    """
+    query = normalize_query(query)
+    first_stage = _first_stage(params)
+
+    async def run_search():
+        query_vector = None
+        profile = None
+        if params.mode != "lexical":
+            query_vector = await embed_query_async(query)
+            if params.num_candidates is None:
+                profile = (await get_catalog().vector_profiles_async()).get(index_name)
+        with measure(ES_SECONDS, "es.search", {"index": index_name}, operation=params.mode):
+            results = await search_index_async(
+                with_trace_headers(get_async_client()), index_name, query, query_vector, first_stage, profile
+            )
+        return await rerank_async(query, results, params)
+
+    with measure(SEARCH_SECONDS, "search", {"index": index_name}, mode=params.mode, scope="single"):
+        return await get_result_cache().get_or_compute_async(
+            index_name, (query, params.cache_key()), run_search
+        )
+
+
+async def search_many_async(
+    index_names: Optional[List[str]],
+    query: str,
+    params: SearchParams,
+    per_index: int = 3,
+    normalization: str = "auto"
+) -> dict:
+    """
+    複数のインデックスをまとめて検索します（federated_search_async を参照）。
+    クエリの埋め込みは1回だけ行います。index_names を省略すると、説明 (description) が登録されている
+    全インデックス（説明のあるインデックスがなければ全インデックス）を対象にします。
+    """
+    if not index_names:
+        indices = await list_indices_async()
+        index_names = [entry["index"] for entry in indices if entry["description"]] or [entry["index"] for entry in indices]
+    index_names = sorted(set(index_names))
+    if not index_names:
+        return {"indices": [], "results": [], "errors": {}}
+    query = normalize_query(query)
+    first_stage = _first_stage(params)
+
+    async def run_search():
+        query_vector = None
+        profiles = None
+        if params.mode != "lexical":
+            query_vector = await embed_query_async(query)
+            profiles = await get_catalog().vector_profiles_async()
+        with measure(ES_SECONDS, "es.msearch", {"indices": len(index_names)}, operation="federated"):
+            result = await federated_search_async(
+                with_trace_headers(get_async_client()), index_names, query, query_vector, first_stage, per_index,
+                normalization, profiles
+            )
+        # インデックス間でスコアを揃える必要がなく、全インデックスの候補を同じ基準で並べ直せる
+        return {**result, "results": await rerank_async(query, result["results"], params)}
+
+    # 複数インデックスの結果は、いずれかのインデックスが更新されると無効化される
+    with measure(SEARCH_SECONDS, "search_many", {"indices": len(index_names)}, mode=params.mode, scope="multi"):
+        result = await get_result_cache().get_or_compute_async(
+            ",".join(index_names),
+            (query, params.cache_key(), per_index, normalization),
+            run_search
+        )
+    return {"indices": index_names, **result}
+
+
+def list_indices() -> List[dict]:
+    """
+    インデックス名と説明 (description) の一覧を返します。
+    """
+    return get_catalog().list()
+
+
+async def list_indices_async() -> List[dict]:
+    return await get_catalog().list_async()
+
+
+def warm_up(retry_interval: float = 5.0):
+    """
+    埋め込みモデル（RERANK_DEFAULT が有効な場合は再ランキングのモデルも）を読み込んで1回推論するまで待ちます。
+    失敗した場合（モデルのダウンロード失敗や委譲先の起動待ちなど）は retry_interval 秒ごとに再試行します。
+    """
+    embedder = get_embedder()
+    while True:
+        try:
+            started = time.perf_counter()
+            embedder.warm_up()
+            logger.info("Embedding model warmed up in %.2fs", time.perf_counter() - started)
+            if RERANK_DEFAULT:
+                started = time.perf_counter()
+                get_reranker().warm_up()
+                logger.info("Re-ranking model warmed up in %.2fs", time.perf_counter() - started)
+            return
+        except Exception as e:
+            logger.warning("Embedding warm-up failed, retrying in %.0fs: %s", retry_interval, e)
+            time.sleep(retry_interval)
+
+
+def start_warm_up() -> threading.Thread:
+    """
+    warm_up() をバックグラウンドスレッドで開始します。サーバーはモデルの読み込みを待たずにリクエストを受け付けられます。
+    """
+    thread = threading.Thread(target=warm_up, name="embedding-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def _models_ready() -> bool:
+    # RERANK_DEFAULT が有効な場合は、起動時の warm-up で再ランキングのモデルも読み込むまで ready にしない
+    return get_embedder().ready and (not RERANK_DEFAULT or get_reranker().ready)
+
+
+def readiness() -> dict:
+    """
+    検索を受け付けられる状態か（モデルの warm-up 済み・Elasticsearch に接続可能）を返します。
+    """
+    model_ready = _models_ready()
+    try:
+        es_ready = bool(get_client().options(request_timeout=2, max_retries=0).ping())
+    except Exception:
+        es_ready = False
+    return {"ready": model_ready and es_ready, "model": model_ready, "elasticsearch": es_ready}
+
+
+async def readiness_async() -> dict:
+    model_ready = _models_ready()
+    try:
+        es_ready = bool(await get_async_client().options(request_timeout=2, max_retries=0).ping())
+    except Exception:
+        es_ready = False
+    return {"ready": model_ready and es_ready, "model": model_ready, "elasticsearch": es_ready}
+
+
+def invalidate(index_name: str, catalog: bool = False):
+    """
+    インデックスの検索結果キャッシュを無効化します。
+    インデックスの作成・削除など一覧が変わる場合は catalog=True でカタログも取り直します。
+    """
+    get_result_cache().invalidate(index_name)
+    if catalog:
+        get_catalog().invalidate()
+
+
+def cache_stats() -> dict:
+    # クエリ埋め込みのキャッシュはモデルの設定（小文字化するか）を使って作るため、統計を見るだけではモデルを読み込まない
+    query_cache = _query_cache
+    stats = {
+        "query_embedding": query_cache.stats() if query_cache is not None else {"entries": 0, "hits": 0, "misses": 0},
+        "search_results": get_result_cache().stats()
+    }
+    embedder = get_embedder()
+    if isinstance(embedder, MicroBatchingEmbedder):
+        stats["micro_batching"] = embedder.stats()
+    if _reranker is not None:
+        stats["rerank"] = _reranker.stats()
+    return stats
+
+
+def _cache_metrics():
+    """
+    /metrics に出力するキャッシュ・マイクロバッチの統計（cache_stats() と同じ値）。
+    """
+    stats = cache_stats()
+    caches = [("query_embedding", stats["query_embedding"]), ("search_results", stats["search_results"])]
+    if "rerank" in stats:
+        caches.append(("rerank", stats["rerank"]))
+    families = [
+        ("rag_cache_hits", "counter", "Cache hits.", [({"cache": name}, s["hits"]) for name, s in caches]),
+        ("rag_cache_misses", "counter", "Cache misses.", [({"cache": name}, s["misses"]) for name, s in caches]),
+        ("rag_cache_entries", "gauge", "Entries held in the cache.", [({"cache": name}, s["entries"]) for name, s in caches])
+    ]
+    if "micro_batching" in stats:
+        families.append(("rag_micro_batches", "counter", "Micro-batched encode calls.", [({}, stats["micro_batching"]["batches"])]))
+    return families
+
+
+REGISTRY.add_collector(_cache_metrics)
@@ -0,0 +1,338 @@
+"""
+埋め込みモデルの読み込みと、埋め込み処理の委譲。
+"""
+import copy
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+
+import numpy as np
+
+from retrieval.telemetry import EMBED_BATCH_SIZE, EMBED_SECONDS, measure, trace_headers
+
+DEFAULT_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+logger = logging.getLogger(__name__)
+
+
+class LocalEmbedder:
+    """
+    SentenceTransformer をプロセス内で使う埋め込み器。
+    モデルは最初に使われた時点で読み込みます（import 時には読み込みません）。
+
+    model_path にはエクスポート済みモデルのローカルディレクトリを指定でき、ダウンロードなしで読み込めます。
+    backend に "onnx" / "openvino" を指定すると、model_file（例: "onnx/model_qint8_avx512.onnx"）で
+    量子化済みのモデルファイルを選べます。
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_MODEL_NAME,
+        model_path: Optional[str] = None,
+        backend: str = "torch",
+        model_file: Optional[str] = None
+    ):
+        self.model_name = model_name
+        self.model_path = model_path or model_name
+        self.backend = backend
+        self.model_file = model_file
+        self.ready = False  # 最初の encode が成功したら True
+        self._model = None
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    @property
+    def model_id(self) -> str:
+        """
+        キャッシュのキーに使う識別子。バックエンドや量子化が異なると埋め込みも変わるため区別します。
+        """
+        if self.backend == "torch":
+            return self.model_name
+        return f"{self.model_name}:{self.backend}:{self.model_file or 'default'}"
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    kwargs = {}
+                    if self.backend != "torch":
+                        kwargs["backend"] = self.backend
+                        if self.model_file:
+                            kwargs["model_kwargs"] = {"file_name": self.model_file}
+                    self._model = SentenceTransformer(self.model_path, **kwargs)
+        return self._model
+
+    @property
+    def dim(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    @property
+    def tokenizer(self):
+        """
+        チャンク分割用のトークナイザー。
+        encode と別のスレッドから同時に使えるよう、モデル内部のものをコピーした別のインスタンスを返します。
+        """
+        if self._tokenizer is None:
+            model = self.model
+            with self._lock:
+                if self._tokenizer is None:
+                    self._tokenizer = copy.deepcopy(model.tokenizer)
+        return self._tokenizer
+
+    @property
+    def lowercase(self) -> bool:
+        """
+        トークナイザーが入力を小文字化するか（uncased モデル）。クエリのキャッシュで大文字・小文字を区別するかに使います。
+        """
+        model = self.model
+        # sentence-transformers の Transformer モジュールの設定か、トークナイザー自身の設定で小文字化される
+        module = model[0] if hasattr(model, "__getitem__") else None
+        tokenizer = model.tokenizer
+        return bool(
+            getattr(module, "do_lower_case", False)
+            or getattr(tokenizer, "do_lower_case", False)
+            or getattr(tokenizer, "init_kwargs", {}).get("do_lower_case")
+        )
+
+    @property
+    def max_tokens(self) -> int:
+        """
+        1つのテキストとして切り捨てられずに埋め込めるトークン数（[CLS] などの特殊トークンを除く）。
+        """
+        return self.model.max_seq_length - self.tokenizer.num_special_tokens_to_add()
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: (len(texts), dim) の float32 配列
+        """
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+        EMBED_BATCH_SIZE.observe(len(texts), embedder="local")
+        with measure(EMBED_SECONDS, "embed", {"texts": len(texts)}, embedder="local"):
+            vectors = self.model.encode(
+                texts,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+        self.ready = True
+        return vectors.astype(np.float32, copy=False)
+
+    def encode_query(self, query: str) -> np.ndarray:
+        return self.encode([query])[0]
+
+    def warm_up(self):
+        """
+        モデルを読み込み、1回 encode して初回実行時のコストを済ませます。
+        """
+        self.encode(["warm up"])
+
+
+class RemoteEmbedder:
+    """
+    Indexing API の /embed/ に埋め込みを委譲する埋め込み器。
+    同じホストで MCP サーバーと Indexing API を動かす場合に、モデルをメモリ上に1つだけ持つために使います。
+    uds を指定すると TCP ではなく Unix ドメインソケットで接続します。
+    """
+
+    def __init__(self, base_url: str, uds: Optional[str] = None, timeout: float = 30):
+        import httpx
+
+        transport = httpx.HTTPTransport(uds=uds, retries=2) if uds else httpx.HTTPTransport(retries=2)
+        self._client = httpx.Client(base_url=base_url, transport=transport, timeout=timeout)
+        self._info = None
+        self.ready = False
+
+    def _get_info(self) -> dict:
+        if self._info is None:
+            res = self._client.get("/embed/")
+            res.raise_for_status()
+            self._info = res.json()
+        return self._info
+
+    @property
+    def model_name(self) -> str:
+        return self._get_info()["model"]
+
+    @property
+    def model_id(self) -> str:
+        return self.model_name
+
+    @property
+    def dim(self) -> int:
+        return self._get_info()["dim"]
+
+    @property
+    def lowercase(self) -> bool:
+        return self._get_info().get("lowercase", False)
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+        EMBED_BATCH_SIZE.observe(len(texts), embedder="remote")
+        with measure(EMBED_SECONDS, "embed", {"texts": len(texts)}, embedder="remote"):
+            res = self._client.post("/embed/", json={"texts": texts}, headers=trace_headers())
+            res.raise_for_status()
+        self.ready = True
+        return np.asarray(res.json()["vectors"], dtype=np.float32)
+
+    def encode_query(self, query: str) -> np.ndarray:
+        return self.encode([query])[0]
+
+    def warm_up(self):
+        """
+        委譲先に接続できることを確認します（委譲先のモデルが読み込み済みになるまで待ちます）。
+        """
+        self.encode(["warm up"])
+
+
+class MicroBatchingEmbedder:
+    """
+    同時に届いた少数テキストの encode 要求を、専用のワーカースレッドで1回のバッチにまとめて実行する埋め込み器。
+
+    ワーカーは最初の要求を受け取ってから最大 max_wait_ms ミリ秒、または合計 max_batch 件に達するまで後続の要求を集め、
+    まとめて encode した結果を各呼び出し元の Future に返します。検索クエリのように1件ずつの encode が
+    並行して届く場合に、モデルの呼び出し回数を減らして CPU あたりのスループットを上げます。
+    max_batch 件以上をまとめて渡す呼び出し（取り込み処理など）は既にバッチになっているため、そのまま実行します。
+    それ以外の属性（model_id, dim, ready など）は元の埋め込み器のものを返します。
+    """
+
+    def __init__(self, embedder, max_batch: int = 32, max_wait_ms: float = 2.0):
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0      # 実行したバッチ数
+        self.batched_texts = 0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.embedder, name)
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embedding-micro-batch", daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            requests = [self._queue.get()]
+            size = len(requests[0][0])
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch:
+                try:
+                    # 前のバッチの encode 中に溜まった要求は待たずに取り出す
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    timeout = deadline - time.perf_counter()
+                    if timeout <= 0:
+                        break
+                    try:
+                        request = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                requests.append(request)
+                size += len(request[0])
+
+            texts = [text for request_texts, _ in requests for text in request_texts]
+            try:
+                vectors = self.embedder.encode(texts, batch_size=max(self.max_batch, len(texts)))
+            except Exception as e:
+                logger.warning("Micro-batched encode of %d texts failed: %s", len(texts), e)
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.batched_texts += len(texts)
+            offset = 0
+            for request_texts, future in requests:
+                future.set_result(vectors[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+    def submit(self, texts: List[str]) -> Future:
+        """
+        texts をバッチの待ち行列に入れ、(len(texts), dim) の配列を返す Future を返します。
+        asyncio からは asyncio.wrap_future() で待つと、スレッドを占有せずに結果を受け取れます。
+        """
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((list(texts), future))
+        return future
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        if not texts or len(texts) >= self.max_batch:
+            return self.embedder.encode(texts, batch_size=batch_size)
+        return self.submit(texts).result()
+
+    def encode_query(self, query: str) -> np.ndarray:
+        return self.encode([query])[0]
+
+    def warm_up(self):
+        self.embedder.warm_up()
+
+    def stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "avg_batch_size": self.batched_texts / self.batches if self.batches else 0.0
+        }
+
+
+def with_micro_batching(embedder):
+    """
+    環境変数の設定に応じて、埋め込み器を MicroBatchingEmbedder で包みます。
+
+    EMBED_MICRO_BATCHING:  on（既定）/ off
+    EMBED_MAX_BATCH:       1回のバッチにまとめる最大テキスト数（既定 32）
+    EMBED_MAX_WAIT_MS:     最初の要求から後続の要求を待つ最大時間（ミリ秒、既定 2）。
+                           0 にすると待たずに、前のバッチの実行中に溜まった要求だけをまとめる
+    """
+    if os.getenv("EMBED_MICRO_BATCHING", "on") == "off":
+        return embedder
+    return MicroBatchingEmbedder(
+        embedder,
+        max_batch=int(os.getenv("EMBED_MAX_BATCH", "32")),
+        max_wait_ms=float(os.getenv("EMBED_MAX_WAIT_MS", "2"))
+    )
+
+
+def create_local_embedder() -> LocalEmbedder:
+    """
+    環境変数からプロセス内の埋め込み器を作成します。
+
+    EMBEDDING_MODEL_NAME:  使用するモデル名（既定は all-MiniLM-L6-v2）
+    EMBEDDING_MODEL_PATH:  エクスポート済みモデルのローカルディレクトリ（指定するとダウンロードせずに読み込む）
+    EMBEDDING_BACKEND:     torch（既定）/ onnx / openvino
+    EMBEDDING_MODEL_FILE:  onnx / openvino で使うモデルファイル（量子化版など）
+    """
+    return LocalEmbedder(
+        os.getenv("EMBEDDING_MODEL_NAME", DEFAULT_MODEL_NAME),
+        model_path=os.getenv("EMBEDDING_MODEL_PATH") or None,
+        backend=os.getenv("EMBEDDING_BACKEND", "torch"),
+        model_file=os.getenv("EMBEDDING_MODEL_FILE") or None
+    )
+
+
+def create_embedder(allow_remote: bool = True):
+    """
+    環境変数から埋め込み器を作成します。
+
+    EMBEDDING_SERVER_URL:  指定すると、そのサーバー（Indexing API）に埋め込みを委譲します
+    EMBEDDING_SERVER_UDS:  委譲先に Unix ドメインソケットで接続する場合のソケットパス
+    それ以外は create_local_embedder() の設定でプロセス内にモデルを読み込み、with_micro_batching() で包みます。
+    """
+    url = os.getenv("EMBEDDING_SERVER_URL")
+    uds = os.getenv("EMBEDDING_SERVER_UDS")
+    if allow_remote and (url or uds):
+        return RemoteEmbedder(url or "http://localhost", uds=uds)
+    return with_micro_batching(create_local_embedder())
@@ -0,0 +1,80 @@
+"""
+Elasticsearch クライアントの作成。
+
+SEARCH_BACKEND=local の場合は、Elasticsearch の代わりにプロセス内で動作する retrieval.local_backend のクライアントを返します。
+helpers.streaming_bulk / helpers.scan はクライアントの内部実装に依存するため、呼び出し側はこのモジュールの
+streaming_bulk() / scan() を使ってください。
+"""
+import os
+
+from elasticsearch import AsyncElasticsearch, Elasticsearch, helpers
+
+SEARCH_BACKENDS = ("elasticsearch", "local")
+
+
+def search_backend() -> str:
+    backend = os.getenv("SEARCH_BACKEND", "elasticsearch")
+    if backend not in SEARCH_BACKENDS:
+        raise ValueError(f"SEARCH_BACKEND は {', '.join(SEARCH_BACKENDS)} のいずれかを指定してください。")
+    return backend
+
+
+def _client_options() -> dict:
+    return {
+        "connections_per_node": int(os.getenv("ES_CONNECTIONS_PER_NODE", "20")),
+        "request_timeout": float(os.getenv("ES_REQUEST_TIMEOUT", "30")),
+        "max_retries": int(os.getenv("ES_MAX_RETRIES", "3")),
+        "retry_on_timeout": True
+    }
+
+
+def create_client() -> Elasticsearch:
+    """
+    環境変数から接続プール付きのクライアントを作成します。
+
+    ELASTICSEARCH_ENDPOINT:   接続先
+    ES_CONNECTIONS_PER_NODE:  ノードごとに保持する HTTP 接続数（既定 20）
+    ES_REQUEST_TIMEOUT:       リクエストのタイムアウト秒数（既定 30）
+    ES_MAX_RETRIES:           接続エラー・タイムアウト時の再試行回数（既定 3）
+    """
+    if search_backend() == "local":
+        from retrieval.local_backend import LocalClient
+
+        return LocalClient()
+    return Elasticsearch(os.getenv("ELASTICSEARCH_ENDPOINT"), **_client_options())
+
+
+def create_async_client() -> AsyncElasticsearch:
+    """
+    create_client() と同じ設定で非同期クライアントを作成します。
+    HTTP の実装には httpx を使うため、aiohttp を追加でインストールする必要はありません。
+    """
+    if search_backend() == "local":
+        from retrieval.local_backend import AsyncLocalClient
+
+        return AsyncLocalClient()
+    return AsyncElasticsearch(os.getenv("ELASTICSEARCH_ENDPOINT"), node_class="httpxasync", **_client_options())
+
+
+def _is_local(client) -> bool:
+    from retrieval.local_backend import LocalClient
+
+    return isinstance(client, LocalClient)
+
+
+def streaming_bulk(client, actions, **kwargs):
+    """
+    helpers.streaming_bulk と同じ引数・戻り値で、ローカルのバックエンドにも対応します。
+    """
+    if _is_local(client):
+        return client.streaming_bulk(actions, **kwargs)
+    return helpers.streaming_bulk(client, actions, **kwargs)
+
+
+def scan(client, **kwargs):
+    """
+    helpers.scan と同じ引数・戻り値で、ローカルのバックエンドにも対応します。
+    """
+    if _is_local(client):
+        return client.scan(**kwargs)
+    return helpers.scan(client, **kwargs)
@@ -0,0 +1,1198 @@
+"""
+Elasticsearch の代わりにプロセス内で動作する検索バックエンド (SEARCH_BACKEND=local)。
+
+数千〜数十万チャンク程度の小規模な環境で、Elasticsearch のコンテナを立てずに同じ API を提供するためのものです。
+LocalClient / AsyncLocalClient は、このリポジトリが使っている Elasticsearch クライアントの API（インデックスの作成・
+mapping・_bulk・_search・_msearch・_mget・scroll）だけを実装しているため、Indexing API と MCP サーバーの
+エンドポイントはそのまま動作します。
+
+インデックスごとのデータ:
+- 埋め込みベクトル:  float32 / float16 の行列をファイルに追記し、np.memmap で読み出す
+- メタデータ:       フィールドごとの列。文字列以外と mapping が text でないフィールドは辞書化して int32 のコード列で持つ
+- 全文検索:         text フィールドの転置インデックスによる BM25（LOCAL_BM25=off で無効にしてメモリを節約できる）
+- 永続化:           登録・削除・設定の変更の操作を JSON Lines のログに追記する。ベクトルを先に書き込んで fsync してからログを書くため、
+                    途中でプロセスが落ちても、読み込み時に末尾の不完全な操作を捨てるだけで一貫した状態に戻る
+
+kNN 検索は全件のスコアを NumPy で計算して argpartition で上位 k 件を選ぶ厳密な検索です（num_candidates は使いません）。
+書き込みは1プロセス（Indexing API）だけが行い、他のプロセス（MCP サーバー）は検索のたびにログの追記分を読み込んで追従します。
+削除された行は、削除済みの行が有効な行より多くなった時点で新しい世代のファイルに書き出して詰めます。
+text フィールドへの term / terms は、Elasticsearch と同じく値を解析せずに、解析済みの語と完全一致する行に絞り込みます。
+"""
+import array
+import asyncio
+import fnmatch
+import json
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Elasticsearch の standard analyzer と同様に、漢字・ひらがなは1文字ずつ、それ以外は英数字の連続を1語とする
+_TOKEN = re.compile(r"[぀-ゟ㐀-䶿一-鿿豈-﫿]|[^\W_]+")
+_INDEX_NAME = re.compile(r"^[a-z0-9][a-z0-9_\-.]*$")
+VECTOR_DTYPES = ("float32", "float16")
+COMPACT_MIN_ROWS = 1000  # 削除済みの行がこの数と有効な行数の両方を超えたら詰める
+SCORE_BLOCK_ROWS = 65536  # float16 の行列を float32 に変換しながらスコアを計算する単位
+
+
+def tokenize(text) -> List[str]:
+    return _TOKEN.findall(str(text).lower()) if text else []
+
+
+class LocalBackendError(Exception):
+    """
+    Elasticsearch のエラーレスポンスに相当する例外。ignore に status を指定した呼び出しでは例外の代わりに本文を返します。
+    """
+
+    def __init__(self, status: int, error_type: str, reason: str):
+        super().__init__(f"{error_type}: {reason}")
+        self.status = status
+        self.error = {"type": error_type, "reason": reason}
+
+    def body(self) -> dict:
+        return {"error": self.error, "status": self.status}
+
+
+def _ignorable(func):
+    def wrapper(*args, ignore=None, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except LocalBackendError as e:
+            ignored = ignore if isinstance(ignore, (list, tuple, set)) else [ignore]
+            if e.status in ignored:
+                return e.body()
+            raise
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+class _Growable:
+    """
+    末尾への追加だけを行う NumPy 配列。容量を倍々に確保し、view() で有効な範囲を返します。
+    """
+
+    def __init__(self, dtype, capacity: int = 1024):
+        self._data = np.zeros(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self._data):
+            grown = np.zeros(len(self._data) * 2, dtype=self._data.dtype)
+            grown[:self.size] = self._data
+            self._data = grown
+        self._data[self.size] = value
+        self.size += 1
+
+    def view(self) -> np.ndarray:
+        return self._data[:self.size]
+
+
+class _KeywordColumn:
+    """
+    値を辞書化し、行ごとのコード (int32, 値がなければ -1) で保持する列。完全一致のフィルタをベクトル化して評価できます。
+    """
+
+    def __init__(self, rows: int):
+        self.values = []
+        self._codes_of = {}
+        self.codes = _Growable(np.int32)
+        for _ in range(rows):
+            self.codes.append(-1)
+
+    @staticmethod
+    def _key(value):
+        if isinstance(value, (str, int, float, bool)):
+            return value
+        return json.dumps(value, sort_keys=True, ensure_ascii=False)
+
+    def append(self, value):
+        if value is None:
+            self.codes.append(-1)
+            return
+        key = self._key(value)
+        code = self._codes_of.get(key)
+        if code is None:
+            code = self._codes_of[key] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def get(self, row: int):
+        code = self.codes.view()[row]
+        return None if code < 0 else self.values[code]
+
+    def mask(self, values: list) -> np.ndarray:
+        codes = [self._codes_of[k] for k in map(self._key, values) if k in self._codes_of]
+        return np.isin(self.codes.view(), codes)
+
+
+class _TextColumn:
+    """
+    content のように行ごとに異なる長い文字列を、辞書化せずにそのまま保持する列。
+    """
+
+    def __init__(self, rows: int):
+        self.values = [None] * rows
+
+    def append(self, value):
+        self.values.append(value)
+
+    def get(self, row: int):
+        return self.values[row]
+
+    def mask(self, values: list) -> np.ndarray:
+        wanted = set(values)
+        return np.fromiter((v in wanted for v in self.values), dtype=bool, count=len(self.values))
+
+
+class _InvertedIndex:
+    """
+    1つの text フィールドの転置インデックス。削除された行も統計には残るため、Elasticsearch のセグメントのマージ前と同様に
+    IDF は詰めるまでわずかにずれます。
+    """
+
+    def __init__(self, rows: int):
+        self.postings = {}  # 語 -> (行番号の array, 出現回数の array)
+        self.lengths = _Growable(np.float32)
+        self.total_length = 0.0
+        for _ in range(rows):
+            self.lengths.append(0)
+
+    def add(self, row: int, text):
+        tokens = tokenize(text)
+        for term, tf in Counter(tokens).items():
+            rows, tfs = self.postings.setdefault(term, (array.array("i"), array.array("f")))
+            rows.append(row)
+            tfs.append(tf)
+        self.lengths.append(len(tokens))
+        self.total_length += len(tokens)
+
+    def scores(self, tokens: List[str], n_rows: int, k1: float = 1.2, b: float = 0.75) -> np.ndarray:
+        scores = np.zeros(n_rows, dtype=np.float32)
+        if not n_rows or not self.total_length:
+            return scores
+        lengths = self.lengths.view()
+        avg_length = self.total_length / n_rows
+        for term, query_tf in Counter(tokens).items():
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            rows = np.array(posting[0], dtype=np.int64)
+            tfs = np.array(posting[1], dtype=np.float32)
+            idf = math.log(1 + (n_rows - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = tfs + k1 * (1 - b + b * lengths[rows] / avg_length)
+            scores[rows] += query_tf * idf * tfs * (k1 + 1) / norm
+        return scores
+
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class LocalIndex:
+    def __init__(self, store: "LocalStore", name: str):
+        self.store = store
+        self.name = name
+        self.dir = os.path.join(store.path, name)
+        self._lock = threading.RLock()
+        self._load()
+
+    # --- ファイル ---
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.dir, "index.json")
+
+    @property
+    def _log_path(self) -> str:
+        return os.path.join(self.dir, f"log.{self.meta['local']['generation']}.jsonl")
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.dir, f"vectors.{self.meta['local']['generation']}.bin")
+
+    def _stat_meta(self):
+        try:
+            st = os.stat(self._meta_path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _write_meta(self):
+        tmp = self._meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+            f.flush()
+            if self.store.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp, self._meta_path)
+        if self.store.fsync:
+            _fsync_dir(self.dir)
+        self._signature = self._stat_meta()
+
+    # --- mapping ---
+    @property
+    def mappings(self) -> dict:
+        return self.meta["mappings"]
+
+    @property
+    def dims(self) -> Optional[int]:
+        return self.meta["local"].get("dims")
+
+    @property
+    def vector_field(self) -> str:
+        for name, prop in self.mappings.get("properties", {}).items():
+            if prop.get("type") == "dense_vector":
+                return name
+        return "embedding"
+
+    @property
+    def similarity(self) -> str:
+        return self.mappings.get("properties", {}).get(self.vector_field, {}).get("similarity", "cosine")
+
+    def _row_bytes(self) -> int:
+        return self.dims * np.dtype(self.meta["local"]["dtype"]).itemsize if self.dims else 0
+
+    # --- 読み込み ---
+    def _reset(self):
+        self.rows = 0
+        self.ids = []
+        self.row_of = {}
+        self.alive = _Growable(np.bool_)
+        self.norms = _Growable(np.float32)
+        self.columns = {}
+        self.inverted = {}
+        self._log_offset = 0
+        self._matrix_cache = None
+
+    def _load(self):
+        self._signature = self._stat_meta()
+        if self._signature is None:
+            raise LocalBackendError(404, "index_not_found_exception", f"no such index [{self.name}]")
+        with open(self._meta_path, encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self._reset()
+        self._replay()
+
+    def _replay(self):
+        """
+        ログの未読み込みの部分を適用します。改行で終わっていない行や、対応するベクトルがまだファイルにない行で止めます。
+        """
+        try:
+            with open(self._log_path, "rb") as f:
+                f.seek(self._log_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        row_bytes = self._row_bytes()
+        vector_rows = os.path.getsize(self._vectors_path) // row_bytes if row_bytes and os.path.exists(self._vectors_path) else 0
+        offset = self._log_offset
+        for line in data.split(b"\n")[:-1]:
+            try:
+                op = json.loads(line)
+            except ValueError:
+                break
+            if op["op"] == "index":
+                if row_bytes and self.rows >= vector_rows:
+                    break
+                self._apply_index(op["_id"], op["_source"])
+            elif op["op"] == "settings":
+                self._apply_settings(op["index"])
+            else:
+                self._apply_delete(op["_id"])
+            offset += len(line) + 1
+        self._log_offset = offset
+
+    def sync(self):
+        """
+        他のプロセスによる書き込み（ログの追記・mapping の変更・詰め直し）を取り込みます。
+        """
+        with self._lock:
+            signature = self._stat_meta()
+            if signature is None:
+                raise LocalBackendError(404, "index_not_found_exception", f"no such index [{self.name}]")
+            if signature != self._signature:
+                self._load()
+                return
+            try:
+                size = os.path.getsize(self._log_path)
+            except FileNotFoundError:
+                return
+            if size > self._log_offset:
+                self._replay()
+
+    # --- メモリ上の状態の更新 ---
+    def _column(self, field: str, value):
+        column = self.columns.get(field)
+        if column is None:
+            prop = self.mappings.get("properties", {}).get(field)
+            is_text = prop.get("type") == "text" if prop else isinstance(value, str)
+            column = self.columns[field] = _TextColumn(self.rows) if is_text else _KeywordColumn(self.rows)
+            if is_text and self.store.bm25:
+                self.inverted[field] = _InvertedIndex(self.rows)
+        return column
+
+    def _apply_index(self, doc_id: str, source: dict):
+        old = self.row_of.get(doc_id)
+        if old is not None:
+            self.alive.view()[old] = False
+        row = self.rows
+        self.ids.append(doc_id)
+        self.row_of[doc_id] = row
+        self.alive.append(True)
+        for field, value in source.items():
+            self._column(field, value)
+        for field, column in self.columns.items():
+            column.append(source.get(field))
+        for field, inverted in self.inverted.items():
+            inverted.add(row, source.get(field))
+        self.rows += 1
+        self.norms.append(0.0)  # ベクトルの書き込み後に _set_norms で設定する
+
+    def _apply_settings(self, index_settings: dict):
+        current = self.meta["settings"].setdefault("index", {})
+        for key, value in index_settings.items():
+            # Elasticsearch と同じく、None は設定を消して既定値に戻す
+            if value is None:
+                current.pop(key, None)
+            else:
+                current[key] = value
+
+    def _apply_delete(self, doc_id: str) -> bool:
+        row = self.row_of.pop(doc_id, None)
+        if row is None:
+            return False
+        self.alive.view()[row] = False
+        return True
+
+    def _matrix(self) -> np.ndarray:
+        if not self.dims or not self.rows:
+            return np.zeros((0, self.dims or 0), dtype=np.float32)
+        if self._matrix_cache is None or self._matrix_cache.shape[0] != self.rows:
+            self._matrix_cache = np.memmap(
+                self._vectors_path, dtype=self.meta["local"]["dtype"], mode="r", shape=(self.rows, self.dims)
+            )
+            norms = self.norms.view()
+            stale = np.flatnonzero(norms == 0)
+            if len(stale):
+                norms[stale] = np.linalg.norm(np.asarray(self._matrix_cache[stale], dtype=np.float32), axis=1)
+        return self._matrix_cache
+
+    # --- 書き込み ---
+    def _truncate_torn_tail(self):
+        """
+        書き込みの途中で落ちた場合に残る、ログ末尾の不完全な行と対応する操作のないベクトルを切り詰めます。
+        """
+        for path, size in ((self._log_path, self._log_offset), (self._vectors_path, self.rows * self._row_bytes())):
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def write(self, ops: List[tuple]) -> List[bool]:
+        """
+        ("index", _id, source, vector) / ("delete", _id) / ("settings", index の設定) の操作をまとめて永続化し、適用します。
+        設定の変更もログに追記するため、index.json を書き換えずに済み、他のプロセスは追記分の読み込みで追従します。
+
+        Returns:
+            list: 操作ごとに成功したか（削除対象が存在しない場合は False）
+        """
+        with self._lock:
+            self.sync()
+            self._truncate_torn_tail()
+            vectors = [op[3] for op in ops if op[0] == "index" and op[3] is not None]
+            if vectors and not self.dims:
+                self.meta["local"]["dims"] = len(vectors[0])
+                # 既存の行にベクトルの領域がないため、全行分の領域を持つ新しい世代に書き出してから追記する
+                self._rewrite() if self.rows else self._write_meta()
+            dims = self.dims
+            dtype = self.meta["local"]["dtype"]
+
+            lines = []
+            block = []
+            for op in ops:
+                if op[0] == "index":
+                    _, doc_id, source, vector = op
+                    lines.append(json.dumps({"op": "index", "_id": doc_id, "_source": source}, ensure_ascii=False))
+                    if dims:
+                        vector = np.zeros(dims) if vector is None else np.asarray(vector, dtype=np.float32)
+                        if vector.shape != (dims,):
+                            raise LocalBackendError(
+                                400, "document_parsing_exception",
+                                f"the [{self.vector_field}] field has {vector.shape[0]} dimensions, expected {dims}"
+                            )
+                        block.append(vector)
+                elif op[0] == "settings":
+                    lines.append(json.dumps({"op": "settings", "index": op[1]}, ensure_ascii=False))
+                else:
+                    lines.append(json.dumps({"op": "delete", "_id": op[1]}))
+            if block:
+                with open(self._vectors_path, "ab") as f:
+                    f.write(np.asarray(block, dtype=dtype).tobytes())
+                    f.flush()
+                    if self.store.fsync:
+                        os.fsync(f.fileno())
+            payload = ("\n".join(lines) + "\n").encode("utf-8")
+            with open(self._log_path, "ab") as f:
+                f.write(payload)
+                f.flush()
+                if self.store.fsync:
+                    os.fsync(f.fileno())
+            self._log_offset += len(payload)
+
+            results = []
+            for op in ops:
+                if op[0] == "index":
+                    self._apply_index(op[1], op[2])
+                    results.append(True)
+                elif op[0] == "settings":
+                    self._apply_settings(op[1])
+                    results.append(True)
+                else:
+                    results.append(self._apply_delete(op[1]))
+            self._maybe_compact()
+            return results
+
+    def _maybe_compact(self):
+        live = len(self.row_of)
+        if self.rows - live > max(COMPACT_MIN_ROWS, live):
+            self._rewrite()
+
+    def _rewrite(self):
+        """
+        有効な行だけを新しい世代のファイルに書き出し、index.json の世代を置き換えてから古い世代を削除します。
+        index.json の置き換えが完了するまでは古い世代が有効なため、途中で落ちても整合性は保たれます。
+        """
+        old_log, old_vectors = self._log_path, self._vectors_path
+        live_rows = sorted(self.row_of.values())
+        matrix = self._matrix() if self.dims and os.path.exists(old_vectors) else None
+        generation = self.meta["local"]["generation"] + 1
+        new_log = os.path.join(self.dir, f"log.{generation}.jsonl")
+        new_vectors = os.path.join(self.dir, f"vectors.{generation}.bin")
+        with open(new_log, "wb") as log, open(new_vectors, "wb") as vectors:
+            for row in live_rows:
+                op = {"op": "index", "_id": self.ids[row], "_source": self._source(row, False)}
+                log.write((json.dumps(op, ensure_ascii=False) + "\n").encode("utf-8"))
+                if self.dims:
+                    if matrix is not None and row < matrix.shape[0]:
+                        vectors.write(np.asarray(matrix[row]).tobytes())
+                    else:
+                        vectors.write(np.zeros(self.dims, dtype=self.meta["local"]["dtype"]).tobytes())
+            for f in (log, vectors):
+                f.flush()
+                if self.store.fsync:
+                    os.fsync(f.fileno())
+        self.meta["local"]["generation"] = generation
+        self._write_meta()
+        for path in (old_log, old_vectors):
+            if os.path.exists(path):
+                os.remove(path)
+        self._load()
+
+    # --- 読み出し ---
+    def _source(self, row: int, include_vector: bool = True) -> dict:
+        source = {}
+        for field, column in self.columns.items():
+            value = column.get(row)
+            if value is not None:
+                source[field] = value
+        if include_vector and self.dims:
+            excludes = self.mappings.get("_source", {}).get("excludes", [])
+            if self.vector_field not in excludes:
+                source[self.vector_field] = np.asarray(self._matrix()[row], dtype=np.float32).tolist()
+        return source
+
+    def source(self, row: int, source_opt) -> Optional[dict]:
+        """
+        _source の指定（True / False / フィールド名のリスト / {"includes": [...], "excludes": [...]}）に従って返します。
+        """
+        if source_opt is False:
+            return None
+        includes, excludes = [], []
+        if isinstance(source_opt, str):
+            includes = [source_opt]
+        elif isinstance(source_opt, (list, tuple)):
+            includes = list(source_opt)
+        elif isinstance(source_opt, dict):
+            includes = list(source_opt.get("includes", []))
+            excludes = list(source_opt.get("excludes", []))
+        wants_vector = (
+            not any(fnmatch.fnmatchcase(self.vector_field, p) for p in excludes)
+            and (not includes or any(fnmatch.fnmatchcase(self.vector_field, p) for p in includes))
+        )
+        source = self._source(row, wants_vector)
+        return {
+            k: v for k, v in source.items()
+            if (not includes or any(fnmatch.fnmatchcase(k, p) for p in includes))
+            and not any(fnmatch.fnmatchcase(k, p) for p in excludes)
+        }
+
+    def _mask(self, clause: dict) -> np.ndarray:
+        kind, cond = next(iter(clause.items()))
+        alive = self.alive.view()
+        if kind == "match_all":
+            return alive.copy()
+        if kind == "ids":
+            mask = np.zeros(self.rows, dtype=bool)
+            rows = [self.row_of[i] for i in cond.get("values", []) if i in self.row_of]
+            mask[rows] = True
+            return mask
+        if kind in ("term", "terms"):
+            field, value = next(iter(cond.items()))
+            if kind == "term":
+                values = [value.get("value") if isinstance(value, dict) else value]
+            else:
+                values = list(value)
+            if field == "_id":
+                return self._mask({"ids": {"values": values}})
+            column = self.columns.get(field)
+            if column is None:
+                return np.zeros(self.rows, dtype=bool)
+            if isinstance(column, _TextColumn):
+                # Elasticsearch と同じく、text フィールドの term は値を解析せず、解析済みの語と完全一致する行を返す
+                return self._term_mask(field, values) & alive
+            return column.mask(values) & alive
+        if kind == "bool":
+            mask, _ = self.query(clause)
+            return mask
+        raise LocalBackendError(400, "parsing_exception", f"unsupported query [{kind}] in the local backend")
+
+    def _term_mask(self, field: str, values: list) -> np.ndarray:
+        mask = np.zeros(self.rows, dtype=bool)
+        inverted = self.inverted.get(field)
+        if inverted is not None:
+            for value in values:
+                posting = inverted.postings.get(str(value))
+                if posting is not None:
+                    mask[np.array(posting[0], dtype=np.int64)] = True
+            return mask
+        wanted = {str(value) for value in values}
+        for row, text in enumerate(self.columns[field].values):
+            mask[row] = not wanted.isdisjoint(tokenize(text))
+        return mask
+
+    def query(self, query: Optional[dict]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            tuple: (一致する行のマスク, 行ごとのスコア)
+        """
+        alive = self.alive.view()
+        if not query:
+            return alive.copy(), np.ones(self.rows, dtype=np.float32)
+        kind, cond = next(iter(query.items()))
+        if kind == "multi_match":
+            scores = self._bm25(cond)
+            return alive & (scores > 0), scores
+        if kind != "bool":
+            return self._mask(query), np.ones(self.rows, dtype=np.float32)
+
+        def clauses(key):
+            value = cond.get(key, [])
+            return value if isinstance(value, list) else [value]
+
+        mask = alive.copy()
+        scores = None
+        for clause in clauses("must"):
+            if "multi_match" in clause:
+                clause_scores = self._bm25(clause["multi_match"])
+                scores = clause_scores if scores is None else scores + clause_scores
+                mask &= clause_scores > 0
+            else:
+                mask &= self._mask(clause)
+        for clause in clauses("filter"):
+            mask &= self._mask(clause)
+        for clause in clauses("must_not"):
+            mask &= ~self._mask(clause)
+        return mask, scores if scores is not None else np.ones(self.rows, dtype=np.float32)
+
+    def _bm25(self, multi_match: dict) -> np.ndarray:
+        """
+        multi_match (best_fields) と同様に、フィールドごとの BM25 スコアの最大値を返します。BM25 が無効な場合は全て0です。
+        """
+        tokens = tokenize(multi_match.get("query", ""))
+        scores = np.zeros(self.rows, dtype=np.float32)
+        for field in multi_match.get("fields", list(self.inverted)):
+            inverted = self.inverted.get(field.split("^")[0])
+            if inverted is not None:
+                np.maximum(scores, inverted.scores(tokens, self.rows), out=scores)
+        return scores
+
+    def knn_scores(self, query_vector, filters) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        全行の類似度を Elasticsearch の _score と同じ尺度で計算します。
+
+        Returns:
+            tuple: (対象の行のマスク, スコア)
+        """
+        mask = self.alive.view().copy()
+        for clause in filters if isinstance(filters, list) else [filters] if filters else []:
+            mask &= self._mask(clause)
+        matrix = self._matrix()
+        if not matrix.shape[0]:
+            return np.zeros(self.rows, dtype=bool), np.zeros(self.rows, dtype=np.float32)
+        query = np.asarray(query_vector, dtype=np.float32)
+        if query.shape != (self.dims,):
+            raise LocalBackendError(
+                400, "illegal_argument_exception",
+                f"the query vector has a different number of dimensions [{query.shape[0]}] than the index vectors [{self.dims}]"
+            )
+        dots = np.empty(self.rows, dtype=np.float32)
+        for start in range(0, self.rows, SCORE_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            dots[start:start + len(block)] = block @ query
+        norms = self.norms.view()
+        mask &= norms > 0
+        similarity = self.similarity
+        if similarity == "cosine":
+            scores = (1 + dots / (norms.clip(min=1e-12) * (np.linalg.norm(query) or 1.0))) / 2
+        elif similarity == "dot_product":
+            scores = (1 + dots) / 2
+        elif similarity == "l2_norm":
+            scores = 1 / (1 + np.maximum(norms ** 2 - 2 * dots + float(query @ query), 0))
+        else:  # max_inner_product
+            scores = np.where(dots < 0, 1 / (1 - dots), dots + 1)
+        return mask, scores.astype(np.float32)
+
+
+def top_rows(mask: np.ndarray, scores: np.ndarray, k: Optional[int]) -> List[int]:
+    """
+    mask の行のうちスコアの高い順に k 件（None で全件）の行番号を返します。同点は行番号の順です。
+    """
+    rows = np.flatnonzero(mask)
+    if k is not None and len(rows) > k:
+        if k <= 0:
+            return []
+        picked = np.argpartition(-scores[rows], k - 1)[:k]
+        rows = np.sort(rows[picked])
+    order = np.argsort(-scores[rows], kind="stable")
+    return rows[order].tolist()
+
+
+class LocalStore:
+    """
+    ディレクトリ配下のインデックスの集まり。1つのディレクトリにつき1つのインスタンスを get_store() で共有します。
+
+    LOCAL_INDEX_PATH:     データを保存するディレクトリ（既定 ./local_index）
+    LOCAL_VECTOR_DTYPE:   新しく作るインデックスのベクトルの型 float32 / float16（既定 float32）
+    LOCAL_BM25:           on / off。off では全文検索を行わず、転置インデックスのメモリを使わない（既定 on）
+    LOCAL_FSYNC:          on / off。off では書き込みごとの fsync を省略する（既定 on）
+    """
+
+    def __init__(self, path: str, dtype: str = "float32", bm25: bool = True, fsync: bool = True):
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"LOCAL_VECTOR_DTYPE は {', '.join(VECTOR_DTYPES)} のいずれかを指定してください。")
+        self.path = os.path.abspath(path)
+        self.dtype = dtype
+        self.bm25 = bm25
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._indices = {}
+        self._scrolls = {}  # scroll_id -> 残りのヒット
+        self._pits = {}     # point in time の ID -> [(インデックス名, 作成時点の _id の一覧)]
+        os.makedirs(self.path, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "LocalStore":
+        return cls(
+            os.getenv("LOCAL_INDEX_PATH", "./local_index"),
+            dtype=os.getenv("LOCAL_VECTOR_DTYPE", "float32"),
+            bm25=os.getenv("LOCAL_BM25", "on") != "off",
+            fsync=os.getenv("LOCAL_FSYNC", "on") != "off"
+        )
+
+    def names(self) -> List[str]:
+        return sorted(
+            name for name in os.listdir(self.path)
+            if os.path.isfile(os.path.join(self.path, name, "index.json"))
+        )
+
+    def get(self, name: str) -> LocalIndex:
+        with self._lock:
+            index = self._indices.get(name)
+            if index is None:
+                index = self._indices[name] = LocalIndex(self, name)
+        try:
+            index.sync()
+        except LocalBackendError:
+            with self._lock:
+                self._indices.pop(name, None)
+            raise
+        return index
+
+    def resolve(self, expr, allow_missing: bool = False) -> List[str]:
+        patterns = expr if isinstance(expr, (list, tuple)) else str(expr or "*").split(",")
+        names = self.names()
+        resolved = []
+        for pattern in patterns:
+            if any(c in pattern for c in "*?"):
+                resolved.extend(n for n in names if fnmatch.fnmatchcase(n, pattern) and n not in resolved)
+            elif pattern in names:
+                if pattern not in resolved:
+                    resolved.append(pattern)
+            elif not allow_missing:
+                raise LocalBackendError(404, "index_not_found_exception", f"no such index [{pattern}]")
+        return resolved
+
+    def create(self, name: str, body: Optional[dict] = None):
+        if not _INDEX_NAME.match(name) or name in (".", ".."):
+            raise LocalBackendError(400, "invalid_index_name_exception", f"Invalid index name [{name}]")
+        body = body or {}
+        with self._lock:
+            if name in self.names():
+                raise LocalBackendError(400, "resource_already_exists_exception", f"index [{name}] already exists")
+            mappings = body.get("mappings", {})
+            dims = next(
+                (p.get("dims") for p in mappings.get("properties", {}).values() if p.get("type") == "dense_vector"),
+                None
+            )
+            meta = {
+                "settings": body.get("settings", {}),
+                "mappings": mappings,
+                "local": {"generation": 0, "dims": dims, "dtype": self.dtype}
+            }
+            directory = os.path.join(self.path, name)
+            os.makedirs(directory, exist_ok=True)
+            tmp = os.path.join(directory, "index.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp, os.path.join(directory, "index.json"))
+            self._indices.pop(name, None)
+
+    def delete(self, name: str):
+        import shutil
+
+        with self._lock:
+            if name not in self.names():
+                raise LocalBackendError(404, "index_not_found_exception", f"no such index [{name}]")
+            # 他のプロセスがインデックスの消失を検知できるよう、index.json を最初に消す
+            os.remove(os.path.join(self.path, name, "index.json"))
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            self._indices.pop(name, None)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store() -> LocalStore:
+    """
+    環境変数の設定でストアを開きます。同期・非同期のクライアントが同じプロセス内のデータを共有するために使います。
+    """
+    store = LocalStore.from_env()
+    with _stores_lock:
+        return _stores.setdefault(store.path, store)
+
+
+class _LocalIndicesClient:
+    def __init__(self, store: LocalStore):
+        self._store = store
+
+    @_ignorable
+    def create(self, index: str, body: Optional[dict] = None, settings=None, mappings=None, **kwargs) -> dict:
+        body = dict(body or {})
+        if settings is not None:
+            body["settings"] = settings
+        if mappings is not None:
+            body["mappings"] = mappings
+        self._store.create(index, body)
+        return {"acknowledged": True, "shards_acknowledged": True, "index": index}
+
+    def exists(self, index: str, **kwargs) -> bool:
+        return bool(self._store.resolve(index, allow_missing=True))
+
+    @_ignorable
+    def delete(self, index: str, **kwargs) -> dict:
+        for name in self._store.resolve(index):
+            self._store.delete(name)
+        return {"acknowledged": True}
+
+    @_ignorable
+    def get_mapping(self, index: str = "*", **kwargs) -> dict:
+        return {name: {"mappings": self._store.get(name).mappings} for name in self._store.resolve(index)}
+
+    @_ignorable
+    def get(self, index: str, **kwargs) -> dict:
+        return {
+            name: {"settings": self._store.get(name).meta["settings"], "mappings": self._store.get(name).mappings}
+            for name in self._store.resolve(index)
+        }
+
+    @_ignorable
+    def get_settings(self, index: str = "*", **kwargs) -> dict:
+        return {name: {"settings": self._store.get(name).meta["settings"]} for name in self._store.resolve(index)}
+
+    @_ignorable
+    def put_mapping(self, index: str, properties: Optional[dict] = None, meta: Optional[dict] = None, body=None, **kwargs) -> dict:
+        body = dict(body or {})
+        properties = properties or body.get("properties")
+        meta = meta if meta is not None else body.get("_meta")
+        for name in self._store.resolve(index):
+            target = self._store.get(name)
+            with target._lock:
+                if properties:
+                    target.mappings.setdefault("properties", {}).update(properties)
+                if meta is not None:
+                    target.mappings["_meta"] = meta
+                target._write_meta()
+        return {"acknowledged": True}
+
+    @_ignorable
+    def put_settings(self, index: str, settings: Optional[dict] = None, body=None, **kwargs) -> dict:
+        # refresh_interval などは検索の動作には影響しないが、Elasticsearch と同じく保存して再起動後・他のプロセスからも返す
+        index_settings = (settings or body or {}).get("index", {})
+        for name in self._store.resolve(index):
+            self._store.get(name).write([("settings", index_settings)])
+        return {"acknowledged": True}
+
+    def refresh(self, index: str = "*", ignore_unavailable: bool = False, **kwargs) -> dict:
+        # 書き込みは即座に検索に反映されるため、存在の確認だけを行う
+        names = self._store.resolve(index, allow_missing=ignore_unavailable)
+        return {"_shards": {"total": len(names), "successful": len(names), "failed": 0}}
+
+
+class LocalClient:
+    """
+    Elasticsearch クライアントのうち、このリポジトリが使う API を LocalStore の上で提供します。
+    bulk と scan は retrieval.es の streaming_bulk() / scan() から streaming_bulk() / scan() メソッドが呼ばれます。
+    """
+
+    def __init__(self, store: Optional[LocalStore] = None):
+        self.store = store or get_store()
+        self.indices = _LocalIndicesClient(self.store)
+
+    def options(self, **kwargs) -> "LocalClient":
+        return self
+
+    def ping(self, **kwargs) -> bool:
+        return os.path.isdir(self.store.path)
+
+    def info(self, **kwargs) -> dict:
+        return {"name": "local", "version": {"number": "local"}, "tagline": "in-process backend"}
+
+    def close(self):
+        pass
+
+    # --- 検索 ---
+    @staticmethod
+    def _body(body: Optional[dict], kwargs: dict) -> dict:
+        body = dict(body or {})
+        for key in ("query", "knn", "size", "sort", "search_after", "pit"):
+            if kwargs.get(key) is not None:
+                body[key] = kwargs[key]
+        for key in ("source", "_source"):
+            if kwargs.get(key) is not None:
+                body["_source"] = kwargs[key]
+        if kwargs.get("from_") is not None:
+            body["from"] = kwargs["from_"]
+        return body
+
+    def _hits(self, index_expr, body: dict) -> Tuple[List[dict], int]:
+        """
+        Returns:
+            tuple: (スコアの高い順のヒット（from / size 適用前）, 一致した件数)
+        """
+        size = body.get("size", 10)
+        scored = []  # (スコア, インデックス名の順序, 行番号, インデックス)
+        total = 0
+        for order, name in enumerate(self.store.resolve(index_expr)):
+            index = self.store.get(name)
+            with index._lock:
+                if "knn" in body:
+                    knn = body["knn"]
+                    mask, scores = index.knn_scores(knn["query_vector"], knn.get("filter"))
+                    rows = top_rows(mask, scores, knn.get("k", size))
+                else:
+                    mask, scores = index.query(body.get("query"))
+                    rows = top_rows(mask, scores, None if size is None else size + body.get("from", 0))
+                total += int(mask.sum()) if "knn" not in body else len(rows)
+                scored.extend((float(scores[row]), order, row, index) for row in rows)
+        scored.sort(key=lambda x: (-x[0], x[1], x[2]))
+        if "knn" in body:
+            scored = scored[:body["knn"].get("k", size)]
+        source_opt = body.get("_source", True)
+        hits = []
+        for score, _, row, index in scored:
+            with index._lock:
+                hit = {"_index": index.name, "_id": index.ids[row], "_score": score}
+                source = index.source(row, source_opt)
+            if source is not None:
+                hit["_source"] = source
+            hits.append(hit)
+        return hits, total
+
+    @staticmethod
+    def _response(hits: List[dict], total: int, started: float, shards: int) -> dict:
+        return {
+            "took": int((time.perf_counter() - started) * 1000),
+            "timed_out": False,
+            "_shards": {"total": shards, "successful": shards, "skipped": 0, "failed": 0},
+            "hits": {
+                "total": {"value": total, "relation": "eq"},
+                "max_score": hits[0]["_score"] if hits else None,
+                "hits": hits
+            }
+        }
+
+    def search(self, index="*", body: Optional[dict] = None, scroll: Optional[str] = None, **kwargs) -> dict:
+        started = time.perf_counter()
+        body = self._body(body, kwargs)
+        if "pit" in body:
+            return self._pit_search(body, started)
+        shards = len(self.store.resolve(index))
+        if scroll:
+            # scroll は検索時点の結果を保持し、size 件ずつ返す
+            page = body.get("size", 10)
+            hits, total = self._hits(index, {**body, "size": None})
+            scroll_id = uuid.uuid4().hex
+            with self.store._lock:
+                self.store._scrolls[scroll_id] = (hits[page:], page, total)
+            response = self._response(hits[:page], total, started, shards)
+            response["_scroll_id"] = scroll_id
+            return response
+        hits, total = self._hits(index, body)
+        start = body.get("from", 0)
+        size = body.get("size", 10)
+        return self._response(hits[start:None if size is None else start + size], total, started, shards)
+
+    def scroll(self, scroll_id: str, body: Optional[dict] = None, **kwargs) -> dict:
+        started = time.perf_counter()
+        with self.store._lock:
+            entry = self.store._scrolls.get(scroll_id)
+            if entry is None:
+                raise LocalBackendError(404, "search_context_missing_exception", f"No search context found for id [{scroll_id}]")
+            remaining, page, total = entry
+            self.store._scrolls[scroll_id] = (remaining[page:], page, total)
+        response = self._response(remaining[:page], total, started, 1)
+        response["_scroll_id"] = scroll_id
+        return response
+
+    def clear_scroll(self, scroll_id=None, body=None, **kwargs) -> dict:
+        ids = scroll_id if isinstance(scroll_id, list) else [scroll_id]
+        with self.store._lock:
+            freed = sum(self.store._scrolls.pop(i, None) is not None for i in ids)
+        return {"succeeded": True, "num_freed": freed}
+
+    def open_point_in_time(self, index: str, keep_alive: Optional[str] = None, **kwargs) -> dict:
+        """
+        その時点のドキュメントの _id を記録します。以降の検索は記録した順に返し、後から追加されたドキュメントは含めません。
+        Elasticsearch と異なり、後から削除されたドキュメントは返さず、更新されたドキュメントは更新後の内容を返します。
+        """
+        snapshot = []
+        for name in self.store.resolve(index):
+            target = self.store.get(name)
+            with target._lock:
+                rows = np.flatnonzero(target.alive.view())
+                snapshot.append((name, [target.ids[row] for row in rows]))
+        pit_id = uuid.uuid4().hex
+        with self.store._lock:
+            self.store._pits[pit_id] = snapshot
+        return {"id": pit_id}
+
+    def close_point_in_time(self, id: Optional[str] = None, body: Optional[dict] = None, **kwargs) -> dict:
+        pit_id = id or (body or {}).get("id")
+        with self.store._lock:
+            freed = self.store._pits.pop(pit_id, None) is not None
+        return {"succeeded": True, "num_freed": int(freed)}
+
+    def _pit_search(self, body: dict, started: float) -> dict:
+        """
+        point in time の検索。並び順は _shard_doc（記録した順）のみに対応し、sort の値は記録した一覧での位置です。
+        """
+        pit_id = body["pit"]["id"]
+        with self.store._lock:
+            snapshot = self.store._pits.get(pit_id)
+        if snapshot is None:
+            raise LocalBackendError(404, "search_context_missing_exception", f"No search context found for id [{pit_id}]")
+        after = (body.get("search_after") or [-1])[0]
+        size = body.get("size", 10)
+        source_opt = body.get("_source", True)
+        hits = []
+        position = 0
+        for name, ids in snapshot:
+            if len(hits) >= size:
+                break
+            start = max(0, after + 1 - position)
+            if start >= len(ids):
+                position += len(ids)
+                continue
+            try:
+                target = self.store.get(name)
+            except LocalBackendError:
+                position += len(ids)
+                continue
+            with target._lock:
+                mask, _ = target.query(body.get("query"))
+                for i in range(start, len(ids)):
+                    row = target.row_of.get(ids[i])
+                    if row is None or not mask[row]:
+                        continue
+                    hit = {"_index": name, "_id": ids[i], "_score": None, "sort": [position + i]}
+                    source = target.source(row, source_opt)
+                    if source is not None:
+                        hit["_source"] = source
+                    hits.append(hit)
+                    if len(hits) >= size:
+                        break
+            position += len(ids)
+        response = self._response(hits, len(hits), started, len(snapshot))
+        response["pit_id"] = pit_id
+        return response
+
+    def msearch(self, searches: List[dict] = None, index=None, body=None, **kwargs) -> dict:
+        started = time.perf_counter()
+        searches = searches if searches is not None else body
+        responses = []
+        for header, search_body in zip(searches[0::2], searches[1::2]):
+            try:
+                responses.append({**self.search(index=header.get("index", index) or "*", body=search_body), "status": 200})
+            except LocalBackendError as e:
+                responses.append(e.body())
+        return {"took": int((time.perf_counter() - started) * 1000), "responses": responses}
+
+    def mget(self, docs: List[dict] = None, index=None, body=None, **kwargs) -> dict:
+        docs = docs if docs is not None else (body or {}).get("docs", [])
+        results = []
+        for ref in docs:
+            name = ref.get("_index", index)
+            result = {"_index": name, "_id": ref["_id"], "found": False}
+            try:
+                target = self.store.get(name)
+            except LocalBackendError as e:
+                result = {"_index": name, "_id": ref["_id"], "error": e.error}
+            else:
+                with target._lock:
+                    row = target.row_of.get(ref["_id"])
+                    if row is not None:
+                        result.update(found=True, _source=target.source(row, ref.get("_source", True)))
+            results.append(result)
+        return {"docs": results}
+
+    def delete(self, index: str, id: str, **kwargs) -> dict:
+        found = self.store.get(index).write([("delete", id)])[0]
+        if not found:
+            raise LocalBackendError(404, "not_found", f"[{id}]: document missing")
+        return {"_index": index, "_id": id, "result": "deleted"}
+
+    # --- helpers 相当 ---
+    def _expand(self, action: dict):
+        op = action.get("_op_type", "index")
+        doc_id = action.get("_id")
+        if "_source" in action:
+            source = action["_source"]
+        else:
+            source = {k: v for k, v in action.items() if not k.startswith("_")}
+        if op == "update":
+            source = source.get("doc", source)
+        return op, action.get("_index"), doc_id, source
+
+    def streaming_bulk(
+        self,
+        actions: Iterable[dict],
+        chunk_size: int = 500,
+        raise_on_error: bool = True,
+        raise_on_exception: bool = True,
+        **kwargs
+    ) -> Iterator[Tuple[bool, dict]]:
+        """
+        elasticsearch.helpers.streaming_bulk と同じ形式で、操作ごとに (成功したか, 結果) を返します。
+        """
+        batch = []
+        for action in actions:
+            batch.append(self._expand(action))
+            if len(batch) >= chunk_size:
+                yield from self._bulk_batch(batch, raise_on_error, raise_on_exception)
+                batch = []
+        if batch:
+            yield from self._bulk_batch(batch, raise_on_error, raise_on_exception)
+
+    def _bulk_batch(self, batch: list, raise_on_error: bool, raise_on_exception: bool):
+        results = [None] * len(batch)
+        by_index = {}
+        for i, item in enumerate(batch):
+            by_index.setdefault(item[1], []).append(i)
+        for name, positions in by_index.items():
+            try:
+                if not self.indices.exists(index=name):
+                    self.store.create(name)
+                target = self.store.get(name)
+                ops = []
+                for i in positions:
+                    op, _, doc_id, source = batch[i]
+                    if op == "delete":
+                        ops.append(("delete", doc_id))
+                        continue
+                    doc_id = doc_id or uuid.uuid4().hex
+                    source = dict(source)
+                    if op == "update":
+                        with target._lock:
+                            row = target.row_of.get(doc_id)
+                            current = target.source(row, True) if row is not None else {}
+                        source = {**current, **source}
+                    vector = source.pop(target.vector_field, None)
+                    ops.append(("index", doc_id, source, vector))
+                outcomes = target.write(ops)
+                for i, (kind, doc_id, *_), ok in zip(positions, ops, outcomes):
+                    op = batch[i][0]
+                    if kind == "delete":
+                        status = 200 if ok else 404
+                        result = "deleted" if ok else "not_found"
+                    else:
+                        status, result = 201, "created"
+                    results[i] = (200 <= status < 300, {op: {"_index": name, "_id": doc_id, "status": status, "result": result}})
+            except LocalBackendError as e:
+                if raise_on_exception:
+                    raise
+                for i in positions:
+                    results[i] = (False, {batch[i][0]: {"_index": name, "_id": batch[i][2], "status": e.status, "error": e.error}})
+        if raise_on_error:
+            failed = [item for ok, item in results if not ok]
+            if failed:
+                raise LocalBackendError(400, "bulk_index_error", f"{len(failed)} document(s) failed to index: {failed[:5]}")
+        yield from results
+
+    def scan(self, index="*", query: Optional[dict] = None, _source=None, size: int = 1000, **kwargs) -> Iterator[dict]:
+        """
+        elasticsearch.helpers.scan と同様に、一致する全ドキュメントを返します（query は検索の本文）。
+        """
+        body = dict(query or {})
+        if _source is not None:
+            body["_source"] = _source
+        body["size"] = None
+        hits, _ = self._hits(index, body)
+        yield from hits
+
+
+class _AsyncNamespace:
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        method = getattr(self._target, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+
+class AsyncLocalClient(_AsyncNamespace):
+    """
+    LocalClient の非同期版。検索はスレッドで実行し、イベントループを止めません。
+    """
+
+    def __init__(self, store: Optional[LocalStore] = None):
+        super().__init__(LocalClient(store))
+        self.indices = _AsyncNamespace(self._target.indices)
+
+    def options(self, **kwargs) -> "AsyncLocalClient":
+        return self
+
+    async def close(self):
+        pass
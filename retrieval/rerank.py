@@ -0,0 +1,187 @@
+"""
+クロスエンコーダーによる検索結果の再ランキング。
+
+ベクトル検索・ハイブリッド検索で多めに取得した候補を、クエリとチャンクの組をまとめて入力するクロスエンコーダーで採点し直し、
+上位 top_k 件に絞ります。エージェントが LLM に渡すチャンクを少なく・的確にするためのものです。
+
+CPU の使用量は候補数 (max_candidates) と時間 (time_budget_ms) で制限します。候補は1段目の順位の高いものから
+batch_size 件ずつ採点し、次のバッチを採点すると予算を超えると見込まれた時点で打ち切ります（最初のバッチは必ず採点します）。
+採点できなかった候補は、採点済みの候補の後に1段目の順位のまま並べます。
+採点結果は (正規化したクエリ, チャンク) ごとにキャッシュし、同じ組は採点し直しません。
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from retrieval.cache import normalize_query
+from retrieval.telemetry import RERANK_CANDIDATES, RERANK_SECONDS, span
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+class CrossEncoderReranker:
+    """
+    model_name:       sentence-transformers の CrossEncoder のモデル名またはローカルディレクトリ
+    max_candidates:   1回の再ランキングで採点する候補数の上限（1段目の検索で取得する件数の既定値にもなる）
+    time_budget_ms:   1回の再ランキングでモデルの推論に使う時間の目安（0 で制限なし）
+    batch_size:       1回の推論にまとめるクエリとチャンクの組の数
+    max_length:       クエリとチャンクを合わせたトークン数の上限（超えた部分は切り捨て）
+    cache_size:       採点結果のキャッシュの件数（0 でキャッシュしない）
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_RERANK_MODEL,
+        max_candidates: int = 30,
+        time_budget_ms: float = 200,
+        batch_size: int = 16,
+        max_length: int = 256,
+        cache_size: int = 4096
+    ):
+        if max_candidates < 1:
+            raise ValueError("RERANK_CANDIDATES は1以上を指定してください。")
+        if batch_size < 1:
+            raise ValueError("RERANK_BATCH_SIZE は1以上を指定してください。")
+        self.model_name = model_name
+        self.max_candidates = max_candidates
+        self.time_budget = time_budget_ms / 1000
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self.ready = False
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._scores = OrderedDict()  # (正規化したクエリ, チャンクのハッシュ) -> スコア
+        self.hits = 0
+        self.misses = 0
+        self.truncated = 0  # 時間の予算で採点を打ち切った回数
+
+    @classmethod
+    def from_env(cls) -> "CrossEncoderReranker":
+        """
+        RERANK_MODEL / RERANK_CANDIDATES / RERANK_TIME_BUDGET_MS / RERANK_BATCH_SIZE / RERANK_MAX_LENGTH /
+        RERANK_CACHE_SIZE から設定を読み込みます。
+        """
+        return cls(
+            os.getenv("RERANK_MODEL", DEFAULT_RERANK_MODEL),
+            max_candidates=int(os.getenv("RERANK_CANDIDATES", "30")),
+            time_budget_ms=float(os.getenv("RERANK_TIME_BUDGET_MS", "200")),
+            batch_size=int(os.getenv("RERANK_BATCH_SIZE", "16")),
+            max_length=int(os.getenv("RERANK_MAX_LENGTH", "256")),
+            cache_size=int(os.getenv("RERANK_CACHE_SIZE", "4096"))
+        )
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length)
+        return self._model
+
+    def warm_up(self):
+        self.model.predict([("warm up", "warm up")], show_progress_bar=False)
+        self.ready = True
+
+    @staticmethod
+    def _chunk_key(result: dict) -> str:
+        text = f"{result.get('index', '')}\x00{result.get('description', '')}\x00{result.get('content', '')}"
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _cached(self, query: str, keys: List[str]) -> List[Optional[float]]:
+        scores = []
+        with self._lock:
+            for key in keys:
+                score = self._scores.get((query, key))
+                if score is not None:
+                    self._scores.move_to_end((query, key))
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                scores.append(score)
+        return scores
+
+    def _store(self, query: str, keys: List[str], scores: List[float]):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._scores[(query, key)] = score
+                self._scores.move_to_end((query, key))
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+
+    def rerank(self, query: str, results: List[dict], top_k: int, max_candidates: Optional[int] = None) -> List[dict]:
+        """
+        results（1段目の順位の順）の先頭 max_candidates 件（RERANK_CANDIDATES が上限）を採点し直し、上位 top_k 件を返します。
+        各結果には rerank_score（採点できなかった候補は None）を追加し、score は1段目のスコアのまま残します。
+        """
+        started = time.perf_counter()
+        limit = min(max_candidates or self.max_candidates, self.max_candidates)
+        candidates = results[:limit]
+        query = normalize_query(query)
+        keys = [self._chunk_key(result) for result in candidates]
+        scores = self._cached(query, keys)
+        pending = [i for i, score in enumerate(scores) if score is None]
+
+        scored = 0
+        with span("rerank", candidates=len(candidates), uncached=len(pending)):
+            if pending and not self.ready:
+                # モデルの読み込みと初回の推論は時間の予算に含めない（含めると最初の検索は必ず1バッチで打ち切られる）
+                with span("rerank.warm_up"):
+                    self.warm_up()
+            model = self.model if pending else None
+            model_time = 0.0
+            last_batch = 0.0
+            for start in range(0, len(pending), self.batch_size):
+                if start and self.time_budget > 0 and model_time + last_batch > self.time_budget:
+                    self.truncated += 1
+                    break
+                batch = pending[start:start + self.batch_size]
+                batch_started = time.perf_counter()
+                predicted = model.predict(
+                    [(query, candidates[i].get("content") or "") for i in batch],
+                    batch_size=len(batch),
+                    show_progress_bar=False
+                )
+                last_batch = time.perf_counter() - batch_started
+                model_time += last_batch
+                batch_scores = [float(score) for score in predicted]
+                for i, score in zip(batch, batch_scores):
+                    scores[i] = score
+                self._store(query, [keys[i] for i in batch], batch_scores)
+                scored += len(batch)
+
+        ranked = sorted(
+            (i for i in range(len(candidates)) if scores[i] is not None), key=lambda i: scores[i], reverse=True
+        )
+        ranked += [i for i in range(len(candidates)) if scores[i] is None]
+        RERANK_CANDIDATES.observe(scored)
+        RERANK_SECONDS.observe(time.perf_counter() - started)
+        reranked = [{**candidates[i], "rerank_score": scores[i]} for i in ranked[:top_k]]
+        # top_k が候補数の上限より大きい場合、残りは1段目の順位のまま続ける
+        return reranked + [{**result, "rerank_score": None} for result in results[limit:top_k]]
+
+    def candidate_count(self, top_k: int, requested: Optional[int] = None) -> int:
+        """
+        1段目の検索で取得する件数。requested（省略時は max_candidates）を max_candidates で切り詰め、top_k 以上にします。
+        """
+        return max(top_k, min(requested or self.max_candidates, self.max_candidates))
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "model": self.model_name,
+                "entries": len(self._scores),
+                "max_entries": self.cache_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "truncated": self.truncated
+            }
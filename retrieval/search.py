@@ -0,0 +1,324 @@
+"""
+ベクトル検索・全文検索（BM25）・ハイブリッド検索の実装。
+"""
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from retrieval.vector_index import VectorProfile
+
+SEARCH_MODES = ("hybrid", "vector", "lexical")
+FUSION_METHODS = ("rrf", "weighted")
+NORMALIZATIONS = ("auto", "minmax", "none")
+LEXICAL_FIELDS = ["description", "content"]
+# 検索結果に埋め込みベクトルを含めない（1件あたり次元数分の浮動小数点数を返さずに済む）
+SOURCE_FILTER = {"excludes": ["embedding"]}
+# rerank を指定しない検索でクロスエンコーダーの再ランキングを行うか
+RERANK_DEFAULT = os.getenv("RERANK_DEFAULT", "off") != "off"
+
+
+@dataclass
+class SearchParams:
+    """
+    検索のパラメータ。
+
+    mode:             hybrid (全文検索 + ベクトル検索) / vector / lexical
+    num_candidates:   kNN 検索で各シャードから集める候補数（None でインデックスの格納方式に応じて決める）
+    rank_window_size: ハイブリッド検索で各検索から取得し、統合の対象とする件数
+    fusion:           rrf (Reciprocal Rank Fusion) / weighted (スコアを正規化して重み付き和)
+    rrf_k:            RRF の定数 k
+    filters:          {フィールド名: 値 または 値のリスト} の完全一致フィルタ。keyword のフィールド（doc_id など）だけを指定できる
+    rerank:           多めに取得した候補をクロスエンコーダーで採点し直して top_k 件に絞るか（None で RERANK_DEFAULT）
+    rerank_candidates: 再ランキングする候補数（None で RERANK_CANDIDATES。RERANK_CANDIDATES を超える値は切り詰める）
+    """
+    top_k: int = 3
+    mode: str = "hybrid"
+    num_candidates: Optional[int] = None
+    rank_window_size: int = 50
+    fusion: str = "rrf"
+    rrf_k: int = 60
+    lexical_weight: float = 1.0
+    vector_weight: float = 1.0
+    filters: dict = field(default_factory=dict)
+    rerank: Optional[bool] = None
+    rerank_candidates: Optional[int] = None
+
+    def __post_init__(self):
+        if self.mode not in SEARCH_MODES:
+            raise ValueError(f"mode は {', '.join(SEARCH_MODES)} のいずれかを指定してください。")
+        if self.fusion not in FUSION_METHODS:
+            raise ValueError(f"fusion は {', '.join(FUSION_METHODS)} のいずれかを指定してください。")
+        if not isinstance(self.filters, dict):
+            raise ValueError("filters は {フィールド名: 値} の形式で指定してください。")
+        text_fields = [name for name in self.filters if name in LEXICAL_FIELDS]
+        if text_fields:
+            # text フィールドの term は解析済みの語との一致になり、値全体では一致しないため受け付けない
+            raise ValueError(
+                f"{', '.join(text_fields)} は text フィールドのため filters には指定できません。"
+                "doc_id などの keyword フィールドを指定してください。"
+            )
+        if self.top_k < 1:
+            raise ValueError("top_k は1以上を指定してください。")
+        self.rank_window_size = max(self.rank_window_size, self.top_k)
+        if self.num_candidates is not None and self.num_candidates < 1:
+            raise ValueError("num_candidates は1以上を指定してください。")
+        if self.rerank is None:
+            self.rerank = RERANK_DEFAULT
+        if self.rerank_candidates is not None and self.rerank_candidates < 1:
+            raise ValueError("rerank_candidates は1以上を指定してください。")
+        if not self.rerank:
+            self.rerank_candidates = None
+
+    def cache_key(self) -> str:
+        return json.dumps(asdict(self), sort_keys=True, ensure_ascii=False)
+
+
+def resolve_num_candidates(params: SearchParams, k: int, profile: Optional[VectorProfile] = None) -> int:
+    """
+    kNN 検索の候補数。指定がなければインデックスの格納方式 (profile) の方針で決め、
+    格納方式が分からないインデックスには環境変数の既定の方針を使います。
+    指定された候補数は k（ハイブリッド検索では rank_window_size、それ以外は top_k）を下回らないように引き上げます。
+    """
+    if params.num_candidates is not None:
+        return max(params.num_candidates, k)
+    return (profile or VectorProfile.from_env()).num_candidates(k)
+
+
+def filter_clauses(filters: dict) -> List[dict]:
+    return [
+        {"terms": {name: list(value)}} if isinstance(value, (list, tuple)) else {"term": {name: value}}
+        for name, value in filters.items()
+    ]
+
+
+def lexical_body(query: str, size: int, filters: dict) -> dict:
+    return {
+        "size": size,
+        "_source": SOURCE_FILTER,
+        "query": {
+            "bool": {
+                "must": [{"multi_match": {"query": query, "fields": LEXICAL_FIELDS}}],
+                "filter": filter_clauses(filters),
+                # 旧形式のインデックスにある説明用の _meta_ ドキュメントは検索結果に含めない
+                "must_not": [{"ids": {"values": ["_meta_"]}}]
+            }
+        }
+    }
+
+
+def knn_body(query_vector: List[float], size: int, num_candidates: int, filters: dict) -> dict:
+    knn = {
+        "field": "embedding",
+        "query_vector": query_vector,
+        "k": size,
+        "num_candidates": num_candidates
+    }
+    if filters:
+        knn["filter"] = filter_clauses(filters)
+    return {"size": size, "_source": SOURCE_FILTER, "knn": knn}
+
+
+def format_hits(hits: List[dict], scores: Optional[List[float]] = None) -> List[dict]:
+    return [
+        {
+            "description": hit["_source"].get("description", ""),
+            "content": hit["_source"].get("content", ""),
+            "score": hit["_score"] if scores is None else scores[i]
+        }
+        for i, hit in enumerate(hits)
+    ]
+
+
+def _hit_key(hit: dict) -> tuple:
+    return hit["_index"], hit["_id"]
+
+
+def fuse_rrf(result_lists: List[List[dict]], weights: List[float], rrf_k: int, top_k: int):
+    """
+    各検索結果の順位から RRF スコア sum(w / (k + rank)) を計算し、上位 top_k 件を返します。
+    """
+    scores = {}
+    hits = {}
+    for hits_list, weight in zip(result_lists, weights):
+        for rank, hit in enumerate(hits_list, start=1):
+            key = _hit_key(hit)
+            hits.setdefault(key, hit)
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [hits[key] for key in ranked], [scores[key] for key in ranked]
+
+
+def fuse_weighted(result_lists: List[List[dict]], weights: List[float], top_k: int):
+    """
+    各検索結果のスコアを min-max 正規化し、重み付き和の上位 top_k 件を返します。
+    """
+    scores = {}
+    hits = {}
+    for hits_list, weight in zip(result_lists, weights):
+        if not hits_list:
+            continue
+        raw = [hit["_score"] for hit in hits_list]
+        low, high = min(raw), max(raw)
+        for hit, score in zip(hits_list, raw):
+            key = _hit_key(hit)
+            hits.setdefault(key, hit)
+            normalized = (score - low) / (high - low) if high > low else 1.0
+            scores[key] = scores.get(key, 0.0) + weight * normalized
+    ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [hits[key] for key in ranked], [scores[key] for key in ranked]
+
+
+def _response_hits(response: dict) -> List[dict]:
+    if "error" in response:
+        raise RuntimeError(json.dumps(response["error"], ensure_ascii=False))
+    return response["hits"]["hits"]
+
+
+def _single_body(
+    query: str,
+    query_vector: Optional[List[float]],
+    params: SearchParams,
+    profile: Optional[VectorProfile] = None
+) -> dict:
+    if params.mode == "lexical":
+        return lexical_body(query, params.top_k, params.filters)
+    num_candidates = resolve_num_candidates(params, params.top_k, profile)
+    return knn_body(query_vector, params.top_k, num_candidates, params.filters)
+
+
+def _hybrid_searches(
+    index_name: str,
+    query: str,
+    query_vector: List[float],
+    params: SearchParams,
+    profile: Optional[VectorProfile] = None
+) -> List[dict]:
+    size = params.rank_window_size
+    return [
+        {"index": index_name},
+        lexical_body(query, size, params.filters),
+        {"index": index_name},
+        knn_body(query_vector, size, resolve_num_candidates(params, size, profile), params.filters)
+    ]
+
+
+def _fuse(responses: List[dict], params: SearchParams) -> Tuple[List[dict], List[float]]:
+    result_lists = [_response_hits(response) for response in responses]
+    weights = [params.lexical_weight, params.vector_weight]
+    if params.fusion == "rrf":
+        return fuse_rrf(result_lists, weights, params.rrf_k, params.top_k)
+    return fuse_weighted(result_lists, weights, params.top_k)
+
+
+def search_index(
+    es,
+    index_name: str,
+    query: str,
+    query_vector: Optional[List[float]],
+    params: SearchParams,
+    profile: Optional[VectorProfile] = None
+) -> List[dict]:
+    """
+    params.mode に応じて検索を実行し、description, content, score を含む結果のリストを返します。
+    ハイブリッド検索では全文検索と kNN 検索を1回の _msearch リクエストで実行し、クライアント側で統合します。
+    profile はインデックスの格納方式で、params.num_candidates が指定されていない場合の候補数の決定に使います。
+    """
+    if params.mode != "hybrid":
+        res = es.search(index=index_name, body=_single_body(query, query_vector, params, profile))
+        return format_hits(res["hits"]["hits"])
+    res = es.msearch(searches=_hybrid_searches(index_name, query, query_vector, params, profile))
+    return format_hits(*_fuse(res["responses"], params))
+
+
+async def search_index_async(
+    es,
+    index_name: str,
+    query: str,
+    query_vector: Optional[List[float]],
+    params: SearchParams,
+    profile: Optional[VectorProfile] = None
+) -> List[dict]:
+    """
+    search_index() の AsyncElasticsearch 版です。
+    """
+    if params.mode != "hybrid":
+        res = await es.search(index=index_name, body=_single_body(query, query_vector, params, profile))
+        return format_hits(res["hits"]["hits"])
+    res = await es.msearch(searches=_hybrid_searches(index_name, query, query_vector, params, profile))
+    return format_hits(*_fuse(res["responses"], params))
+
+
+def _minmax(scores: List[float]) -> List[float]:
+    if not scores:
+        return []
+    low, high = min(scores), max(scores)
+    return [(score - low) / (high - low) if high > low else 1.0 for score in scores]
+
+
+async def federated_search_async(
+    es,
+    index_names: List[str],
+    query: str,
+    query_vector: Optional[List[float]],
+    params: SearchParams,
+    per_index: int,
+    normalization: str = "auto",
+    profiles: Optional[Dict[str, VectorProfile]] = None
+) -> dict:
+    """
+    複数のインデックスを1回の _msearch リクエストで検索し、スコアの高い順に統合した上位 params.top_k 件を返します。
+    クエリの埋め込み (query_vector) は全インデックスで共有し、各インデックスからは最大 per_index 件までしか採用しません。
+
+    normalization:
+        minmax: インデックスごとにスコアを 0〜1 に正規化してから統合する
+        none:   スコアをそのまま比較する
+        auto:   lexical (BM25 はインデックスごとの統計に依存し比較できない) では minmax、
+                それ以外（コサイン類似度・RRF はインデックス間で比較できる）では none
+
+    Returns:
+        dict: results (index, description, content, score のリスト) と
+              errors (検索に失敗したインデックス名 -> エラー内容) を含む辞書
+    """
+    if normalization not in NORMALIZATIONS:
+        raise ValueError(f"normalization は {', '.join(NORMALIZATIONS)} のいずれかを指定してください。")
+    if per_index < 1:
+        raise ValueError("per_index は1以上を指定してください。")
+    if normalization == "auto":
+        normalization = "minmax" if params.mode == "lexical" else "none"
+
+    profiles = profiles or {}
+    searches = []
+    for index_name in index_names:
+        profile = profiles.get(index_name)
+        if params.mode == "hybrid":
+            searches.extend(_hybrid_searches(index_name, query, query_vector, params, profile))
+        else:
+            searches.extend([{"index": index_name}, _single_body(query, query_vector, params, profile)])
+    res = await es.msearch(searches=searches)
+
+    per_request = 2 if params.mode == "hybrid" else 1
+    merged = []
+    errors = {}
+    for i, index_name in enumerate(index_names):
+        responses = res["responses"][i * per_request:(i + 1) * per_request]
+        try:
+            if params.mode == "hybrid":
+                hits, scores = _fuse(responses, params)
+            else:
+                hits = _response_hits(responses[0])
+                scores = [hit["_score"] for hit in hits]
+        except RuntimeError as e:
+            errors[index_name] = str(e)
+            continue
+        if normalization == "minmax":
+            scores = _minmax(scores)
+        merged.extend(zip(scores[:per_index], hits[:per_index]))
+
+    merged.sort(key=lambda x: x[0], reverse=True)
+    merged = merged[:params.top_k]
+    results = [
+        {"index": hit["_index"], **formatted}
+        for (_, hit), formatted in zip(merged, format_hits([hit for _, hit in merged], [score for score, _ in merged]))
+    ]
+    return {"results": results, "errors": errors}
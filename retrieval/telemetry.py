@@ -0,0 +1,370 @@
+"""
+Prometheus 形式のメトリクスと、OpenTelemetry による分散トレース（任意）。
+
+メトリクスは prometheus_client を使わずにプロセス内で集計し、各サービスの /metrics で render() の結果を返します。
+トレースは TRACING を設定した場合だけ有効になり、エージェント → MCP サーバー → Elasticsearch の順に trace context を引き継ぎます。
+- エージェント → MCP サーバー: fastmcp がリクエストの _meta に traceparent を入れて送り、サーバー側で取り出す
+- MCP サーバー / Indexing API → Elasticsearch: trace_headers() の traceparent を HTTP ヘッダーに付ける
+  （elasticsearch-py 自身も OpenTelemetry の span を作るため、リクエストごとの span が子として記録される）
+
+TRACING:            off（既定）/ console（標準出力）/ otlp（OTLP で送信。opentelemetry-exporter-otlp が必要）/
+                    memory（プロセス内に保持し finished_spans() で取得。テスト用）
+OTEL_SERVICE_NAME:  トレースに付けるサービス名（省略時は setup_tracing() の引数）
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 秒単位の処理時間のバケット
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 件数（バッチサイズ・チャンク数）のバケット
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} のラベルは {', '.join(self.labelnames) or 'なし'} を指定してください。")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[Tuple[str, List[Tuple[str, str]], float]]:
+        """
+        出力する (サンプル名, ラベル, 値) のリスト。
+        """
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name + "_total", list(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # 各バケットの件数（累積ではない）・合計・件数
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[2] if state else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        samples = []
+        for key, counts, total, count in items:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append((self.name + "_bucket", labels + [("le", _format_value(bound))], cumulative))
+            samples.append((self.name + "_sum", labels, total))
+            samples.append((self.name + "_count", labels, count))
+        return samples
+
+
+class Registry:
+    """
+    メトリクスと、出力時に値を集める collector の集まり。
+    collector は (名前, 型, 説明, [(ラベルの辞書, 値)]) のリストを返す関数で、キャッシュの統計など既存の集計値を出力するのに使います。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"メトリクス {name} は既に {metric.type} として登録されています。")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+    def add_collector(self, collector: Callable[[], Iterable[tuple]]):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        Prometheus のテキスト形式 (version 0.0.4) で出力します。
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                logger.warning("Metrics collector failed: %s", e)
+                continue
+            for name, metric_type, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                sample_name = name + "_total" if metric_type == "counter" else name
+                for labels, value in samples:
+                    lines.append(f"{sample_name}{_format_labels(list(labels.items()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- 各サービスで共通のメトリクス ---
+EMBED_SECONDS = REGISTRY.histogram("rag_embed_seconds", "Time spent in one encode call.", ["embedder"])
+EMBED_BATCH_SIZE = REGISTRY.histogram(
+    "rag_embed_batch_size", "Number of texts passed to one encode call.", ["embedder"], buckets=SIZE_BUCKETS
+)
+ES_SECONDS = REGISTRY.histogram("rag_es_request_seconds", "Time spent in search backend requests.", ["operation"])
+SEARCH_SECONDS = REGISTRY.histogram(
+    "rag_search_seconds", "End-to-end search time including embedding and caches.", ["mode", "scope"]
+)
+INGEST_CHUNKS = REGISTRY.counter("rag_ingest_chunks", "Chunks processed by ingestion.", ["result"])
+INGEST_DOCUMENT_CHUNKS = REGISTRY.histogram(
+    "rag_ingest_document_chunks", "Number of chunks per ingested document.", buckets=SIZE_BUCKETS
+)
+BULK_ACTIONS = REGISTRY.histogram(
+    "rag_bulk_actions", "Number of actions written by one bulk_write call.", buckets=SIZE_BUCKETS
+)
+TOOL_SECONDS = REGISTRY.histogram("rag_mcp_tool_seconds", "MCP tool execution time on the server.", ["tool", "status"])
+AGENT_TOOL_SECONDS = REGISTRY.histogram(
+    "rag_agent_tool_call_seconds", "MCP tool call latency seen by the agent, including the pool.", ["tool", "status"]
+)
+MCP_CONNECT_SECONDS = REGISTRY.histogram("rag_mcp_connect_seconds", "Time to open an MCP client session.")
+RERANK_SECONDS = REGISTRY.histogram("rag_rerank_seconds", "Time spent in one cross-encoder re-ranking call.")
+RERANK_CANDIDATES = REGISTRY.histogram(
+    "rag_rerank_scored_candidates", "Number of candidates scored by the cross-encoder per call.", buckets=SIZE_BUCKETS
+)
+
+
+# --- トレース ---
+_tracer = None
+_memory_exporter = None
+
+
+def setup_tracing(service_name: str) -> bool:
+    """
+    TRACING の設定に従って TracerProvider を設定します。無効な場合や SDK がない場合は何もせず False を返します。
+    """
+    global _tracer, _memory_exporter
+    mode = os.getenv("TRACING", "off")
+    if mode == "off":
+        return False
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SimpleSpanProcessor
+    except ImportError as e:
+        logger.warning("TRACING=%s requires opentelemetry-sdk; tracing is disabled: %s", mode, e)
+        return False
+
+    provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", service_name)}))
+    if mode == "console":
+        provider.add_span_processor(SimpleSpanProcessor(ConsoleSpanExporter()))
+    elif mode == "memory":
+        from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+        _memory_exporter = InMemorySpanExporter()
+        provider.add_span_processor(SimpleSpanProcessor(_memory_exporter))
+    elif mode == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError as e:
+            logger.warning("TRACING=otlp requires opentelemetry-exporter-otlp; tracing is disabled: %s", e)
+            return False
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    else:
+        raise ValueError("TRACING は off / console / otlp / memory のいずれかを指定してください。")
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("retrieval")
+    return True
+
+
+def tracing_enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, **attributes):
+    """
+    トレースが有効な場合は span を開始し、無効な場合は何もしないコンテキストマネージャーを返します。
+    """
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.start_as_current_span(name, attributes={k: v for k, v in attributes.items() if v is not None})
+
+
+@contextmanager
+def server_span(name: str, headers, end_on_exit: bool = True):
+    """
+    受け取った HTTP リクエストのヘッダーから trace context を取り出し、その子として span を開始します。
+    end_on_exit=False の場合、ブロックを正常に抜けても span は終了しないため、呼び出し側で span.end() を呼んでください
+    （ストリーミングのレスポンスで、本文を送り終えるまでを span に含める場合）。トレースが無効な場合は None を返します。
+    """
+    if _tracer is None:
+        yield None
+        return
+    from opentelemetry import propagate, trace
+
+    current = _tracer.start_span(name, context=propagate.extract(dict(headers)), kind=trace.SpanKind.SERVER)
+    try:
+        with trace.use_span(current, end_on_exit=False, record_exception=True, set_status_on_exception=True):
+            yield current
+    except BaseException:
+        current.end()
+        raise
+    if end_on_exit:
+        current.end()
+
+
+@contextmanager
+def measure(histogram: Histogram, span_name: Optional[str] = None, attributes: Optional[dict] = None, **labels):
+    """
+    処理時間を histogram に記録し、span_name を指定した場合は同じ区間の span も作成します。
+    """
+    with span(span_name, **(attributes or {}), **labels) if span_name else nullcontext():
+        with histogram.time(**labels):
+            yield
+
+
+def trace_headers() -> Dict[str, str]:
+    """
+    現在の trace context を HTTP ヘッダー (traceparent / tracestate) として返します。トレースが無効な場合は空です。
+    """
+    if _tracer is None:
+        return {}
+    from opentelemetry import propagate
+
+    headers = {}
+    propagate.inject(headers)
+    return headers
+
+
+def with_trace_headers(client):
+    """
+    Elasticsearch クライアントのリクエストに traceparent を付けます。トレースが無効な場合はそのまま返します。
+    """
+    headers = trace_headers()
+    return client.options(headers=headers) if headers else client
+
+
+def finished_spans() -> list:
+    """
+    TRACING=memory で記録した span の一覧（テスト・ベンチマーク用）。
+    """
+    return list(_memory_exporter.get_finished_spans()) if _memory_exporter is not None else []
+
+
+# --- /metrics を持たないプロセス（エージェント）向けの HTTP サーバー ---
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> Optional[threading.Thread]:
+    """
+    /metrics だけを返す HTTP サーバーをデーモンスレッドで起動します。ポートが使用中の場合は警告を出して None を返します。
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        logger.warning("Could not start metrics server on port %d: %s", port, e)
+        return None
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,109 @@
+"""
+埋め込みベクトルの格納方式（dense_vector の量子化・HNSW のパラメータ・シャード数）と、それに合わせた kNN 検索の候補数。
+
+格納方式はインデックス作成時に mapping の _meta.vector に保存し、検索時に num_candidates を決めるために参照します。
+量子化するほどメモリは減りますが、グラフ探索の近似誤差が大きくなるため、候補数を多めに集めて精度を補います。
+"""
+import os
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+# index_options.type。hnsw は float32 のまま、int8 / int4 はスカラー量子化（1/4, 1/8）、
+# bbq は1次元1ビットの量子化（1/32。Elasticsearch 8.16 以降）
+VECTOR_INDEX_TYPES = ("hnsw", "int8_hnsw", "int4_hnsw", "bbq_hnsw")
+SIMILARITIES = ("cosine", "dot_product", "l2_norm", "max_inner_product")
+
+# 検索時に集める候補数の、取得件数 k に対する倍率
+CANDIDATE_FACTORS = {"hnsw": 2.0, "int8_hnsw": 3.0, "int4_hnsw": 4.0, "bbq_hnsw": 5.0}
+MAX_NUM_CANDIDATES = 10000  # Elasticsearch の上限
+
+
+@dataclass
+class VectorProfile:
+    """
+    embedding フィールドの格納方式。
+
+    index_type:         hnsw / int8_hnsw / int4_hnsw / bbq_hnsw
+    similarity:         cosine / dot_product（単位ベクトルのみ）/ l2_norm / max_inner_product
+    m:                  HNSW の各ノードの接続数。大きいほど精度が上がり、メモリと登録時間が増える
+    ef_construction:    HNSW の構築時に探索する候補数。大きいほど精度が上がり、登録が遅くなる
+    shards:             プライマリシャード数
+    exclude_source:     embedding を _source に保存しない（ディスクを節約するが、reindex でベクトルを引き継げなくなる）
+    candidate_factor:   検索時の num_candidates を k の何倍にするか（None で index_type ごとの既定値）
+    min_candidates:     検索時の num_candidates の下限
+    """
+    index_type: str = "int8_hnsw"
+    similarity: str = "cosine"
+    m: int = 16
+    ef_construction: int = 100
+    shards: int = 1
+    exclude_source: bool = False
+    candidate_factor: Optional[float] = None
+    min_candidates: int = 100
+
+    def __post_init__(self):
+        if self.index_type not in VECTOR_INDEX_TYPES:
+            raise ValueError(f"vector_index_type は {', '.join(VECTOR_INDEX_TYPES)} のいずれかを指定してください。")
+        if self.similarity not in SIMILARITIES:
+            raise ValueError(f"similarity は {', '.join(SIMILARITIES)} のいずれかを指定してください。")
+        if self.m < 2:
+            raise ValueError("m は2以上を指定してください。")
+        if self.ef_construction < self.m:
+            raise ValueError("ef_construction は m 以上を指定してください。")
+        if self.shards < 1:
+            raise ValueError("shards は1以上を指定してください。")
+        if self.candidate_factor is None:
+            self.candidate_factor = CANDIDATE_FACTORS[self.index_type]
+        if self.candidate_factor < 1:
+            raise ValueError("candidate_factor は1以上を指定してください。")
+
+    @classmethod
+    def from_env(cls, **overrides) -> "VectorProfile":
+        """
+        環境変数の設定に、指定された値（None 以外）を上書きした格納方式を返します。
+        """
+        factor = os.getenv("VECTOR_CANDIDATE_FACTOR")
+        values = {
+            "index_type": os.getenv("VECTOR_INDEX_TYPE", "int8_hnsw"),
+            "similarity": os.getenv("VECTOR_SIMILARITY", "cosine"),
+            "m": int(os.getenv("HNSW_M", "16")),
+            "ef_construction": int(os.getenv("HNSW_EF_CONSTRUCTION", "100")),
+            "shards": int(os.getenv("INDEX_SHARDS", "1")),
+            "exclude_source": os.getenv("VECTOR_EXCLUDE_SOURCE", "false").lower() in ("1", "true", "yes"),
+            "candidate_factor": float(factor) if factor else None,
+            "min_candidates": int(os.getenv("VECTOR_MIN_CANDIDATES", "100"))
+        }
+        values.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**values)
+
+    @classmethod
+    def from_meta(cls, meta: Optional[dict]) -> Optional["VectorProfile"]:
+        """
+        mapping の _meta.vector から復元します。保存されていない（この仕組みより前に作成した）インデックスでは None を返します。
+        """
+        if not meta:
+            return None
+        fields = cls.__dataclass_fields__
+        return cls(**{key: value for key, value in meta.items() if key in fields})
+
+    def to_meta(self) -> dict:
+        return asdict(self)
+
+    def field_mapping(self, dims: int) -> dict:
+        if self.index_type == "int4_hnsw" and dims % 2:
+            raise ValueError("int4_hnsw は次元数が偶数のモデルでのみ使用できます。")
+        if self.index_type == "bbq_hnsw" and dims < 64:
+            raise ValueError("bbq_hnsw は64次元以上のモデルでのみ使用できます。")
+        return {
+            "type": "dense_vector",
+            "dims": dims,
+            "index": True,
+            "similarity": self.similarity,
+            "index_options": {"type": self.index_type, "m": self.m, "ef_construction": self.ef_construction}
+        }
+
+    def num_candidates(self, k: int) -> int:
+        """
+        k 件を取得する kNN 検索で、各シャードから集める候補数。
+        """
+        return min(MAX_NUM_CANDIDATES, max(self.min_candidates, k, int(k * self.candidate_factor)))
@@ -0,0 +1,28 @@
+"""
+Indexing API のテスト用の設定。
+
+Elasticsearch とモデルを使わずに実行できるよう、プロセス内の検索バックエンド (SEARCH_BACKEND=local) を一時ディレクトリに作成し、
+埋め込みはベンチマークと同じ HashedEmbedder（モデルを読み込まない埋め込み器）で行います。
+"""
+import os
+import tempfile
+
+import pytest
+
+os.environ.setdefault("API_SEVER_PORT", "0")
+os.environ["MCP_SEVER_URL"] = ""
+os.environ["SEARCH_BACKEND"] = "local"
+os.environ["LOCAL_INDEX_PATH"] = tempfile.mkdtemp(prefix="test_local_index_")
+os.environ["LOCAL_FSYNC"] = "off"
+os.environ["CHUNKING"] = "chars"
+os.environ["EMBEDDING_WARMUP"] = "off"
+
+
+@pytest.fixture(scope="session")
+def server():
+    from benchmarks.suite import HashedEmbedder
+    from indexing import server
+    from retrieval import core
+
+    server.embedder = core.set_embedder(HashedEmbedder())
+    return server
@@ -0,0 +1,36 @@
+import re
+
+import pytest
+
+
+class WhitespaceTokenizer:
+    """
+    空白で区切った単語を1トークンとする、Hugging Face のトークナイザーと同じ呼び出し方のトークナイザー。
+    """
+
+    def __call__(self, texts, **kwargs):
+        return {"offset_mapping": [[m.span() for m in re.finditer(r"\S+", text)] for text in texts]}
+
+
+class TokenizingEmbedder:
+    max_tokens = 128
+    tokenizer = WhitespaceTokenizer()
+
+
+@pytest.fixture
+def token_chunking(server, monkeypatch):
+    monkeypatch.setattr(server, "embedder", TokenizingEmbedder())
+    monkeypatch.setattr(server, "_batch_tokenizer", None)
+    return server
+
+
+def test_small_chunk_tokens_with_default_overlap(token_chunking):
+    text = "one two three. four five six. seven eight nine. ten eleven twelve."
+    chunks = list(token_chunking.make_chunks([text], "tokens", 200, chunk_tokens=8))
+    assert len(chunks) > 1
+    assert all(len(chunk.split()) <= 8 for chunk in chunks)
+
+
+def test_explicit_overlap_must_be_smaller_than_chunk_tokens(token_chunking):
+    with pytest.raises(ValueError):
+        token_chunking.make_chunker("tokens", 200, chunk_tokens=8, overlap_tokens=8)
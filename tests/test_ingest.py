@@ -0,0 +1,71 @@
+import uuid
+
+import pytest
+
+
+def chunk_ids(server, index_name: str, doc_id: str) -> set:
+    return set(server.existing_chunks(index_name, doc_id))
+
+
+@pytest.fixture
+def index_name(server):
+    name = f"test_{uuid.uuid4().hex[:8]}"
+    yield name
+    server.es.indices.delete(index=name, ignore_unavailable=True)
+
+
+def test_failed_write_keeps_stale_chunks(server, index_name, monkeypatch):
+    def index(content: str) -> dict:
+        return server.index_document_chunked(server.DocumentChunkRequest(
+            index_name=index_name, description="manual.txt", doc_id="manual", content=content, chunk_size=10
+        ))
+
+    first = index("aaaaaaaaaabbbbbbbbbb")
+    assert first["indexed"] == 2
+    old = chunk_ids(server, index_name, "manual")
+
+    # 新しいチャンクの書き込みだけを失敗させる
+    streaming_bulk = server.streaming_bulk
+
+    def failing_bulk(client, actions, **kwargs):
+        for action in actions:
+            if "broken" in action.get("_source", {}).get("content", ""):
+                yield False, {"index": {"_id": action["_id"], "status": 400, "error": "mapper_parsing_exception"}}
+            else:
+                yield from streaming_bulk(client, [action], **kwargs)
+
+    monkeypatch.setattr(server, "streaming_bulk", failing_bulk)
+    failed = index("broken....cccccccccc")
+    assert len(failed["errors"]) == 1
+    assert failed["deleted"] == 0
+    assert failed["stale"] == 2
+    assert old <= chunk_ids(server, index_name, "manual")
+
+    # 登録し直して成功すれば、残した古いチャンクは削除される
+    monkeypatch.setattr(server, "streaming_bulk", streaming_bulk)
+    retried = index("broken....cccccccccc")
+    assert retried["errors"] == []
+    assert retried["deleted"] == 2
+    assert not old & chunk_ids(server, index_name, "manual")
+
+
+def test_delete_missing_index_returns_404(server):
+    from fastapi.testclient import TestClient
+
+    res = TestClient(server.app).delete("/delete_index/", params={"index_name": "test_missing"})
+    assert res.status_code == 404
+
+
+def test_ingest_restores_custom_refresh_interval(server, index_name):
+    def refresh_interval():
+        settings = server.es.indices.get_settings(index=index_name)[index_name]["settings"]
+        return settings.get("index", {}).get("refresh_interval")
+
+    server.ensure_index(index_name)
+    server.es.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": "5s"}})
+    with server.refresh_paused(index_name):
+        assert refresh_interval() == "-1"
+        with server.refresh_paused(index_name):
+            pass
+        assert refresh_interval() == "-1"
+    assert refresh_interval() == "5s"
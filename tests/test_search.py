@@ -0,0 +1,9 @@
+import pytest
+
+from retrieval.search import SearchParams
+
+
+def test_filters_reject_text_fields():
+    with pytest.raises(ValueError, match="description"):
+        SearchParams(filters={"description": "manual.txt - chunk 1"})
+    assert SearchParams(filters={"doc_id": "manual.txt"}).filters == {"doc_id": "manual.txt"}
@@ -12,11 +12,20 @@ st.title("RAG Document Indexing UI")
 st.subheader("1. インデックス作成")
 index_name_create = st.text_input("インデックス名を入力", key="index_name_create")
 index_description_create = st.text_input("説明 (description)", key="index_desc_input")
+vector_index_type_create = st.selectbox(
+    "ベクトルの格納方式", ["int8_hnsw", "hnsw", "int4_hnsw", "bbq_hnsw"], key="vector_index_type_create"
+)
+exclude_source_create = st.checkbox("embedding を _source に保存しない", key="exclude_source_create")
 if st.button("Create Index", key="btn_create_index"):
     if index_name_create and index_description_create:
         res = requests.post(
             f"{API_URL}/create_index/",
-            json={"index_name": index_name_create, "description": index_description_create}
+            json={
+                "index_name": index_name_create,
+                "description": index_description_create,
+                "vector_index_type": vector_index_type_create,
+                "exclude_embedding_source": exclude_source_create
+            }
         )
         st.write(res.json())
     else:
@@ -26,9 +35,11 @@ if st.button("Create Index", key="btn_create_index"):
 st.subheader("2. テキストを登録（チャンク化）")
 index_name_text = st.text_input("対象インデックス名 (テキスト用)", key="index_name_text")
 description_text = st.text_input("説明 (description)", key="desc_text_input")
+doc_id_text = st.text_input("文書ID（任意。同じIDで再登録すると変更分だけ更新）", key="doc_id_text")
 content_text = st.text_area("内容", key="content_text")
+chunking_text = st.selectbox("チャンク分割", ["tokens", "chars"], key="chunking_text")
 chunk_size_text = st.number_input(
-    "チャンクサイズ", min_value=50, max_value=1000, value=200, step=50, key="chunk_size_text"
+    "チャンクサイズ（chars の場合の文字数）", min_value=50, max_value=1000, value=200, step=50, key="chunk_size_text"
 )
 if st.button("Index Text", key="btn_index_text"):
     if index_name_text and description_text and content_text:
@@ -36,8 +47,11 @@ if st.button("Index Text", key="btn_index_text"):
             "index_name": index_name_text,
             "description": description_text,
             "content": content_text,
-            "chunk_size": chunk_size_text
+            "chunk_size": chunk_size_text,
+            "chunking": chunking_text
         }
+        if doc_id_text:
+            payload["doc_id"] = doc_id_text
         res = requests.post(f"{API_URL}/index_document_chunked/", json=payload)
         st.write(res.json())
     else:
@@ -47,20 +61,41 @@ if st.button("Index Text", key="btn_index_text"):
 st.subheader("3. ファイルアップロード（txt, docx）")
 index_name_file = st.text_input("対象インデックス名 (ファイル用)", key="index_name_file")
 uploaded_file = st.file_uploader("ファイルを選択", type=["txt", "docx"], key="file_uploader")
+chunking_file = st.selectbox("チャンク分割 (ファイル)", ["tokens", "chars"], key="chunking_file")
 chunk_size_file = st.number_input(
-    "チャンクサイズ (ファイル)", min_value=50, max_value=1000, value=500, step=50, key="chunk_size_file"
+    "チャンクサイズ (ファイル、chars の場合の文字数)", min_value=50, max_value=1000, value=500, step=50, key="chunk_size_file"
 )
 if st.button("Index File", key="btn_index_file"):
     if uploaded_file and index_name_file:
         files = {"file": (uploaded_file.name, uploaded_file.getvalue())}
+        # 同じファイル名で再アップロードすると、変更のあったチャンクだけが登録される
         res = requests.post(
-            f"{API_URL}/index_file/?index_name={index_name_file}&chunk_size={chunk_size_file}",
+            f"{API_URL}/index_file/",
+            params={"index_name": index_name_file, "chunk_size": chunk_size_file, "chunking": chunking_file},
             files=files
         )
         st.write(res.json())
+        if res.status_code == 200:
+            st.session_state["job_id_input"] = res.json().get("job_id", "")
     else:
         st.warning("インデックス名とファイルを指定してください。")
 
+# ファイルの取り込みはバックグラウンドジョブで行われるため、ジョブIDで進捗を確認する
+job_id = st.text_input("ジョブID", key="job_id_input")
+col_status, col_cancel = st.columns(2)
+if col_status.button("Check Job", key="btn_check_job"):
+    if job_id:
+        res = requests.get(f"{API_URL}/jobs/{job_id}")
+        st.write(res.json())
+    else:
+        st.warning("ジョブIDを入力してください。")
+if col_cancel.button("Cancel Job", key="btn_cancel_job"):
+    if job_id:
+        res = requests.delete(f"{API_URL}/jobs/{job_id}")
+        st.write(res.json())
+    else:
+        st.warning("ジョブIDを入力してください。")
+
 # --- 4. 検索 ---
 st.subheader("4. 検索")
 index_name_search = st.text_input("検索対象インデックス", key="index_name_search")
@@ -68,9 +103,10 @@ query_text = st.text_input("検索クエリ", key="query_text")
 top_k = st.number_input(
     "取得件数", min_value=1, max_value=20, value=3, key="top_k"
 )
+search_mode = st.selectbox("検索モード", ["hybrid", "vector", "lexical"], key="search_mode")
 if st.button("Search", key="btn_search"):
     if index_name_search and query_text:
-        params = {"index_name": index_name_search, "query": query_text, "top_k": top_k}
+        params = {"index_name": index_name_search, "query": query_text, "top_k": top_k, "mode": search_mode}
         res = requests.get(f"{API_URL}/search/", params=params)
         if res.status_code == 200:
             results = res.json().get("results", [])